@@ -0,0 +1,709 @@
+"""
+Contains DAO cache implementations.
+
+A cache is configured by putting an instance in the service conf:
+
+    GWS_CONF['CACHE'] = FileCache('/var/cache/resttools', ttl=300)
+
+The DAO asks the cache before every GET (getCache) and hands it every
+response it fetched (processResponse), even a failed one (None), so a
+cache can release any claim it holds on the url.  Writes to a url drop
+its cached copy (deleteCache); the DAO also drops the urls a write
+changes along with it.
+
+A url has one entry, kept with the values of the request headers that
+change the response (_VARY_HEADERS).  A request with other values
+misses, and its response replaces the entry, so deleting the url drops
+every variant.
+"""
+
+import os
+import time
+import math
+import errno
+import bisect
+import random
+import socket
+import struct
+import hashlib
+import tempfile
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+
+from resttools.mock.mock_http import MockHTTP
+
+import logging
+logger = logging.getLogger(__name__)
+
+# request headers that change the response for a url
+_VARY_HEADERS = ('X-UW-Act-as', 'Accept')
+
+
+class NoCache(object):
+    """
+    The cache used when none is configured.
+    """
+    def getCache(self, service, url, headers):
+        return None
+
+    def processResponse(self, service, url, headers, response):
+        pass
+
+    def deleteCache(self, service, url, headers):
+        pass
+
+
+class TimedCache(object):
+    """
+    An in-process cache.  Entries live for ttl seconds and at most
+    max_entries are kept.  Concurrent misses on a url are coalesced: one
+    thread fetches, the others wait for its result.
+
+    policy chooses what is kept when the cache is full:
+        'lru': the least recently used entry is dropped.
+        'tinylfu': a small recency window in front of a main LRU; a new
+            entry leaving the window only replaces the main victim if it
+            has been requested more often (per a frequency sketch), so
+            scans of one-off urls cannot flush the hot entries.
+    """
+
+    def __init__(self, ttl=60, max_entries=10000, statuses=(200,), wait_timeout=10.0, policy='lru'):
+        self._ttl = ttl
+        self._statuses = statuses
+        self._wait_timeout = wait_timeout
+        if policy == 'tinylfu':
+            self._entries = _TinyLFUPolicy(max_entries)
+        else:
+            self._entries = _LRUPolicy(max_entries)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns {'hits', 'misses', 'hit_ratio', 'evictions', 'rejections'}.
+        """
+        lookups = self._hits + self._misses
+        return {'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': float(self._hits) / lookups if lookups else 0.0,
+                'evictions': self._entries.evictions,
+                'rejections': self._entries.rejections}
+
+    def getCache(self, service, url, headers):
+        key = _cache_key(service, url, headers)
+        deadline = time.time() + self._wait_timeout
+        with self._lock:
+            self._entries.record_access(key)
+        while True:
+            with self._lock:
+                record = self._entries.get(key)
+                if _fresh(record, headers):
+                    self._hits += 1
+                    return _response_from_record(record)
+                event = self._inflight.get(key)
+                if event is None or time.time() > deadline:
+                    # this caller fetches
+                    self._misses += 1
+                    self._inflight[key] = threading.Event()
+                    return None
+            event.wait(max(deadline - time.time(), 0))
+
+    def processResponse(self, service, url, headers, response):
+        key = _cache_key(service, url, headers)
+        with self._lock:
+            if response is not None and response.status in self._statuses:
+                self._entries.put(key, _record_from_response(response, self._ttl, headers))
+            event = self._inflight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def deleteCache(self, service, url, headers):
+        with self._lock:
+            self._entries.pop(_cache_key(service, url, headers))
+
+
+class _LRUPolicy(object):
+
+    def __init__(self, max_entries):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self.evictions = 0
+        self.rejections = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def record_access(self, key):
+        pass
+
+    def get(self, key):
+        record = self._entries.pop(key, None)
+        if record is not None:
+            self._entries[key] = record
+        return record
+
+    def put(self, key, record):
+        self._entries.pop(key, None)
+        self._entries[key] = record
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        return self._entries.pop(key, None)
+
+
+class _TinyLFUPolicy(object):
+    """
+    Window TinyLFU: new entries go to a window LRU (1% of the space); an
+    entry pushed out of the window is admitted to the main LRU only if
+    the sketch says it is more frequent than the main LRU's victim.
+    """
+
+    def __init__(self, max_entries):
+        self._window_size = max(1, max_entries // 100)
+        self._main_size = max(1, max_entries - self._window_size)
+        self._window = OrderedDict()
+        self._main = OrderedDict()
+        self._sketch = FrequencySketch(max_entries)
+        self.evictions = 0
+        self.rejections = 0
+
+    def __len__(self):
+        return len(self._window) + len(self._main)
+
+    def record_access(self, key):
+        self._sketch.increment(key)
+
+    def get(self, key):
+        for segment in (self._window, self._main):
+            record = segment.pop(key, None)
+            if record is not None:
+                segment[key] = record
+                return record
+        return None
+
+    def put(self, key, record):
+        if key in self._main:
+            del self._main[key]
+            self._main[key] = record
+            return
+        self._window.pop(key, None)
+        self._window[key] = record
+        if len(self._window) <= self._window_size:
+            return
+
+        candidate, candidate_record = self._window.popitem(last=False)
+        if len(self._main) < self._main_size:
+            self._main[candidate] = candidate_record
+            return
+        victim = next(iter(self._main))
+        if self._sketch.estimate(candidate) > self._sketch.estimate(victim):
+            del self._main[victim]
+            self._main[candidate] = candidate_record
+            self.evictions += 1
+        else:
+            self.rejections += 1
+
+    def pop(self, key):
+        record = self._window.pop(key, None)
+        if record is None:
+            record = self._main.pop(key, None)
+        return record
+
+
+class FrequencySketch(object):
+    """
+    A count-min sketch of recent request frequencies: depth rows of small
+    saturating counters.  After sample_size increments all counters are
+    halved so old popularity fades.
+    """
+    _max_count = 15
+
+    def __init__(self, max_entries, depth=4):
+        width = 1
+        while width < max(max_entries, 16):
+            width *= 2
+        self._mask = width - 1
+        self._depth = depth
+        self._rows = [bytearray(width) for n in range(depth)]
+        self._sample_size = 10 * max(max_entries, 16)
+        self._additions = 0
+
+    def _indexes(self, key):
+        digest = hashlib.md5(key).digest()
+        for row in range(self._depth):
+            yield row, struct.unpack_from('<I', digest, row * 4)[0] & self._mask
+
+    def estimate(self, key):
+        return min(self._rows[row][i] for row, i in self._indexes(key))
+
+    def increment(self, key):
+        added = False
+        for row, i in self._indexes(key):
+            if self._rows[row][i] < self._max_count:
+                self._rows[row][i] += 1
+                added = True
+        if added:
+            self._additions += 1
+            if self._additions >= self._sample_size:
+                self._reset()
+
+    def _reset(self):
+        for counters in self._rows:
+            for i in range(len(counters)):
+                counters[i] >>= 1
+        self._additions //= 2
+
+
+def simulate_trace(cache, trace, service='trace'):
+    """
+    Replays a recorded trace of urls against cache, filling every miss
+    with a stub response, and returns the cache's stats().  Use it to
+    compare policies, e.g. TimedCache(policy='lru') and policy='tinylfu'.
+    """
+    response = MockHTTP()
+    response.status = 200
+    for url in trace:
+        if cache.getCache(service, url, {}) is None:
+            cache.processResponse(service, url, {}, response)
+    return cache.stats()
+
+
+class SharedCache(object):
+    """
+    Base for caches shared by several processes.  With coalesce on, a miss
+    takes a short lease on the url before fetching.  Other processes that
+    miss while the lease is held wait up to wait_timeout for the result
+    instead of fetching it themselves.  A lease older than lease_timeout
+    is considered abandoned.
+
+    Subclasses implement _load, _store, _remove, _add_lease, _get_lease
+    and _remove_lease.
+    """
+    _poll_interval = 0.05
+
+    def __init__(self, ttl=60, statuses=(200,), coalesce=True,
+                 lease_timeout=10.0, wait_timeout=10.0):
+        self._ttl = ttl
+        self._statuses = statuses
+        self._coalesce = coalesce
+        self._lease_timeout = lease_timeout
+        self._wait_timeout = wait_timeout
+        self._local = threading.local()
+
+    def getCache(self, service, url, headers):
+        key = _cache_key(service, url, headers)
+        record = self._load_fresh(key, headers)
+        if record is not None:
+            return _response_from_record(record)
+        if not self._coalesce:
+            return None
+        if self._acquire(key):
+            return self._recheck(key, headers)
+
+        deadline = time.time() + self._wait_timeout
+        while time.time() < deadline:
+            time.sleep(self._poll_interval)
+            record = self._load_fresh(key, headers)
+            if record is not None:
+                return _response_from_record(record)
+            if self._acquire(key):
+                # the holder gave up without a result
+                return self._recheck(key, headers)
+        logger.debug('lease wait timed out for %s' % url)
+        return None
+
+    def processResponse(self, service, url, headers, response):
+        key = _cache_key(service, url, headers)
+        try:
+            if response is not None and response.status in self._statuses:
+                self._store(key, _record_from_response(response, self._ttl, headers), self._ttl)
+        finally:
+            self._release(key)
+
+    def deleteCache(self, service, url, headers):
+        self._remove(_cache_key(service, url, headers))
+
+    def _recheck(self, key, headers):
+        # the previous holder may have stored its result just before
+        # releasing the lease we now hold
+        record = self._load_fresh(key, headers)
+        if record is None:
+            return None
+        self._release(key)
+        return _response_from_record(record)
+
+    def _load_fresh(self, key, headers):
+        record = self._load(key)
+        if _fresh(record, headers):
+            return record
+        return None
+
+    def _acquire(self, key):
+        token = '%s:%d:%d:%d' % (socket.gethostname(), os.getpid(),
+                                 threading.current_thread().ident, random.getrandbits(32))
+        if self._add_lease(key, token, self._lease_timeout):
+            self._held_leases()[key] = token
+            return True
+        return False
+
+    def _release(self, key):
+        token = self._held_leases().pop(key, None)
+        if token is not None and self._get_lease(key) == token:
+            self._remove_lease(key)
+
+    def _held_leases(self):
+        if not hasattr(self._local, 'leases'):
+            self._local.leases = {}
+        return self._local.leases
+
+
+class FileCache(SharedCache):
+    """
+    A cache kept in a directory, shared by all processes on a host.
+    Leases are lock files created exclusively next to the entries.
+    """
+
+    def __init__(self, path, **kwargs):
+        super(FileCache, self).__init__(**kwargs)
+        self._path = path
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _file(self, key):
+        digest = hashlib.sha1(key).hexdigest()
+        return os.path.join(self._path, digest[:2], digest)
+
+    def _load(self, key):
+        try:
+            with open(self._file(key), 'rb') as f:
+                return pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _store(self, key, record, ttl):
+        path = self._file(key)
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        fd, tmp = tempfile.mkstemp(dir=dirname)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+        # readers see either the old or the new entry, never a partial one
+        os.rename(tmp, path)
+
+    def _remove(self, key):
+        try:
+            os.unlink(self._file(key))
+        except OSError:
+            pass
+
+    def _add_lease(self, key, token, timeout):
+        path = self._file(key) + '.lease'
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            try:
+                if os.path.getmtime(path) + timeout > time.time():
+                    return False
+                # abandoned lease
+                os.unlink(path)
+            except OSError:
+                pass
+            return False
+        os.write(fd, token)
+        os.close(fd)
+        return True
+
+    def _get_lease(self, key):
+        try:
+            with open(self._file(key) + '.lease') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def _remove_lease(self, key):
+        try:
+            os.unlink(self._file(key) + '.lease')
+        except OSError:
+            pass
+
+
+class MemcachedCache(SharedCache):
+    """
+    A cache spread over several memcached nodes ('host:port').  Keys are
+    placed with consistent hashing over replicas virtual nodes per node, so
+    adding or losing a node only moves that node's share of the keys.  A
+    node that fails is skipped for retry_interval seconds and its keys go
+    to the next node on the ring.  Keys written or deleted while their
+    node was down are deleted from it when it comes back, so it cannot
+    serve entries that were replaced on the next node while it was away.
+    Leases are memcached 'add's.
+    """
+
+    def __init__(self, nodes, replicas=100, retry_interval=30.0, socket_timeout=1.0, **kwargs):
+        super(MemcachedCache, self).__init__(**kwargs)
+        self._nodes = dict((node, _MemcachedNode(node, socket_timeout)) for node in nodes)
+        self._ring = _HashRing(nodes, replicas)
+        self._retry_interval = retry_interval
+        self._down = {}
+        # {down node: keys written elsewhere while it was down}
+        self._missed = {}
+        self._missed_lock = threading.Lock()
+
+    def node_stats(self):
+        """
+        Returns {node: {'hits', 'misses', 'errors', 'hit_rate'}}.
+        """
+        stats = {}
+        for name, node in self._nodes.items():
+            lookups = node.hits + node.misses
+            stats[name] = {'hits': node.hits,
+                           'misses': node.misses,
+                           'errors': node.errors,
+                           'hit_rate': float(node.hits) / lookups if lookups else 0.0}
+        return stats
+
+    def node_for(self, key):
+        """
+        Returns the live node that holds key, or None if all are down.
+        """
+        now = time.time()
+        for name in self._ring.nodes_for(_node_key(key)):
+            if self._down.get(name, 0) <= now:
+                return self._nodes[name]
+        return None
+
+    def _call(self, key, method, *args):
+        # retry once on the next live node if the first one fails
+        for attempt in range(2):
+            node = self.node_for(key)
+            if node is None:
+                return None
+            try:
+                if node.name in self._down:
+                    self._rejoin(node)
+                if method in ('set', 'delete'):
+                    self._note_missed(node, key, args[0])
+                return getattr(node, method)(*args)
+            except (socket.error, IOError, ValueError) as e:
+                logger.warning('cache node %s failed: %s' % (node.name, e))
+                node.errors += 1
+                node.close()
+                self._down[node.name] = time.time() + self._retry_interval
+        return None
+
+    def _rejoin(self, node):
+        # back after an outage: drop what was replaced while it was away
+        with self._missed_lock:
+            missed = list(self._missed.get(node.name, ()))
+        for node_key in missed:
+            node.delete(node_key)
+        with self._missed_lock:
+            self._missed[node.name] = self._missed.get(node.name, set()) - set(missed)
+            if not self._missed[node.name]:
+                del self._missed[node.name]
+        self._down.pop(node.name, None)
+
+    def _note_missed(self, node, key, node_key):
+        # the down nodes ahead of node on key's ring walk
+        now = time.time()
+        for name in self._ring.nodes_for(_node_key(key)):
+            if name == node.name:
+                return
+            if self._down.get(name, 0) > now:
+                with self._missed_lock:
+                    self._missed.setdefault(name, set()).add(node_key)
+
+    def _load(self, key):
+        data = self._call(key, 'get', _node_key(key))
+        if data is None:
+            return None
+        return pickle.loads(data)
+
+    def _store(self, key, record, ttl):
+        self._call(key, 'set', _node_key(key), pickle.dumps(record, pickle.HIGHEST_PROTOCOL), ttl)
+
+    def _remove(self, key):
+        self._call(key, 'delete', _node_key(key))
+
+    def _add_lease(self, key, token, timeout):
+        return bool(self._call(key, 'add', _node_key(key) + ':lease', token, timeout))
+
+    def _get_lease(self, key):
+        return self._call(key, 'get', _node_key(key) + ':lease', False)
+
+    def _remove_lease(self, key):
+        self._call(key, 'delete', _node_key(key) + ':lease')
+
+
+class _HashRing(object):
+
+    def __init__(self, nodes, replicas):
+        self._points = []
+        self._names = {}
+        self._node_count = len(set(nodes))
+        for node in nodes:
+            for n in range(replicas):
+                point = _hash_point('%s-%d' % (node, n))
+                self._points.append(point)
+                self._names[point] = node
+        self._points.sort()
+
+    def nodes_for(self, key):
+        """
+        Yields the distinct nodes clockwise from key's point on the ring.
+        """
+        if not self._points:
+            return
+        seen = set()
+        start = bisect.bisect(self._points, _hash_point(key))
+        for n in range(len(self._points)):
+            name = self._names[self._points[(start + n) % len(self._points)]]
+            if name not in seen:
+                seen.add(name)
+                yield name
+                if len(seen) == self._node_count:
+                    return
+
+
+class _MemcachedNode(object):
+    """
+    One memcached connection speaking the text protocol.
+    """
+
+    def __init__(self, name, socket_timeout):
+        self.name = name
+        host, port = name.rsplit(':', 1)
+        self._address = (host, int(port))
+        self._timeout = socket_timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, key, count=True):
+        with self._lock:
+            self._send('get %s\r\n' % key)
+            value = None
+            line = self._readline()
+            while line != 'END':
+                parts = line.split()
+                if parts[0] != 'VALUE':
+                    raise ValueError('bad get reply: %s' % line)
+                value = self._file.read(int(parts[3]) + 2)[:-2]
+                line = self._readline()
+        if count:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, data, ttl):
+        return self._store('set', key, data, ttl)
+
+    def add(self, key, data, ttl):
+        return self._store('add', key, data, ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._send('delete %s\r\n' % key)
+            return self._readline() == 'DELETED'
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except socket.error:
+                pass
+        self._sock = None
+        self._file = None
+
+    def _store(self, cmd, key, data, ttl):
+        with self._lock:
+            self._send('%s %s 0 %d %d\r\n%s\r\n' % (cmd, key, int(math.ceil(ttl)), len(data), data))
+            return self._readline() == 'STORED'
+
+    def _send(self, data):
+        if self._sock is None:
+            self._sock = socket.create_connection(self._address, self._timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._file = self._sock.makefile('rb')
+        self._sock.sendall(data)
+
+    def _readline(self):
+        line = self._file.readline()
+        if not line:
+            raise IOError('connection closed')
+        return line.rstrip('\r\n')
+
+
+def _node_key(key):
+    return hashlib.sha1(key).hexdigest()
+
+
+def _hash_point(key):
+    return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+
+def _cache_key(service, url, headers=None):
+    return '%s %s' % (service, url)
+
+
+def _vary(headers):
+    """
+    The values of the _VARY_HEADERS in headers, matched case insensitively.
+    """
+    vary = {}
+    for name, value in (headers or {}).items():
+        for header in _VARY_HEADERS:
+            if name.lower() == header.lower():
+                vary[header] = value
+    return vary
+
+
+def _fresh(record, headers):
+    return (record is not None and record['expires'] > time.time() and
+            record.get('vary', {}) == _vary(headers))
+
+
+def _record_from_response(response, ttl, headers=None):
+    return {'status': response.status,
+            'data': response.data,
+            'headers': dict(response.headers or {}),
+            'vary': _vary(headers),
+            'expires': time.time() + ttl}
+
+
+def _response_from_record(record):
+    response = MockHTTP()
+    response.status = record['status']
+    response.data = record['data']
+    response.headers = dict(record['headers'])
+    return response
@@ -1,5 +1,6 @@
 # resttools implementation for non-django applications
 
+import re
 from resttools.mock.mock_http import MockHTTP
 from resttools.dao_implementation.irws import File as IRWSFile
 from resttools.dao_implementation.irws import Live as IRWSLive
@@ -9,6 +10,14 @@ from resttools.dao_implementation.gws import File as GWSFile
 from resttools.dao_implementation.gws import Live as GWSLive
 from resttools.dao_implementation.ntfyws import File as NTFYWSFile
 from resttools.dao_implementation.ntfyws import Live as NTFYWSLive
+from resttools.dao_implementation.record import get_recorder
+from resttools.cache_implementation import NoCache
+
+# run modes that talk to the real service
+LIVE_MODES = ('Live', 'Record')
+
+# requests with these headers ask the service about its current data
+CONDITIONAL_HEADERS = ('if-none-match', 'if-modified-since')
 
 
 class DAO_BASE(object):
@@ -18,25 +27,65 @@ class DAO_BASE(object):
         self._run_mode = conf['RUN_MODE']
 
     def _getURL(self, service, url, headers):
-        dao = self._getDAO()
-        response = dao.getURL(url, headers)
+        dao = self._getProfiledDAO(service)
+        if any(name.lower() in CONDITIONAL_HEADERS for name in headers or {}):
+            # a cached 200 could be older than the validator it answers
+            return dao.getURL(url, headers)
+
+        cache = self._getCache()
+        response = cache.getCache(service, url, headers)
+        if response is not None:
+            return response
+
+        response = None
+        try:
+            response = dao.getURL(url, headers)
+        finally:
+            cache.processResponse(service, url, headers, response)
         return response
 
     def _postURL(self, service, url, headers, body=None):
-        dao = self._getDAO()
+        dao = self._getProfiledDAO(service)
         response = dao.postURL(url, headers, body)
+        self._invalidate(service, url, headers)
         return response
 
     def _deleteURL(self, service, url, headers):
-        dao = self._getDAO()
+        dao = self._getProfiledDAO(service)
         response = dao.deleteURL(url, headers)
+        self._invalidate(service, url, headers)
         return response
 
     def _putURL(self, service, url, headers, body=None):
-        dao = self._getDAO()
+        dao = self._getProfiledDAO(service)
         response = dao.putURL(url, headers, body)
+        self._invalidate(service, url, headers)
         return response
 
+    def _invalidate(self, service, url, headers):
+        cache = self._getCache()
+        for related in [url] + self._relatedURLs(url):
+            cache.deleteCache(service, related, headers)
+
+    def _relatedURLs(self, url):
+        """
+        Other urls whose responses a write to url changes.
+        """
+        return []
+
+    def _getProfiledDAO(self, service):
+        dao = self._getDAO()
+        if self._run_mode == 'Record':
+            dao = get_recorder(self._conf).wrap(service, dao)
+        elif self._run_mode not in LIVE_MODES and self._conf.get('MOCK_PROFILE') is not None:
+            dao = self._conf['MOCK_PROFILE'].wrap(dao)
+        return dao
+
+    def _getCache(self):
+        if self._conf.get('CACHE') is not None:
+            return self._conf['CACHE']
+        return NoCache()
+
 
 class IRWS_DAO(DAO_BASE):
     def getURL(self, url, headers):
@@ -46,7 +95,7 @@ class IRWS_DAO(DAO_BASE):
         return self._putURL('irws', url, headers, body)
 
     def _getDAO(self):
-        if self._run_mode == 'Live':
+        if self._run_mode in LIVE_MODES:
             return IRWSLive(self._conf)
         return IRWSFile(self._conf)
 
@@ -59,23 +108,40 @@ class NWS_DAO(DAO_BASE):
         return self._postURL('nws', url, headers, body)
 
     def _getDAO(self):
-        if self._run_mode == 'Live':
+        if self._run_mode in LIVE_MODES:
             return NWSLive(self._conf)
         return NWSFile(self._conf)
 
 
+# a group, or something under it (member, member/<name>, ...)
+_GWS_GROUP_URL = re.compile(r'^(/group_sws/v2/group/[^/?]+)(?:/(member|effective_member)(?:/([^/?]+))?)?')
+
+
 class GWS_DAO(DAO_BASE):
+    def _relatedURLs(self, url):
+        # a write to a group changes the group and its member views;
+        # groups that include it as a member catch up within the cache ttl
+        m = _GWS_GROUP_URL.match(url)
+        if m is None:
+            return []
+        group = m.group(1)
+        urls = [group, group + '/member', group + '/effective_member',
+                group + '/effective_member?view=count']
+        if m.group(3):
+            urls += [group + '/member/' + m.group(3), group + '/effective_member/' + m.group(3)]
+        return [u for u in urls if u != url]
+
     def getURL(self, url, headers):
         return self._getURL('gws', url, headers)
 
     def putURL(self, url, headers, body):
         return self._putURL('gws', url, headers, body)
 
-    def deleteURL(self, url, headers, body):
-        return self._deleteURL('gws', url, headers, body)
+    def deleteURL(self, url, headers):
+        return self._deleteURL('gws', url, headers)
 
     def _getDAO(self):
-        if self._run_mode == 'Live':
+        if self._run_mode in LIVE_MODES:
             return GWSLive(self._conf)
         return GWSFile(self._conf)
 
@@ -85,6 +151,6 @@ class NTFYWS_DAO(DAO_BASE):
         return self._postURL('ntfyws', url, headers, body)
 
     def _getDAO(self):
-        if self._run_mode == 'Live':
+        if self._run_mode in LIVE_MODES:
             return NTFYWSLive(self._conf)
         return NTFYWSFile(self._conf)
@@ -0,0 +1,186 @@
+"""
+Latency and fault injection for the File DAOs.
+
+File mode answers at once and never fails, so timeouts, retries and
+caching are never exercised.  A FaultProfile in a service's conf makes
+its File DAO behave more like the real service:
+
+    GWS_CONF['MOCK_PROFILE'] = FaultProfile(
+        latency={'dist': 'longtail', 'median': 0.05, 'sigma': 1.0},
+        errors={503: 0.01},
+        reset_rate=0.001,
+        trickle={'chunk_size': 16384, 'delay': 0.002},
+        urls=[(r'/effective_member', {'latency': {'dist': 'fixed', 'value': 0.5}})],
+        seed=1)
+
+latency is one of
+    {'dist': 'fixed', 'value': seconds}
+    {'dist': 'normal', 'mean': seconds, 'stddev': seconds}
+    {'dist': 'longtail', 'median': seconds, 'sigma': spread, 'max': seconds}
+      (lognormal)
+errors maps an HTTP status to the fraction of requests that get it.
+reset_rate is the fraction of requests that fail with a connection reset.
+trickle delivers the body chunk_size bytes at a time, delay seconds
+  apart: in process when the body is first read, and on the wire when
+  a MockServer with the profile sends it.
+urls is a list of (regex, settings) overriding the settings above for
+matching urls, first match wins; settings may name 'methods'.
+
+With a seed the same sequence of requests sees the same faults.
+"""
+
+import re
+import time
+import errno
+import socket
+import random
+import threading
+
+from urllib3.exceptions import ProtocolError
+
+from resttools.mock.mock_http import MockHTTP
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class FaultProfile(object):
+
+    def __init__(self, latency=None, errors=None, reset_rate=0.0, trickle=None,
+                 urls=None, seed=None, sleep=time.sleep):
+        self._default = {'latency': latency,
+                         'errors': errors or {},
+                         'reset_rate': reset_rate,
+                         'trickle': trickle,
+                         'methods': None}
+        self._urls = []
+        for pattern, settings in (urls or []):
+            rule = dict(self._default)
+            rule.update(settings)
+            self._urls.append((re.compile(pattern), rule))
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sleep = sleep
+
+    def wrap(self, dao):
+        """
+        Returns dao with the profile applied to its requests.
+        """
+        return _ProfiledDAO(dao, self)
+
+    def rule_for(self, method, url):
+        for pattern, rule in self._urls:
+            if pattern.search(url) and (not rule['methods'] or method in rule['methods']):
+                return rule
+        return self._default
+
+    def apply(self, method, url, request):
+        """
+        Performs request() as the profile says: waits, fails or trickles.
+        """
+        rule = self.rule_for(method, url)
+        with self._lock:
+            delay = self._latency(rule['latency'])
+            reset = self._random.random() < rule['reset_rate']
+            status = self._error(rule['errors'])
+
+        if delay > 0:
+            self._sleep(delay)
+        if reset:
+            logger.debug('injected connection reset: %s %s' % (method, url))
+            raise ProtocolError('Connection aborted.',
+                                socket.error(errno.ECONNRESET, 'Connection reset by peer'))
+        if status is not None:
+            logger.debug('injected %d: %s %s' % (status, method, url))
+            response = MockHTTP()
+            response.status = status
+            response.data = 'injected fault: %d' % status
+            response.headers = {'X-Data-Source': 'fault profile'}
+            return response
+
+        response = request()
+        trickle = rule['trickle']
+        if trickle:
+            response = TrickleMockHTTP(response, trickle.get('chunk_size', 8192),
+                                       trickle.get('delay', 0.001), self._sleep)
+        return response
+
+    def _latency(self, latency):
+        if not latency:
+            return 0.0
+        dist = latency.get('dist', 'fixed')
+        if dist == 'fixed':
+            return latency.get('value', 0.0)
+        if dist == 'normal':
+            return max(0.0, self._random.gauss(latency.get('mean', 0.0), latency.get('stddev', 0.0)))
+        if dist == 'longtail':
+            delay = latency.get('median', 0.0) * self._random.lognormvariate(0.0, latency.get('sigma', 1.0))
+            if 'max' in latency:
+                delay = min(delay, latency['max'])
+            return delay
+        raise ValueError('unknown latency distribution: %s' % dist)
+
+    def _error(self, errors):
+        if not errors:
+            return None
+        pick = self._random.random()
+        for status in sorted(errors):
+            pick -= errors[status]
+            if pick < 0:
+                return status
+        return None
+
+
+class TrickleMockHTTP(MockHTTP):
+    """
+    A response whose body arrives chunk_size bytes at a time, with a
+    delay before each chunk.  iter_chunks yields the chunks as they
+    arrive; data waits for all of them, once.
+    """
+
+    def __init__(self, response, chunk_size, delay, sleep=time.sleep):
+        self.status = response.status
+        self.headers = response.headers
+        self._body = response.data or ''
+        self.length = len(self._body)
+        self._chunk_size = chunk_size
+        self._delay = delay
+        self._sleep = sleep
+        self._data = None
+
+    def iter_chunks(self):
+        for offset in range(0, len(self._body), self._chunk_size):
+            self._sleep(self._delay)
+            yield self._body[offset:offset + self._chunk_size]
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = ''.join(self.iter_chunks())
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    def buffer(self):
+        return self.data
+
+
+class _ProfiledDAO(object):
+
+    def __init__(self, dao, profile):
+        self._dao = dao
+        self._profile = profile
+
+    def getURL(self, url, headers):
+        return self._profile.apply('GET', url, lambda: self._dao.getURL(url, headers))
+
+    def putURL(self, url, headers, body):
+        return self._profile.apply('PUT', url, lambda: self._dao.putURL(url, headers, body))
+
+    def postURL(self, url, headers, body):
+        return self._profile.apply('POST', url, lambda: self._dao.postURL(url, headers, body))
+
+    def deleteURL(self, url, headers):
+        return self._profile.apply('DELETE', url, lambda: self._dao.deleteURL(url, headers))
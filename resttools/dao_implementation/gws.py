@@ -3,7 +3,20 @@ Contains GWS DAO implementations.
 """
 from resttools.mock.mock_http import MockHTTP
 from resttools.dao_implementation.live import get_con_pool, get_live_url
-from resttools.dao_implementation.mock import get_mockdata_url
+from resttools.dao_implementation.mock import get_mockdata_url, put_mockdata_url, delete_mockdata_url
+from resttools.dao_implementation.mock import get_mock_store, _header
+from urllib import unquote
+from lxml import etree
+import re
+import threading
+
+# a group, its member list, one member of a group
+GROUP_URL = re.compile(r'^/group_sws/v2/group/([^/?]+)$')
+MEMBERS_URL = re.compile(r'^/group_sws/v2/group/([^/?]+)/member$')
+MEMBER_URL = re.compile(r'^(/group_sws/v2/group/[^/]+/member)/([^/?]+)$')
+
+# member list updates from per-member writes are read-modify-write
+_members_lock = threading.Lock()
 
 
 class File(object):
@@ -24,27 +37,55 @@ class File(object):
         return get_mockdata_url("gws", self._conf, url, headers)
 
     def putURL(self, url, headers, body):
-        response = MockHTTP()
-
-        if body is not None:
-            if "If-Match" in headers:
-                response.status = 200  # update
-            else:
-                response.status = 201  # create
-            response.headers = {"X-Data-Source": "GWS file mock data",
-                                "Content-Type": headers["Content-Type"]}
-            response.data = body
-        else:
-            response.status = 400
-            response.data = "Bad Request: no POST body"
-
+        # store what a GET of the url returns, not the request document
+        if body is not None and (GROUP_URL.match(url) or MEMBERS_URL.match(url)):
+            if not isinstance(body, basestring):
+                body = ''.join(body)
+            body = _as_get_document(url, body)
+        members = MEMBERS_URL.match(url) is not None
+        if members and (_header(headers, 'If-Match') or '').strip() == '*':
+            # a group always has a member list, stored or not
+            headers = dict((k, v) for k, v in headers.items() if k.lower() != 'if-match')
+        response = put_mockdata_url("gws", self._conf, url, headers, body)
+        if members and response.status == 201:
+            # ... so putting one replaces it
+            response.status = 200
+        m = MEMBER_URL.match(url)
+        if m is not None and response.status in (200, 201):
+            name = unquote(m.group(2))
+            self._update_members(m.group(1), name, 'eppn' if '@' in name else 'uwnetid')
         return response
 
     def deleteURL(self, url, headers):
-        response = MockHTTP()
-        response.status = 200
+        response = delete_mockdata_url("gws", self._conf, url, headers)
+        m = MEMBER_URL.match(url)
+        if m is not None:
+            if response.status == 404:
+                # GWS answers 200 to removing a member that is not there
+                response.status = 200
+            if response.status == 200:
+                self._update_members(m.group(1), unquote(m.group(2)), None)
         return response
 
+    def _update_members(self, members_url, name, member_type):
+        """
+        Adds (member_type) or removes (None) name in the stored member
+        list, so a GET of the list sees per-member writes.
+        """
+        with _members_lock:
+            current = get_mockdata_url("gws", self._conf, members_url, {})
+            if current.status == 200:
+                root = etree.fromstring(current.data)
+            else:
+                root = etree.fromstring(_as_get_document(members_url, '<gws><group><members/></group></gws>'))
+            members = root.find('group').find('members')
+            for member in members.findall('member'):
+                if member.text == name:
+                    members.remove(member)
+            if member_type is not None:
+                etree.SubElement(members, 'member', {'class': 'member', 'type': member_type}).text = name
+            get_mock_store(self._conf).put("gws", members_url, {}, etree.tostring(root))
+
 
 class Live(object):
     """
@@ -96,3 +137,25 @@ class Live(object):
                             self._conf['CA_FILE'],
                             socket_timeout=self._socket_timeout,
                             max_pool_size=self._max_pool_size)
+
+
+def _as_get_document(url, body):
+    """
+    Returns the GET form of a group or member list PUT body: the request
+    documents name their elements <x class="name">, GET documents
+    <name>, and a group's names are under <names>.
+    """
+    root = etree.fromstring(body)
+    for e in root.iter('x'):
+        if e.get('class'):
+            e.tag = e.get('class')
+    group = root.find('group')
+    if group is not None and group.find('name') is None:
+        name = group.findtext('names/name')
+        if name is None:
+            m = GROUP_URL.match(url) or MEMBERS_URL.match(url)
+            name = m.group(1)
+        e = etree.Element('name', {'class': 'name'})
+        e.text = name
+        group.insert(0, e)
+    return etree.tostring(root)
@@ -5,7 +5,7 @@ Contains IRWS DAO implementations.
 from resttools.mock.mock_http import MockHTTP
 import re
 from resttools.dao_implementation.live import get_con_pool, get_live_url
-from resttools.dao_implementation.mock import get_mockdata_url
+from resttools.dao_implementation.mock import get_mockdata_url, find_mockdata, put_mockdata_url
 
 import logging
 logger = logging.getLogger(__name__)
@@ -18,7 +18,6 @@ class File(object):
 
     """
     _max_pool_size = 5
-    _cache_db = {}
 
     def __init__(self, conf):
         self._conf = conf
@@ -27,12 +26,6 @@ class File(object):
 
     def getURL(self, url, headers):
         logger.debug('file irws get url: ' + url)
-        if url in File._cache_db:
-            print'usng cache'
-            response = MockHTTP
-            response.data = File._cache_db[url]
-            response.status = 200
-            return response
         response = get_mockdata_url("irws", self._conf, url, headers)
         if response.status == 404:
             logger.debug('status 404')
@@ -41,17 +34,18 @@ class File(object):
 
     def putURL(self, url, headers, body):
         logger.debug('file irws put url: ' + url)
-        print('file irws put url: ' + url)
 
-        response = get_mockdata_url("irws", self._conf, url, headers)
-        if response.status == 404:
-            # try set in cache
-            File._cache_db[url] = body
-            print('not found for put - cache')
-            logger.debug('not found for put - cache')
-            response.data = '{"cached": {"code": "0000","message": "put cached in mock data"}}'
-            response.status = 200
+        # the canned reply, if any, is looked up before the write hides it
+        canned = find_mockdata("irws", self._conf, url, headers)
+        response = put_mockdata_url("irws", self._conf, url, headers, body)
+        if response.status not in (200, 201):
+            return response
+        if canned is not None:
+            return canned
 
+        logger.debug('not found for put - cached in mock store')
+        response.data = '{"cached": {"code": "0000","message": "put cached in mock data"}}'
+        response.status = 200
         return response
 
 
@@ -67,11 +67,20 @@ def get_live_url(con_pool,
     :param headers:
         headers to include with the request
     :param body:
-        the POST, PUT body of the request
+        the POST, PUT body of the request.  A body that is not a string
+        is an iterable of chunks, sent with chunked transfer encoding;
+        it can only be sent once, so the request is not retried.
     """
     timeout = con_pool.timeout
 
+    kwargs = {}
+    if body is not None and not isinstance(body, basestring):
+        # urllib3 before 1.16 has no chunked: only iterable bodies need it
+        kwargs['chunked'] = True
+        retries = 0
+
     start_time = time.time()
-    response = con_pool.urlopen(method, url, body=body, headers=headers, retries=retries, timeout=timeout)
+    response = con_pool.urlopen(method, url, body=body, headers=headers, retries=retries, timeout=timeout,
+                                **kwargs)
     request_time = time.time() - start_time
     return response
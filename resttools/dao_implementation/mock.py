@@ -6,7 +6,13 @@ import json
 import time
 import string
 import logging
-from resttools.mock.mock_http import MockHTTP
+import mmap
+import hashlib
+import itertools
+import struct
+import zipfile
+import threading
+from resttools.mock.mock_http import MockHTTP, MappedMockHTTP
 
 """
 A centralized the mock data access
@@ -15,6 +21,9 @@ A centralized the mock data access
 fs_encoding = sys.getfilesystemencoding() or sys.getdefaultencoding()
 app_resource_dirs = []
 
+# files this large are memory-mapped, not read
+MMAP_THRESHOLD = 1 << 20
+
 
 def get_mockdata_url(service_name, conf,
                      url, headers):
@@ -27,11 +36,15 @@ def get_mockdata_url(service_name, conf,
     success = False
     start_time = time.time()
 
-    dir_base = dirname(__file__)
-    app_root = abspath(dir_base)
-    response = _load_resource_from_path(app_root, service_name, conf, url, headers)
+    entry = get_mock_store(conf).get(service_name, url)
+    if entry is MockStore.DELETED:
+        response = None
+    elif entry is not None:
+        response = _response_from_entry(entry)
+    else:
+        response = find_mockdata(service_name, conf, url, headers)
     if response:
-        return response
+        return _not_modified(response, headers) or response
 
     # If no response has been found in any installed app, return a 404
     logger = logging.getLogger(__name__)
@@ -41,87 +54,553 @@ def get_mockdata_url(service_name, conf,
     return response
 
 
-def _load_resource_from_path(app_root, service_name, conf, url, headers):
+def _not_modified(response, headers):
+    """
+    Returns a 304 response if headers has an If-None-Match that matches
+    the 200 response's ETag (mock data files: an ETag of their content).
+    """
+    if_none_match = _header(headers, 'If-None-Match')
+    if if_none_match is None or response.status != 200:
+        return None
+    etag = _header(response.headers, 'ETag') or '"%s"' % hashlib.md5(response.data).hexdigest()
+    if if_none_match.strip() != '*' and etag not in [t.strip() for t in if_none_match.split(',')]:
+        return None
+    not_modified = MockHTTP()
+    not_modified.status = 304
+    not_modified.data = ''
+    not_modified.headers = {'ETag': etag}
+    return not_modified
 
-    logger = logging.getLogger(__name__)
+
+def find_mockdata(service_name, conf, url, headers=None):
+    """
+    Returns the response for url from the mock data (archive, index or
+    files), or None.  Writes held by the mock store are not looked at.
+    """
+    dir_base = dirname(__file__)
+    app_root = abspath(dir_base)
+    response = None
+    if conf.get('MOCK_ARCHIVE'):
+        response = _get_mock_archive(conf['MOCK_ARCHIVE'], conf).lookup(service_name, url)
+    if response is None:
+        if conf.get('MOCK_PRELOAD'):
+            response = _get_mock_index(app_root, service_name, conf).lookup(url)
+        else:
+            response = _load_resource_from_path(app_root, service_name, conf, url, headers)
+    return response
+
+
+def _mock_roots(app_root, service_name, conf):
+    """
+    Returns the service's mock data directories, in search order.  The
+    bundled mock data is searched after MOCK_ROOT unless MOCK_FALLBACK
+    is False.
+    """
     mock_root = app_root + '/../mock'
     std_root = mock_root + '/' + service_name
     if 'MOCK_ROOT' in conf and conf['MOCK_ROOT'] is not None:
         mock_root = conf['MOCK_ROOT']
     root = mock_root + '/' + service_name
+    if root == std_root or not conf.get('MOCK_FALLBACK', True):
+        return [root]
+    return [root, std_root]
+
+
+def _load_resource_from_path(app_root, service_name, conf, url, headers):
+
+    logger = logging.getLogger(__name__)
 
     if url == "///":
         # Just a placeholder to put everything else in an else.
         # If there are things that need dynamic work, they'd go here
         pass
     else:
-        try:
+        for root in _mock_roots(app_root, service_name, conf):
             file_path = convert_to_platform_safe(root + url)
-            logger.debug('try1: ' + file_path)
+            logger.debug('try: ' + file_path)
             if os.path.isdir(file_path):
                 file_path = file_path + '.resource'
-            handle = open(file_path)
-        except IOError:
-            if std_root is not mock_root:
-                try:
-                    file_path = convert_to_platform_safe(std_root + url)
-                    logger.debug('try2: ' + file_path)
-                    if os.path.isdir(file_path):
-                        file_path = file_path + '.resource'
-                    handle = open(file_path)
-                except IOError:
-                    return
-
-        logger.debug("URL: %s; File: %s" % (url, file_path))
+            try:
+                entry = _read_mock_file(service_name, file_path, _mmap_threshold(conf))
+            except IOError:
+                continue
 
-        response = MockHTTP()
-        response.status = 200
-        data = handle.read()
-        cut = string.find(data, 'MOCKDATA-MOCKDATA-MOCKDATA')
-        if cut >= 0:
-            data = data[string.find(data, '\n', cut)+1:]
-        response.data = data
-        response.headers = {"X-Data-Source": service_name + " file mock data", }
+            logger.debug("URL: %s; File: %s" % (url, file_path))
+            return _response_from_entry(entry)
 
-        try:
-            headers = open(handle.name + '.http-headers')
-            data = headers.read()
-            cut = string.find(data, 'MOCKDATA-MOCKDATA-MOCKDATA')
-            if cut >= 0:
-                data = data[string.find(data, '\n', cut)+1:]
-            file_values = json.loads(data)
 
-            if "headers" in file_values:
-                response.headers = dict(response.headers.items() + file_values['headers'].items())
+def _mmap_threshold(conf):
+    return conf.get('MOCK_MMAP_THRESHOLD', MMAP_THRESHOLD)
+
+
+def _read_mock_file(service_name, file_path, mmap_threshold=None):
+    """
+    Reads a mock data file, and its .http-headers file if there is one,
+    into an entry dict with status, data and headers.  Files of at least
+    mmap_threshold bytes are memory-mapped instead of read: the entry
+    has 'mapped' and the 'offset' and 'size' of the body in it.
+    """
+    entry = {'path': file_path,
+             'status': 200,
+             'data': None,
+             'headers': {"X-Data-Source": service_name + " file mock data", }}
+    with open(file_path, 'rb') as handle:
+        stat = os.fstat(handle.fileno())
+        entry['mtime'] = stat.st_mtime
+        if mmap_threshold and stat.st_size >= mmap_threshold:
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            entry['mapped'] = mapped
+            entry['offset'] = _mockdata_offset(mapped)
+            entry['size'] = len(mapped) - entry['offset']
+        else:
+            entry['data'] = _strip_mockdata_header(handle.read())
+
+    try:
+        with open(file_path + '.http-headers') as handle:
+            file_values = json.loads(_strip_mockdata_header(handle.read()))
+
+        if "headers" in file_values:
+            entry['headers'] = dict(entry['headers'].items() + file_values['headers'].items())
+
+        if 'status' in file_values:
+            entry['status'] = file_values['status']
+
+        else:
+            entry['headers'] = dict(entry['headers'].items() + file_values.items())
+
+    except IOError:
+        pass
+
+    return entry
+
+
+def _strip_mockdata_header(data):
+    cut = string.find(data, 'MOCKDATA-MOCKDATA-MOCKDATA')
+    if cut >= 0:
+        data = data[string.find(data, '\n', cut)+1:]
+    return data
+
+
+def _mockdata_offset(data):
+    """
+    Returns where the body starts in data (a string or mmap).
+    """
+    cut = data.find('MOCKDATA-MOCKDATA-MOCKDATA')
+    if cut >= 0:
+        return data.find('\n', cut) + 1
+    return 0
+
+
+def _entry_data(entry):
+    if entry.get('mapped') is not None:
+        return entry['mapped'][entry['offset']:entry['offset'] + entry['size']]
+    return entry['data']
+
+
+def _response_from_entry(entry):
+    if entry.get('mapped') is not None:
+        response = MappedMockHTTP(entry['mapped'], entry['offset'], entry['size'])
+        response.status = entry['status']
+        response.headers = dict(entry['headers'])
+        return response
+    response = MockHTTP()
+    response.status = entry['status']
+    response.data = entry['data']
+    response.headers = dict(entry['headers'])
+    return response
+
+
+def _scan_mock_root(service_name, root, mmap_threshold=None):
+    """
+    Returns {url key: entry} for every mock data file under root.
+    """
+    entries = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith('.http-headers'):
+                continue
+            file_path = os.path.join(dirpath, filename)
+            key = file_path[len(root):].replace(os.sep, '/')
+            try:
+                entry = _read_mock_file(service_name, file_path, mmap_threshold)
+            except IOError:
+                continue
+            entries[key] = entry
+            if filename.endswith('.resource') and os.path.isdir(file_path[:-len('.resource')]):
+                entries[key[:-len('.resource')]] = entry
+    return entries
+
+
+_mock_indexes = {}
+
+
+def _get_mock_index(app_root, service_name, conf):
+    roots = tuple(_mock_roots(app_root, service_name, conf))
+    key = (service_name, roots)
+    if key not in _mock_indexes:
+        _mock_indexes[key] = MockIndex(service_name, roots, reload=conf.get('MOCK_RELOAD', False),
+                                       mmap_threshold=_mmap_threshold(conf))
+    return _mock_indexes[key]
+
+
+class MockIndex(object):
+    """
+    All of a service's mock data, read once into memory.
+
+    The roots are scanned when the index is created: every file becomes an
+    entry keyed by its (platform safe) url, with the MOCKDATA header cut and
+    its .http-headers applied; a directory with a '.resource' file answers
+    for the directory's url.  Earlier roots win.  Use with
+
+        conf['MOCK_PRELOAD'] = True
+
+    With reload on (conf['MOCK_RELOAD']), an entry whose file changed is
+    read again, and a url not in the index is looked for on disk.
+
+    Files of mmap_threshold bytes or more (conf['MOCK_MMAP_THRESHOLD'])
+    are memory-mapped, not read; their responses are MappedMockHTTPs.
+    Replace such files (write and rename) rather than rewriting them.
+    """
+
+    def __init__(self, service_name, roots, reload=False, mmap_threshold=None):
+        self._service_name = service_name
+        self._roots = roots
+        self._reload = reload
+        self._mmap_threshold = mmap_threshold
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.scan()
+
+    def __len__(self):
+        return len(self._entries)
 
-            if 'status' in file_values:
-                response.status = file_values['status']
+    def scan(self):
+        entries = {}
+        for root in reversed(self._roots):
+            entries.update(_scan_mock_root(self._service_name, root, self._mmap_threshold))
+        self._entries = entries
 
+    def lookup(self, url):
+        """
+        Returns a MockHTTP for the url, or None if there is no mock data.
+        """
+        key = convert_to_platform_safe(url)
+        entry = self._entries.get(key)
+        if self._reload:
+            entry = self._refresh(key, entry)
+        if entry is None:
+            return None
+        return _response_from_entry(entry)
+
+    def _refresh(self, key, entry):
+        if entry is not None:
+            try:
+                if os.path.getmtime(entry['path']) == entry['mtime']:
+                    return entry
+            except OSError:
+                pass
+        # changed, removed or new: look on disk
+        entry = None
+        for root in self._roots:
+            file_path = root + key
+            if os.path.isdir(file_path):
+                file_path = file_path + '.resource'
+            try:
+                entry = _read_mock_file(self._service_name, file_path, self._mmap_threshold)
+                break
+            except IOError:
+                continue
+        with self._lock:
+            if entry is None:
+                self._entries.pop(key, None)
             else:
-                response.headers = dict(response.headers.items() + file_values.items())
+                self._entries[key] = entry
+        return entry
+
+
+_mock_archives = {}
+
+
+def _get_mock_archive(path, conf):
+    if path not in _mock_archives:
+        _mock_archives[path] = MockArchive(path, mmap_threshold=_mmap_threshold(conf))
+    return _mock_archives[path]
+
+
+class MockArchive(object):
+    """
+    Mock data for several services packed in one zip file.  Bodies are
+    members stored as 'data/<service><url key>'; 'index.json' maps
+    '<service><url key>' to the member, status and headers.  The index is
+    read into a dict when the archive is opened, so a lookup is a dict hit
+    and one member read.  Use with
+
+        conf['MOCK_ARCHIVE'] = '/path/to/mock.zip'
+
+    Build one from a mock tree with build_mock_archive() or
+    python -m resttools.mock.pack.
+
+    Stored (uncompressed) members of mmap_threshold bytes or more are
+    served from a memory map of the archive, at offsets worked out when
+    it is opened.
+    """
+    INDEX = 'index.json'
+
+    def __init__(self, path, mmap_threshold=None):
+        self._path = path
+        self._zip = zipfile.ZipFile(path)
+        self._lock = threading.Lock()
+        self._entries = json.loads(self._zip.read(self.INDEX))['entries']
+        self._mapped = None
+        self._offsets = {}
+        if mmap_threshold:
+            self._map_members(mmap_threshold)
 
-        except IOError:
-            pass
+    def _map_members(self, mmap_threshold):
+        large = [info for info in self._zip.infolist()
+                 if info.compress_type == zipfile.ZIP_STORED and info.file_size >= mmap_threshold]
+        if not large:
+            return
+        with open(self._path, 'rb') as handle:
+            self._mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        for info in large:
+            # the local header's name and extra lengths can differ from the central directory's
+            header = info.header_offset
+            name_len, extra_len = struct.unpack('<HH', self._mapped[header + 26:header + 30])
+            self._offsets[info.filename] = (header + 30 + name_len + extra_len, info.file_size)
 
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, service_name, url):
+        """
+        Returns a MockHTTP for the url, or None if it is not in the archive.
+        """
+        entry = self._entries.get('/' + service_name + convert_to_platform_safe(url))
+        if entry is None:
+            return None
+        if entry['member'] in self._offsets:
+            offset, size = self._offsets[entry['member']]
+            response = MappedMockHTTP(self._mapped, offset, size)
+        else:
+            response = MockHTTP()
+            with self._lock:
+                response.data = self._zip.read(entry['member'])
+        response.status = entry['status']
+        response.headers = dict(entry['headers'])
         return response
 
 
+class MockArchiveWriter(object):
+    """
+    Writes a MockArchive: add() each url's body, then close() to write
+    the index.  Urls added with the same member share its body.
+    """
+
+    def __init__(self, archive_path, compress=False):
+        compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        self._zip = zipfile.ZipFile(archive_path, 'w', compression, allowZip64=True)
+        self._index = {}
+        self._members = set()
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, service_name, key, data, status=200, headers=None, member=None):
+        """
+        Stores data for the url key (platform safe, as in the mock tree).
+        """
+        if member is None:
+            member = 'data/' + service_name + key
+        if member not in self._members:
+            self._zip.writestr(member, data)
+            self._members.add(member)
+        if headers is None:
+            headers = {"X-Data-Source": service_name + " file mock data"}
+        self._index['/' + service_name + key] = {'member': member,
+                                                 'status': status,
+                                                 'headers': headers}
+
+    def close(self):
+        self._zip.writestr(MockArchive.INDEX, json.dumps({'entries': self._index}))
+        self._zip.close()
+
+
+def build_mock_archive(mock_root, archive_path, services=None, compress=False):
+    """
+    Packs the mock tree at mock_root (one directory per service) into a
+    MockArchive at archive_path.  Returns the number of urls stored.
+    """
+    if services is None:
+        services = sorted(d for d in os.listdir(mock_root) if os.path.isdir(os.path.join(mock_root, d)))
+    writer = MockArchiveWriter(archive_path, compress=compress)
+    for service_name in services:
+        service_root = os.path.join(mock_root, service_name)
+        entries = _scan_mock_root(service_name, service_root)
+        for key in sorted(entries):
+            entry = entries[key]
+            # directory aliases share the .resource member
+            member = 'data/' + service_name + entry['path'][len(service_root):].replace(os.sep, '/')
+            writer.add(service_name, key, _entry_data(entry), entry['status'], entry['headers'], member=member)
+    writer.close()
+    return len(writer)
+
+
+def get_mock_store(conf):
+    """
+    Returns the store for writes made through the File DAOs:
+    conf['MOCK_STORE'] if set, else one shared by the process.
+    """
+    if conf.get('MOCK_STORE') is not None:
+        return conf['MOCK_STORE']
+    return default_store
+
+
+class MockStore(object):
+    """
+    Thread-safe, in-memory state for mock writes.  PUT resources are
+    kept here and served to later GETs ahead of the mock data; DELETEs
+    leave a marker so the url reads as gone; POST bodies are logged.
+
+    Every version of a resource has an ETag.  If-Match ('*' or an ETag)
+    and If-None-Match: * are checked on PUT and DELETE; mock data files
+    count as existing resources, with an ETag from their content.
+    Locking is per stripe of urls, so unrelated writes do not contend.
+    """
+    DELETED = object()
+    _stripes = 64
+
+    def __init__(self):
+        self._resources = {}
+        self._posts = {}
+        self._locks = [threading.Lock() for n in range(self._stripes)]
+        self._versions = itertools.count(1)
+
+    def __len__(self):
+        return len(self._resources)
+
+    def clear(self):
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            self._resources.clear()
+            self._posts.clear()
+        finally:
+            for lock in self._locks:
+                lock.release()
+
+    def get(self, service_name, url):
+        """
+        Returns the entry written for url, DELETED, or None if the
+        store knows nothing about it.
+        """
+        return self._resources.get((service_name, url))
+
+    def put(self, service_name, url, headers, body, current=None):
+        """
+        Stores body for url.  current is the mock data response for url,
+        if any.  Returns (status, entry): 201 created, 200 updated or
+        412 if a precondition failed.
+        """
+        key = (service_name, url)
+        with self._lock(key):
+            etag = self._current_etag(key, current)
+            status = self._check_preconditions(headers, etag)
+            if status is not None:
+                return status, None
+            entry = {'status': 200,
+                     'data': body,
+                     'headers': {'X-Data-Source': service_name + ' mock store',
+                                 'ETag': '"%d"' % next(self._versions)}}
+            content_type = _header(headers, 'Content-Type')
+            if content_type:
+                entry['headers']['Content-Type'] = content_type
+            self._resources[key] = entry
+        return (201 if etag is None else 200), entry
+
+    def delete(self, service_name, url, headers, current=None):
+        """
+        Deletes url.  Returns 200, 404 if there is nothing to delete or
+        412 if a precondition failed.
+        """
+        key = (service_name, url)
+        with self._lock(key):
+            etag = self._current_etag(key, current)
+            if etag is None:
+                return 404
+            status = self._check_preconditions(headers, etag)
+            if status is not None:
+                return status
+            self._resources[key] = self.DELETED
+        return 200
+
+    def post(self, service_name, url, headers, body):
+        key = (service_name, url)
+        with self._lock(key):
+            self._posts.setdefault(key, []).append(body)
+
+    def posts(self, service_name, url):
+        """
+        Returns the bodies POSTed to url, oldest first.
+        """
+        key = (service_name, url)
+        with self._lock(key):
+            return list(self._posts.get(key, []))
+
+    def _lock(self, key):
+        return self._locks[hash(key) % self._stripes]
+
+    def _current_etag(self, key, current):
+        entry = self._resources.get(key)
+        if entry is self.DELETED:
+            return None
+        if entry is not None:
+            return entry['headers']['ETag']
+        if current is not None and current.status == 200:
+            return '"%s"' % hashlib.md5(current.data).hexdigest()
+        return None
+
+    def _check_preconditions(self, headers, etag):
+        if_match = _header(headers, 'If-Match')
+        if if_match is not None:
+            if etag is None:
+                return 412
+            if if_match.strip() != '*' and etag not in [t.strip() for t in if_match.split(',')]:
+                return 412
+        if _header(headers, 'If-None-Match') == '*' and etag is not None:
+            return 412
+        return None
+
+
+default_store = MockStore()
+
+
+def _header(headers, name):
+    if headers:
+        for header in headers:
+            if header.lower() == name.lower():
+                return headers[header]
+    return None
+
+
 def post_mockdata_url(service_name, conf, url, headers, body, dir_base=dirname(__file__)):
     """
     :param service_name:
         possible "sws", "pws", "book", "hfs", etc.
+    Logs the POST in the mock store and returns the mock data response
+    for url (the canned reply), 404 if there is none.
     """
-    # Currently this post method does not return a response body
-    response = MockHTTP()
-    if body is not None:
-        if "dispatch" in url:
-            response.status = 200
-        else:
-            response.status = 201
-        response.headers = {"X-Data-Source": service_name + " file mock data", "Content-Type": headers['Content-Type']}
-    else:
+    if body is None:
+        response = MockHTTP()
         response.status = 400
         response.data = "Bad Request: no POST body"
+        return response
+
+    get_mock_store(conf).post(service_name, url, headers, body)
+    response = find_mockdata(service_name, conf, url, headers)
+    if response is None:
+        response = MockHTTP()
+        response.status = 404
     return response
 
 
@@ -129,15 +608,27 @@ def put_mockdata_url(service_name, conf, url, headers, body, dir_base=dirname(__
     """
     :param service_name:
         possible "sws", "pws", "book", "hfs", etc.
+    Writes body to the mock store.  Returns 201 (created) or 200
+    (updated) with the body, or 412 if If-Match/If-None-Match failed.
     """
-    # Currently this put method does not return a response body
     response = MockHTTP()
-    if body is not None:
-        response.status = 204
-        response.headers = {"X-Data-Source": service_name + " file mock data", "Content-Type": headers['Content-Type']}
-    else:
+    if body is None:
         response.status = 400
-        response.data = "Bad Request: no POST body"
+        response.data = "Bad Request: no PUT body"
+        return response
+    if not isinstance(body, basestring):
+        # a streamed body
+        body = ''.join(body)
+
+    store = get_mock_store(conf)
+    current = None
+    if store.get(service_name, url) is None:
+        current = find_mockdata(service_name, conf, url, headers)
+    status, entry = store.put(service_name, url, headers, body, current=current)
+    response.status = status
+    if entry is not None:
+        response.data = entry['data']
+        response.headers = dict(entry['headers'])
     return response
 
 
@@ -145,12 +636,15 @@ def delete_mockdata_url(service_name, conf, url, headers, dir_base=dirname(__fil
     """
     :param service_name:
         possible "sws", "pws", "book", "hfs", etc.
+    Deletes url in the mock store: 200, 404 if it does not exist or 412
+    if If-Match failed.
     """
-    # Http response code 204 No Content:
-    # The server has fulfilled the request but does not need to return an entity-body
+    store = get_mock_store(conf)
+    current = None
+    if store.get(service_name, url) is None:
+        current = find_mockdata(service_name, conf, url, headers)
     response = MockHTTP()
-    response.status = 204
-
+    response.status = store.delete(service_name, url, headers, current=current)
     return response
 
 
@@ -5,7 +5,7 @@ Contains Notify WS  DAO implementations.
 from resttools.mock.mock_http import MockHTTP
 import re
 from resttools.dao_implementation.live import get_con_pool, get_live_url
-from resttools.dao_implementation.mock import get_mockdata_url
+from resttools.dao_implementation.mock import get_mockdata_url, post_mockdata_url
 
 import logging
 logger = logging.getLogger(__name__)
@@ -27,7 +27,7 @@ class File(object):
     def postURL(self, url, headers, body):
         logger.debug('file ntfyws post url: ' + url)
 
-        response = get_mockdata_url("ntfyws", self._conf, url, headers)
+        response = post_mockdata_url("ntfyws", self._conf, url, headers, body)
         if response.status == 404:
             logger.debug('status 404')
             response.data = '{"error": {"code": "7000","message": "No record matched"}}'
@@ -0,0 +1,174 @@
+"""
+Record mode: the Live DAOs, with every response also written out as
+mock data that File mode can replay.
+
+    conf['RUN_MODE'] = 'Record'
+    conf['RECORD_ROOT'] = '/path/to/mock'     # a mock tree, for MOCK_ROOT
+
+or, for a packed archive (MOCK_ARCHIVE), a Recorder you close when done:
+
+    conf['RECORDER'] = Recorder(archive='/path/to/mock.zip',
+                                redact=[(r'"birthdate": "[^"]*"', '"birthdate": ""')])
+    ...
+    conf['RECORDER'].close()
+
+Bodies are written as the service sent them, after the redact rules
+(regex, replacement) are applied; status and headers go to a
+.http-headers file (archive: the index).  Only GET and POST responses
+are recorded by default: in File mode PUT and DELETE go to the mock
+store instead.  A url recorded twice keeps the last response.
+"""
+
+import os
+import re
+import json
+import threading
+
+from resttools.dao_implementation.mock import MockArchiveWriter, convert_to_platform_safe
+
+import logging
+logger = logging.getLogger(__name__)
+
+# connection and session headers that make no sense replayed
+DROP_HEADERS = ('connection', 'keep-alive', 'transfer-encoding', 'content-length', 'content-encoding',
+                'date', 'server', 'set-cookie', 'authorization', 'x-uw-act-as')
+
+
+class Recorder(object):
+    """
+    Writes responses to a mock tree under root, or to an archive.
+    redact is a list of (regex, replacement) applied to bodies and
+    header values; drop_headers are not recorded at all.
+    """
+
+    def __init__(self, root=None, archive=None, redact=None, drop_headers=DROP_HEADERS,
+                 methods=('GET', 'POST'), compress=False):
+        if (root is None) == (archive is None):
+            raise ValueError('Recorder needs one of root or archive')
+        self._root = root
+        self._archive = None
+        if archive is not None:
+            self._archive = MockArchiveWriter(archive, compress=compress)
+            self._recorded = {}
+        self._redact = [(re.compile(pattern), replacement) for pattern, replacement in (redact or [])]
+        self._drop_headers = set(h.lower() for h in drop_headers)
+        self._methods = methods
+        self._lock = threading.Lock()
+        self._closed = False
+        self.count = 0
+
+    def wrap(self, service_name, dao):
+        """
+        Returns dao with its responses recorded.
+        """
+        return _RecordingDAO(dao, service_name, self)
+
+    def record(self, service_name, method, url, response):
+        if method not in self._methods or response is None:
+            return
+        data = self._scrub(response.data or '')
+        headers = {}
+        for name, value in dict(response.headers or {}).items():
+            if name.lower() not in self._drop_headers:
+                headers[name] = self._scrub(value)
+        with self._lock:
+            if self._closed:
+                raise ValueError('Recorder is closed')
+            if self._archive is not None:
+                self._add_to_archive(service_name, url, response.status, headers, data)
+            else:
+                self._write_file(service_name, url, response.status, headers, data)
+            self.count += 1
+        logger.debug('recorded %s %s %s: %d' % (service_name, method, url, response.status))
+
+    def close(self):
+        with self._lock:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
+                self._closed = True
+
+    def _scrub(self, text):
+        for pattern, replacement in self._redact:
+            text = pattern.sub(replacement, text)
+        return text
+
+    def _add_to_archive(self, service_name, url, status, headers, data):
+        key = convert_to_platform_safe(url)
+        # a url recorded again gets a new member, and the index the last one
+        n = self._recorded.get((service_name, key), 0)
+        self._recorded[(service_name, key)] = n + 1
+        member = 'data/' + service_name + key + ('.%d' % n if n else '')
+        self._archive.add(service_name, key, data, status=status,
+                          headers=dict(headers, **{'X-Data-Source': service_name + ' file mock data'}),
+                          member=member)
+
+    def _write_file(self, service_name, url, status, headers, data):
+        path = convert_to_platform_safe(self._root + '/' + service_name + url)
+        self._make_dirs(os.path.dirname(path))
+        if os.path.isdir(path):
+            path = path + '.resource'
+        with open(path, 'wb') as f:
+            f.write(data)
+        with open(path + '.http-headers', 'w') as f:
+            json.dump({'status': status, 'headers': headers}, f, indent=2, sort_keys=True)
+
+    def _make_dirs(self, directory):
+        if os.path.isdir(directory):
+            return
+        parent = os.path.dirname(directory)
+        if parent != directory:
+            self._make_dirs(parent)
+        if os.path.isfile(directory):
+            # a recorded url is now also a directory: it answers as .resource
+            os.rename(directory, directory + '.resource')
+            if os.path.exists(directory + '.http-headers'):
+                os.rename(directory + '.http-headers', directory + '.resource.http-headers')
+        os.mkdir(directory)
+
+
+_recorders = {}
+_recorders_lock = threading.Lock()
+
+
+def get_recorder(conf):
+    """
+    Returns conf['RECORDER'], or the tree Recorder for conf['RECORD_ROOT'].
+    """
+    if conf.get('RECORDER') is not None:
+        return conf['RECORDER']
+    if conf.get('RECORD_ROOT') is None:
+        raise ValueError("Record mode needs RECORDER or RECORD_ROOT in the conf")
+    with _recorders_lock:
+        if conf['RECORD_ROOT'] not in _recorders:
+            _recorders[conf['RECORD_ROOT']] = Recorder(root=conf['RECORD_ROOT'],
+                                                       redact=conf.get('RECORD_REDACT'))
+        return _recorders[conf['RECORD_ROOT']]
+
+
+class _RecordingDAO(object):
+
+    def __init__(self, dao, service_name, recorder):
+        self._dao = dao
+        self._service_name = service_name
+        self._recorder = recorder
+
+    def getURL(self, url, headers):
+        response = self._dao.getURL(url, headers)
+        self._recorder.record(self._service_name, 'GET', url, response)
+        return response
+
+    def putURL(self, url, headers, body):
+        response = self._dao.putURL(url, headers, body)
+        self._recorder.record(self._service_name, 'PUT', url, response)
+        return response
+
+    def postURL(self, url, headers, body):
+        response = self._dao.postURL(url, headers, body)
+        self._recorder.record(self._service_name, 'POST', url, response)
+        return response
+
+    def deleteURL(self, url, headers):
+        response = self._dao.deleteURL(url, headers)
+        self._recorder.record(self._service_name, 'DELETE', url, response)
+        return response
@@ -0,0 +1,306 @@
+"""
+A local catalog of GWS groups that answers name and stem searches.
+
+Group names and stems change slowly, but every search_groups call goes
+to GWS.  The catalog keeps the GroupReference objects from the searches
+it has made (crawls) and from get_group_by_id.  It indexes them by name,
+in a sorted list for prefix ranges, by stem and, for course groups, by
+curriculum, quarter, year, course number, section and SLN:
+
+    catalog = GroupCatalog(GWS(conf), max_age=3600)
+    catalog.crawl(stem='course')
+    catalog.search_groups(name='2015spr-phys*', stem='course')   # local
+    catalog.search_groups(stem='course', scope='one')             # local
+    catalog.search_groups(member='javerage')                      # GWS
+    catalog.courses(curriculum='PHYS', quarter='spring', year=2015)
+
+A search is answered locally when a crawl younger than max_age covered
+it: a crawl of a stem covers every name and stem search below it, a
+crawl of a name prefix every search for longer prefixes.  Other searches
+(member, owner, instructor..., or outside what was crawled) go to GWS,
+and name and stem searches made that way count as crawls.  refresh
+repeats the crawls, dropping groups they no longer return; add and
+remove update the catalog in between.
+
+As GWS does, a name is matched below the stem when a stem is given,
+may contain * and matches any name that starts with it.
+"""
+
+import re
+import time
+import bisect
+import threading
+
+from resttools.gws import GWS, _page
+from resttools.models.gws import GroupReference
+
+import logging
+logger = logging.getLogger(__name__)
+
+# the search parameters the catalog can answer
+LOCAL_PARAMETERS = ('name', 'stem', 'scope')
+
+COURSE_NAME = re.compile(r'^course_(\d{4})(win|spr|sum|aut)-(.+?)(\d{3})([a-z0-9]*)$')
+
+COURSE_ATTRIBUTES = ('curriculum', 'quarter', 'year', 'number', 'section', 'sln')
+
+
+class _Query(object):
+    """
+    A name/stem/scope search, as the set of names it matches.
+    """
+
+    def __init__(self, name=None, stem=None, scope=None):
+        self.name = name or None
+        self.stem = stem or None
+        self.one = scope == 'one' and self.stem is not None
+        base = self.stem + '_' if self.stem else ''
+        literal = (self.name or '').split('*')[0]
+        # every match starts with prefix
+        self.prefix = base + literal
+        # ... and every name starting with prefix (one level below the
+        # stem, for scope one) matches
+        self.prefix_only = (self.name or '').rstrip('*') == literal
+        self.whole_prefix = self.prefix_only and not self.one
+        self._pattern = re.compile(re.escape(base) + '.*'.join(re.escape(p) for p in (self.name or '').split('*')))
+
+    @property
+    def key(self):
+        return (self.name, self.stem, self.one)
+
+    def matches(self, group_name):
+        if self.stem is not None and group_name == self.stem:
+            return self.name is None
+        if not self._pattern.match(group_name):
+            return False
+        return not self.one or '_' not in group_name[len(self.stem) + 1:]
+
+    def covers(self, other):
+        """
+        True if every name other matches, this matches.
+        """
+        if self.key == other.key:
+            return True
+        if self.one:
+            return (self.prefix_only and other.one and other.stem == self.stem and
+                    other.prefix.startswith(self.prefix))
+        if not self.whole_prefix or not other.prefix.startswith(self.prefix):
+            return False
+        # a stem search also returns the stem group itself
+        return (other.name is not None or other.stem is None or
+                other.stem.startswith(self.prefix) or other.stem == self.stem)
+
+
+class GroupCatalog(object):
+    """
+    GroupReference objects from crawls of gws, indexed by name, stem
+    and course attributes.  Crawls older than max_age seconds (None:
+    never) no longer answer searches.
+    """
+
+    def __init__(self, gws, max_age=None):
+        self.gws = gws
+        self.max_age = max_age
+        self._groups = {}
+        self._names = []
+        self._stems = {}
+        self._courses = dict((attribute, {}) for attribute in COURSE_ATTRIBUTES)
+        self._course_keys = {}
+        self._crawls = {}
+        self._lock = threading.RLock()
+        self.local = 0
+        self.remote = 0
+
+    def __len__(self):
+        return len(self._groups)
+
+    def __contains__(self, group_id):
+        return group_id.lower() in self._groups
+
+    def get(self, group_id):
+        """
+        The catalog's GroupReference for group_id, or None.
+        """
+        return self._groups.get(group_id.lower())
+
+    def add(self, group):
+        """
+        Adds or replaces a group, from a GroupReference or a Group.  A
+        CourseGroup also gives its SLN to the course index.
+        """
+        reference = group
+        if not isinstance(group, GroupReference):
+            reference = GroupReference()
+            reference.uwregid = group.uwregid
+            reference.name = group.name
+            reference.title = group.title
+            reference.description = group.description
+        name = reference.name.lower()
+        with self._lock:
+            if name not in self._groups:
+                bisect.insort(self._names, name)
+                self._stems.setdefault(_stem(name), set()).add(name)
+            self._groups[name] = reference
+            course = _course_attributes(name)
+            if course is not None:
+                if getattr(group, 'sln', None):
+                    course['sln'] = str(group.sln)
+                elif 'sln' in self._course_keys.get(name, {}):
+                    course['sln'] = self._course_keys[name]['sln']
+                self._index_course(name, course)
+
+    def remove(self, group_id):
+        name = group_id.lower()
+        with self._lock:
+            if self._groups.pop(name, None) is None:
+                return
+            del self._names[bisect.bisect_left(self._names, name)]
+            self._stems[_stem(name)].discard(name)
+            self._index_course(name, None)
+
+    def get_group_by_id(self, group_id):
+        """
+        Reads the group from GWS, as GWS.get_group_by_id, and adds it.
+        """
+        group = self.gws.get_group_by_id(group_id)
+        self.add(group)
+        return group
+
+    def crawl(self, **kwargs):
+        """
+        Searches GWS for the name/stem/scope search kwargs and makes the
+        catalog answer it, and the searches it covers, from now on.
+        Groups in the catalog the search should have returned but did
+        not are removed.  Returns the number of groups found.
+        """
+        kwargs = _given(kwargs)
+        query = self._query(kwargs)
+        if query is None:
+            raise ValueError('only %s searches can be crawled' % ', '.join(LOCAL_PARAMETERS))
+        start = time.time()
+        groups = self.gws.search_groups(**kwargs)
+        with self._lock:
+            found = set()
+            for group in groups:
+                self.add(group)
+                found.add(group.name.lower())
+            for name in self._match(query):
+                if name not in found:
+                    self.remove(name)
+            self._crawls[query.key] = (query, kwargs, start)
+        return len(groups)
+
+    def refresh(self, force=False):
+        """
+        Repeats the crawls older than max_age (all of them with force).
+        Returns the number repeated.
+        """
+        count = 0
+        for query, kwargs, crawled in list(self._crawls.values()):
+            if force or self._stale(crawled):
+                self.crawl(**kwargs)
+                count += 1
+        return count
+
+    def search_groups(self, limit=None, offset=0, **kwargs):
+        """
+        Returns GroupReference objects as GWS.search_groups does, from
+        the catalog (sorted by name) when a crawl covers the search.
+        """
+        kwargs = _given(kwargs)
+        query = self._query(kwargs)
+        if query is not None and self._covered(query):
+            self.local += 1
+            return _page((self._groups[name] for name in self._match(query)), limit, offset)
+        self.remote += 1
+        if query is not None:
+            self.crawl(**kwargs)
+            return _page((self._groups[name] for name in self._match(query)), limit, offset)
+        return self.gws.search_groups(limit=limit, offset=offset, **kwargs)
+
+    def courses(self, **attributes):
+        """
+        Returns the catalog's course groups with the passed attributes
+        (curriculum, quarter, year, number, section, sln), sorted by
+        name.  Only groups in the catalog are searched; SLNs are known
+        for groups added from get_group_by_id.
+        """
+        names = None
+        for attribute, value in attributes.items():
+            if attribute not in COURSE_ATTRIBUTES:
+                raise ValueError('not a course attribute: %s' % attribute)
+            matching = self._courses[attribute].get(_course_value(attribute, value), set())
+            names = set(matching) if names is None else names & matching
+        if names is None:
+            names = set(self._course_keys)
+        return [self._groups[name] for name in sorted(names)]
+
+    def _query(self, kwargs):
+        # as GWS.iter_search_groups normalizes them
+        kwargs = dict((k.lower(), v.lower()) for k, v in kwargs.iteritems())
+        if set(kwargs) - set(LOCAL_PARAMETERS) or not (kwargs.get('name') or kwargs.get('stem')):
+            return None
+        return _Query(kwargs.get('name'), kwargs.get('stem'), kwargs.get('scope'))
+
+    def _covered(self, query):
+        for crawled, kwargs, when in self._crawls.values():
+            if not self._stale(when) and crawled.covers(query):
+                return True
+        return False
+
+    def _stale(self, when):
+        return self.max_age is not None and time.time() - when > self.max_age
+
+    def _match(self, query):
+        """
+        The names in the catalog query matches, sorted.
+        """
+        with self._lock:
+            if query.one and query.name is None:
+                candidates = sorted(self._stems.get(query.stem, ()))
+                if query.stem in self._groups:
+                    candidates.insert(bisect.bisect_left(candidates, query.stem), query.stem)
+            else:
+                start = bisect.bisect_left(self._names, query.prefix)
+                stop = bisect.bisect_left(self._names, query.prefix + '\xff')
+                candidates = self._names[start:stop]
+                if query.stem is not None and query.name is None and query.stem in self._groups:
+                    candidates = [query.stem] + candidates
+            return [name for name in candidates if query.matches(name)]
+
+    def _index_course(self, name, course):
+        old = self._course_keys.pop(name, None)
+        if old is not None:
+            for attribute, value in old.items():
+                self._courses[attribute][value].discard(name)
+        if course is not None:
+            self._course_keys[name] = course
+            for attribute, value in course.items():
+                self._courses[attribute].setdefault(value, set()).add(name)
+
+
+def _given(kwargs):
+    # a parameter passed as None is not passed
+    return dict((k, v) for k, v in kwargs.iteritems() if v is not None)
+
+
+def _stem(name):
+    return name.rsplit('_', 1)[0] if '_' in name else None
+
+
+def _course_attributes(name):
+    m = COURSE_NAME.match(name)
+    if m is None:
+        return None
+    year, quarter, curriculum, number, section = m.groups()
+    return {'curriculum': curriculum.upper(), 'quarter': GWS.QTRS[quarter], 'year': year,
+            'number': number, 'section': section.upper()}
+
+
+def _course_value(attribute, value):
+    value = str(value)
+    if attribute in ('curriculum', 'section'):
+        return value.upper()
+    if attribute == 'quarter':
+        return GWS.QTRS.get(value.lower(), value.lower())
+    return value
@@ -6,15 +6,29 @@ from resttools.dao import GWS_DAO
 from resttools.exceptions import InvalidGroupID
 from resttools.exceptions import DataFailureException
 from resttools.models.gws import Group, CourseGroup, GroupReference
-from resttools.models.gws import GroupUser, GroupMember
-from urllib import urlencode
+from resttools.models.gws import GroupUser, GroupMember, MemberSync, GroupExpansion
+from resttools.models.gws import MembershipCheck, MembershipResult
+from urllib import urlencode, quote
+from cStringIO import StringIO
 from lxml import etree
 import re
+import time
+import threading
+from itertools import islice
+from collections import OrderedDict
+from array import array
+from multiprocessing.pool import ThreadPool
 from jinja2 import Environment, PackageLoader
 
 import logging
 logger = logging.getLogger(__name__)
 
+# one per process: templates are compiled on first use and kept
+_j2env = Environment(loader=PackageLoader('resttools', 'templates/gws'))
+
+# size of the chunks a streamed request body is sent in
+STREAM_CHUNK_SIZE = 65536
+
 
 class GWS(object):
     """
@@ -23,16 +37,17 @@ class GWS(object):
     def __init__(self, conf, actas=None):
         self._service_name = 'gws'
         self._conf = conf
-        self._j2env = Environment(loader=PackageLoader('resttools',
-                                                       'templates/gws'))
+        self._j2env = _j2env
         self._actas = actas
 
     QTRS = {'win': 'winter', 'spr': 'spring', 'sum': 'summer', 'aut': 'autumn'}
 
-    def search_groups(self, **kwargs):
+    def search_groups(self, limit=None, offset=0, **kwargs):
         """
         Returns a list of resttools.GroupReference objects matching the
-        passed parameters. Valid parameters are:
+        passed parameters.  limit and offset select a page of the results:
+        GWS has no paging, so parsing stops once the page is complete.
+        Valid parameters are:
             name: parts_of_name
                 name may include the wild-card (*) character.
             stem: group_stem
@@ -51,6 +66,15 @@ class GWS(object):
                 Values are 'one' to limit results to one level of stem name
                 and 'all' to return all groups.
         """
+        return _page(self.iter_search_groups(**kwargs), limit, offset)
+
+    def iter_search_groups(self, **kwargs):
+        """
+        Like search_groups, but yields each resttools.GroupReference as
+        soon as it is parsed.  The response is parsed incrementally and
+        parsed elements are dropped, so memory does not grow with the
+        number of results.  The search is made when iteration starts.
+        """
         kwargs = dict((k.lower(), v.lower()) for k, v in kwargs.iteritems())
         if 'type' in kwargs and (kwargs['type'] != 'direct' and
                                  kwargs['type'] != 'effective'):
@@ -70,23 +94,16 @@ class GWS(object):
         if response.status != 200:
             raise DataFailureException(url, response.status, response.data)
 
-        groups = []
-        root = etree.fromstring(response.data)
-        e_grs_list = root.find('groupreferences').findall('groupreference')
-        for e in e_grs_list:
+        for e in self._iterparse(response.data, 'groupreference'):
             group = GroupReference()
-            group.uwregid = e.find('regid').text
-            group.title = e.find('title').text
-            group.description = e.find('description').text
-            group.name = e.find('name').text
-            groups.append(group)
-
-        return groups
+            _parse_children(e, GROUPREFERENCE_FIELDS, group.__dict__)
+            yield group
 
     def get_group_by_id(self, group_id):
         """
         Returns a resttools.Group object for the group identified by the
-        passed group ID.
+        passed group ID.  With conf['GWS_LAZY'] it is a LazyGroup, whose
+        fields are parsed when first read.
         """
         if not self._is_valid_group_id(group_id):
             raise InvalidGroupID(group_id)
@@ -98,8 +115,49 @@ class GWS(object):
         if response.status != 200:
             raise DataFailureException(url, response.status, response.data)
 
+        if self._conf.get('GWS_LAZY'):
+            if re.match(r'^course_', group_id):
+                return LazyCourseGroup(group_id, response.data)
+            return LazyGroup(group_id, response.data)
         return self._group_from_xml(response.data)
 
+    def get_groups_by_ids(self, group_ids, max_workers=8, as_ready=False):
+        """
+        Returns an OrderedDict of resttools.Group objects for the passed
+        group IDs, by ID in the order given, read max_workers at a time.
+        An ID passed more than once is read once.  A group that cannot be
+        read maps to its DataFailureException, and the rest are still
+        read.  With as_ready, returns an iterator of (group ID, Group or
+        exception) pairs instead, in the order the reads finish.
+        """
+        group_ids = list(group_ids)
+        for group_id in group_ids:
+            if not self._is_valid_group_id(group_id):
+                raise InvalidGroupID(group_id)
+
+        unique = list(OrderedDict.fromkeys(group_ids))
+        if as_ready:
+            return self._iter_groups_by_ids(unique, max_workers, ordered=False)
+        return OrderedDict(self._iter_groups_by_ids(unique, max_workers, ordered=True))
+
+    def _iter_groups_by_ids(self, group_ids, max_workers, ordered):
+        if not group_ids:
+            return
+        pool = ThreadPool(min(max_workers, len(group_ids)))
+        try:
+            results = pool.imap if ordered else pool.imap_unordered
+            for result in results(self._group_or_error, group_ids):
+                yield result
+        finally:
+            # stops the reads still queued if the caller stopped early
+            pool.terminate()
+
+    def _group_or_error(self, group_id):
+        try:
+            return group_id, self.get_group_by_id(group_id)
+        except DataFailureException as e:
+            return group_id, e
+
     def create_group(self, group):
         """
         Creates a group from the passed resttools.Group object.
@@ -168,17 +226,23 @@ class GWS(object):
         if response.status != 200:
             raise DataFailureException(url, response.status, response.data)
 
+        if self._conf.get('GWS_COMPACT'):
+            return self._compact_members(response.data)
+        if self._conf.get('GWS_LAZY'):
+            return LazyMemberList(response.data)
         return self._members_from_xml(response.data)
 
     def put_members(self, group_id, members):
         """
         Puts the membership of the group represented by the passed group id.
-        Returns a list of members not found.
+        Returns a list of members not found.  members may be any iterable;
+        the body is generated as it is sent (chunked, in Live mode), so
+        memory does not grow with the number of members.
         """
         if not self._is_valid_group_id(group_id):
             raise InvalidGroupID(group_id)
 
-        body = self._xml_from_members(group_id, members)
+        body = self._stream_members_xml(group_id, members)
 
         dao = GWS_DAO(self._conf)
         url = "/group_sws/v2/group/%s/member" % group_id
@@ -192,22 +256,218 @@ class GWS(object):
 
         return self._notfoundmembers_from_xml(response.data)
 
-    def get_effective_members(self, group_id):
+    def sync_members(self, group_id, desired, max_workers=8, full_put_ratio=0.5):
+        """
+        Makes the direct membership of the group identified by the passed
+        group ID equal to desired (GroupMember objects, or netids), and
+        returns a resttools.MemberSync saying what was done.
+
+        Only the difference from the current members is sent, as
+        per-member adds and deletes made max_workers at a time.  If the
+        difference is more than full_put_ratio of the desired members the
+        whole list is put instead.
+        """
+        if not self._is_valid_group_id(group_id):
+            raise InvalidGroupID(group_id)
+
+        wanted = {}
+        for member in desired:
+            if not isinstance(member, GroupMember):
+                member = GroupMember(name=member, member_type=GroupMember.UWNETID_TYPE)
+            wanted[(member.name, member.member_type)] = member
+        current = set((m.name, m.member_type) for m in self.get_members(group_id))
+
+        adds = [wanted[key] for key in sorted(set(wanted) - current)]
+        removes = [GroupMember(name=name, member_type=member_type)
+                   for name, member_type in sorted(current - set(wanted))]
+        if not adds and not removes:
+            result = MemberSync('none')
+        elif len(adds) + len(removes) > full_put_ratio * len(wanted):
+            result = MemberSync('full')
+            notfound = set(self.put_members(group_id, wanted.values()))
+            result.failed = [(m, 404) for m in adds if m.name in notfound]
+            result.added = [m for m in adds if m.name not in notfound]
+            result.removed = removes
+        else:
+            result = MemberSync('delta')
+            requests = [('PUT', m) for m in adds] + [('DELETE', m) for m in removes]
+            pool = ThreadPool(min(max_workers, len(requests)))
+            try:
+                statuses = pool.map(lambda request: self._try_member_request(group_id, *request), requests)
+            finally:
+                pool.close()
+            for (method, member), status in zip(requests, statuses):
+                if isinstance(status, Exception) or status not in (200, 201):
+                    result.failed.append((member, status))
+                elif method == 'PUT':
+                    result.added.append(member)
+                else:
+                    result.removed.append(member)
+        result.unchanged = len(current & set(wanted))
+        return result
+
+    def _try_member_request(self, group_id, method, member):
+        """
+        As _member_request, returning the exception if one is raised, so
+        one failure does not stop the other requests.
+        """
+        try:
+            return self._member_request(group_id, method, member)
+        except Exception as e:
+            logger.info('%s %s member %s: %s' % (method, group_id, member.name, e))
+            return e
+
+    def _member_request(self, group_id, method, member):
+        """
+        Adds (PUT) or removes (DELETE) one member.  Returns the status.
+        """
+        dao = GWS_DAO(self._conf)
+        url = "/group_sws/v2/group/%s/member/%s" % (group_id, quote(member.name, safe=''))
+        if method == 'PUT':
+            response = dao.putURL(url, self._headers({"Content-Type": "text/xml"}), '')
+        else:
+            response = dao.deleteURL(url, self._headers({}))
+        if response.status not in (200, 201):
+            logger.info('%s %s: %s' % (method, url, response.status))
+        return response.status
+
+    def expand_members(self, group_id, max_depth=10, max_members=None, member_filter=None,
+                       max_workers=8, memo=None):
+        """
+        Expands the group identified by the passed group ID through its
+        group-type members, breadth first, and returns a
+        resttools.GroupExpansion of the non-group members found.
+
+        Each level's groups are read max_workers at a time.  A group is
+        read once however many paths lead to it; pass a dict as memo to
+        share the reads between calls (groups that could not be read are
+        not kept in it, so they are tried again).  Paths that loop back are recorded
+        as cycles, not followed.  Groups more than max_depth below the
+        group are not read, and expansion stops at max_members members.
+        member_filter(member) may reject members.
+        """
+        if not self._is_valid_group_id(group_id):
+            raise InvalidGroupID(group_id)
+
+        if memo is None:
+            memo = {}
+        result = GroupExpansion(group_id)
+        seen = set([group_id])
+        frontier = [(group_id,)]
+        depth = 0
+        failures = {}
+        pool = ThreadPool(max_workers)
+        try:
+            while frontier:
+                fetch = [path[-1] for path in frontier if path[-1] not in memo and path[-1] not in failures]
+                for gid, members in zip(fetch, pool.map(self._expansion_members, fetch)):
+                    if isinstance(members, list):
+                        memo[gid] = members
+                    else:
+                        failures[gid] = members
+                next_frontier = []
+                for path in frontier:
+                    if path[-1] in failures:
+                        if len(path) == 1:
+                            # the group itself could not be read
+                            raise failures[path[-1]]
+                        result.errors[path[-1]] = getattr(failures[path[-1]], 'status', failures[path[-1]])
+                        continue
+                    members = memo[path[-1]]
+                    for member in members:
+                        if member.member_type == GroupMember.GROUP_TYPE:
+                            if member.name in path:
+                                result.cycles.append(path + (member.name,))
+                            elif member.name not in seen:
+                                seen.add(member.name)
+                                if depth < max_depth:
+                                    next_frontier.append(path + (member.name,))
+                                    result.groups.append(member.name)
+                                else:
+                                    result.truncated = 'depth'
+                            continue
+                        key = (member.name, member.member_type)
+                        if key in result.provenance:
+                            continue
+                        if member_filter is not None and not member_filter(member):
+                            continue
+                        if max_members is not None and len(result.members) >= max_members:
+                            result.truncated = 'size'
+                            return result
+                        result.provenance[key] = path
+                        result.members.append(member)
+                frontier = next_frontier
+                depth += 1
+        finally:
+            pool.close()
+        return result
+
+    def _expansion_members(self, group_id):
+        # failures are returned, so one unreadable group does not stop the rest
+        try:
+            return list(self.get_members(group_id))
+        except (DataFailureException, InvalidGroupID) as e:
+            return e
+
+    def get_effective_members(self, group_id, limit=None, offset=0):
         """
         Returns a list of effective resttools.GroupMember objects for the
-        group identified by the passed group ID.
+        group identified by the passed group ID.  limit and offset select
+        a page of the members, as for search_groups.
         """
         if not self._is_valid_group_id(group_id):
             raise InvalidGroupID(group_id)
 
+        if limit is None and not offset:
+            if self._conf.get('GWS_COMPACT'):
+                return self._compact_members(self._effective_members_xml(group_id))
+            if self._conf.get('GWS_LAZY'):
+                return LazyMemberList(self._effective_members_xml(group_id))
+        return _page(self.iter_effective_members(group_id), limit, offset)
+
+    def iter_effective_members(self, group_id):
+        """
+        Like get_effective_members, but yields each resttools.GroupMember
+        as it is parsed, as iter_search_groups does.
+        """
+        if not self._is_valid_group_id(group_id):
+            raise InvalidGroupID(group_id)
+
+        for member in self._iterparse(self._effective_members_xml(group_id), 'member'):
+            yield GroupMember(name=member.text, member_type=member.get("type"))
+
+    def _effective_members_xml(self, group_id):
+        return self._effective_members_response(group_id).data
+
+    def _effective_members_response(self, group_id, etag=None):
         dao = GWS_DAO(self._conf)
         url = "/group_sws/v2/group/%s/effective_member" % group_id
-        response = dao.getURL(url, self._headers({"Accept": "text/xml"}))
+        headers = {"Accept": "text/xml"}
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        response = dao.getURL(url, self._headers(headers))
 
-        if response.status != 200:
+        if response.status != 200 and not (etag is not None and response.status == 304):
             raise DataFailureException(url, response.status, response.data)
 
-        return self._members_from_xml(response.data)
+        return response
+
+    def get_effective_member_names(self, group_id, etag=None):
+        """
+        Returns (names, etag): the set of effective member names of the
+        group and the ETag of the member list, if GWS sent one.  Given
+        the etag of an earlier call, names is None if the list has not
+        changed since.
+        """
+        if not self._is_valid_group_id(group_id):
+            raise InvalidGroupID(group_id)
+
+        response = self._effective_members_response(group_id, etag)
+        new_etag = response.getheader('ETag', None) or None
+        if response.status == 304:
+            return None, new_etag or etag
+        names = set(_intern(m.text) for m in self._iterparse(response.data, 'member'))
+        return names, new_etag
 
     def get_effective_member_count(self, group_id):
         """
@@ -250,73 +510,90 @@ class GWS(object):
         else:
             raise DataFailureException(url, response.status, response.data)
 
-    def _group_from_xml(self, data):
-        root = etree.fromstring(data)
-        gr = root.find('group')
-        group_id = gr.find('name').text
-        if re.match(r'^course_', group_id):
-            group = CourseGroup()
-            group.curriculum_abbr = gr.find('course_curr').text.upper()
-            group.course_number = gr.find('course_no').text
-            group.year = gr.find('course_year').text
-            group.quarter = self.QTRS[gr.find('course_qtr').text]
-            group.section_id = gr.find('course_sect').text.upper()
-            group.sln = gr.find('course_sln').text
-
-            group.instructors = []
-            instructors = (gr.find('course_instructors').findall('course_instructor'))
-            for instructor in instructors:
-                group.instructors.append(GroupMember(name=instructor.text, member_type="uwnetid"))
-        else:
-            group = Group()
-
-        group.name = group_id
-        group.uwregid = gr.find('regid').text
-        group.title = gr.find('title').text
-        group.description = gr.find('description').text
-        group.contact = gr.find('contact').text
-        group.authnfactor = gr.find('authnfactor').text
-        group.classification = gr.find('classification').text
-        group.emailenabled = gr.find('emailenabled').text
-        group.dependson = gr.find('dependson').text
-        group.publishemail = gr.find('publishemail').text
+    def is_effective_member_many(self, group_id, netids, strategy=None, point_limit=8, max_workers=8):
+        """
+        Checks each of netids for effective membership in the group and
+        returns a resttools.MembershipResult with a check per netid.  Up
+        to point_limit netids are checked concurrently one by one
+        (strategy 'point'); more are looked up in the group's fetched
+        effective member list ('fetch').
+        """
+        if not self._is_valid_group_id(group_id):
+            raise InvalidGroupID(group_id)
+
+        netids = [re.sub('@washington.edu', '', netid) for netid in netids]
+        if strategy is None:
+            strategy = 'point' if len(netids) <= point_limit else 'fetch'
+        if strategy == 'point':
+            return self._point_checks([(group_id, netid) for netid in netids], max_workers)
+        if strategy != 'fetch':
+            raise ValueError('unknown strategy: %s' % strategy)
+
+        start = time.time()
+        try:
+            # netids are not case sensitive, as the point checks GWS answers
+            names = set(m.name.lower() for m in self.iter_effective_members(group_id))
+            error = None
+        except DataFailureException as e:
+            names, error = set(), e
+        seconds = time.time() - start
+        checks = [MembershipCheck(group_id, netid, None if error else netid.lower() in names, seconds, error)
+                  for netid in netids]
+        return MembershipResult('fetch', checks, seconds)
+
+    def member_of_any(self, netid, group_ids, strategy=None, point_limit=8, max_workers=8):
+        """
+        Checks netid for effective membership in each of group_ids and
+        returns a resttools.MembershipResult, true if it is in any of
+        them.  Up to point_limit groups are checked concurrently one by
+        one (strategy 'point'); more are answered by one effective
+        membership search for netid ('search').
+        """
+        group_ids = list(group_ids)
+        for group_id in group_ids:
+            if not self._is_valid_group_id(group_id):
+                raise InvalidGroupID(group_id)
 
+        netid = re.sub('@washington.edu', '', netid)
+        if strategy is None:
+            strategy = 'point' if len(group_ids) <= point_limit else 'search'
+        if strategy == 'point':
+            return self._point_checks([(group_id, netid) for group_id in group_ids], max_workers)
+        if strategy != 'search':
+            raise ValueError('unknown strategy: %s' % strategy)
+
+        start = time.time()
+        try:
+            names = set(g.name.lower() for g in self.iter_search_groups(member=netid, type='effective'))
+            error = None
+        except DataFailureException as e:
+            names, error = set(), e
+        seconds = time.time() - start
+        checks = [MembershipCheck(group_id, netid, None if error else group_id.lower() in names, seconds, error)
+                  for group_id in group_ids]
+        return MembershipResult('search', checks, seconds)
+
+    def _point_checks(self, pairs, max_workers):
+        def check(pair):
+            start = time.time()
+            try:
+                return MembershipCheck(pair[0], pair[1], self.is_effective_member(*pair), time.time() - start)
+            except DataFailureException as e:
+                return MembershipCheck(pair[0], pair[1], None, time.time() - start, e)
+
+        start = time.time()
+        if not pairs:
+            return MembershipResult('point', [], 0.0)
+        pool = ThreadPool(min(max_workers, len(pairs)))
         try:
-            group.reporttoorig = gr.find('reporttoorig').text
-        except AttributeError:
-            # Legacy class name for this attribute
-            group.reporttoorig = gr.find('reporttoowner').text
-
-        for user in gr.find('admins').findall('admin'):
-            group.admins.append(GroupUser(user.text,
-                                          user_type=user.get('type')))
-
-        for user in gr.find('updaters').findall('updater'):
-            group.updaters.append(GroupUser(name=user.text,
-                                            user_type=user.get("type")))
-
-        for user in gr.find('creators').findall('creator'):
-            group.creators.append(GroupUser(name=user.text,
-                                            user_type=user.get("type")))
-
-        for user in gr.find('readers').findall('reader'):
-            group.readers.append(GroupUser(name=user.text,
-                                           user_type=user.get("type")))
-
-        for user in gr.find('optins').findall('optin'):
-            group.optins.append(GroupUser(name=user.text,
-                                          user_type=user.get("type")))
-
-        for user in gr.find('optouts').findall('optout'):
-            group.optouts.append(GroupUser(name=user.text,
-                                           user_type=user.get("type")))
-
-        # viewers are not used according to Jim Fox
-        # group.viewers = []
-        # for user in gr.find('viewers').findall('viewer'):
-        #     group.viewers.append(GroupUser(name=user.text,
-        #                                    user_type=user.get("type")))
-        return group
+            checks = pool.map(check, pairs)
+        finally:
+            pool.close()
+        return MembershipResult('point', checks, time.time() - start)
+
+    def _group_from_xml(self, data):
+        root = etree.fromstring(data)
+        return _group_from_element(root.find('group'))
 
     def _xml_from_group(self, group):
         template = self._j2env.get_template("group.xml")
@@ -333,6 +610,9 @@ class GWS(object):
 
         return members
 
+    def _compact_members(self, data):
+        return CompactMemberList((m.text, m.get('type')) for m in self._iterparse(data, 'member'))
+
     def _notfoundmembers_from_xml(self, data):
         members = []
         root = etree.fromstring(data)
@@ -345,9 +625,35 @@ class GWS(object):
 
         return members
 
-    def _xml_from_members(self, group_id, members):
+    def _stream_members_xml(self, group_id, members):
+        """
+        Yields the members document in chunks of about STREAM_CHUNK_SIZE
+        bytes, reading members as it goes.
+        """
         template = self._j2env.get_template("members.xml")
-        return template.render({"group_id": group_id, "members": members})
+        chunk = []
+        size = 0
+        for part in template.generate({"group_id": group_id, "members": members}):
+            part = part.encode('utf-8')
+            chunk.append(part)
+            size += len(part)
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+        if chunk:
+            yield ''.join(chunk)
+
+    def _iterparse(self, data, tag):
+        """
+        Yields each tag element of the XML document data when its end tag
+        is parsed, then frees it and the elements before it.
+        """
+        for event, e in etree.iterparse(StringIO(data), events=('end',), tag=tag):
+            yield e
+            e.clear()
+            while e.getprevious() is not None:
+                del e.getparent()[0]
 
     def _is_valid_group_id(self, group_id):
         if not re.match(r'^[a-z0-9][\w\.-]+$', group_id, re.I):
@@ -367,3 +673,390 @@ class GWS(object):
 
         headers[header] = value
         return headers
+
+
+def _intern(name):
+    # member names repeat across groups and refreshes; keep one copy
+    return intern(name) if isinstance(name, str) else name
+
+
+def _page(items, limit=None, offset=0):
+    """
+    Returns the list of items from offset, at most limit of them, without
+    consuming items past the page.
+    """
+    stop = None if limit is None else offset + limit
+    return list(islice(items, offset, stop))
+
+
+# Group XML is parsed in one pass over the <group> element's children:
+# each child's tag picks a handler from a table, which stores the
+# child's value under the attribute name.
+
+def _field(attr, convert=None, legacy=False):
+    def handler(fields, e):
+        value = e.text if convert is None or e.text is None else convert(e.text)
+        if legacy:
+            # only used when the current name is absent
+            fields.setdefault(attr, value)
+        else:
+            fields[attr] = value
+    handler.attr = attr
+    return handler
+
+
+def _users(attr, tag):
+    def handler(fields, e):
+        fields[attr] = [GroupUser(name=u.text, user_type=u.get('type')) for u in e.iterchildren(tag)]
+    handler.attr = attr
+    handler.default = list
+    return handler
+
+
+def _instructors(fields, e):
+    fields['instructors'] = [GroupMember(name=i.text, member_type="uwnetid")
+                             for i in e.iterchildren('course_instructor')]
+_instructors.attr = 'instructors'
+_instructors.default = list
+
+
+GROUP_FIELDS = {
+    'regid': _field('uwregid'),
+    'title': _field('title'),
+    'description': _field('description'),
+    'contact': _field('contact'),
+    'authnfactor': _field('authnfactor'),
+    'classification': _field('classification'),
+    'emailenabled': _field('emailenabled'),
+    'dependson': _field('dependson'),
+    'publishemail': _field('publishemail'),
+    'reporttoorig': _field('reporttoorig'),
+    'reporttoowner': _field('reporttoorig', legacy=True),
+    'admins': _users('admins', 'admin'),
+    'updaters': _users('updaters', 'updater'),
+    'creators': _users('creators', 'creator'),
+    'readers': _users('readers', 'reader'),
+    'optins': _users('optins', 'optin'),
+    'optouts': _users('optouts', 'optout'),
+    # viewers are not used according to Jim Fox
+}
+
+COURSE_FIELDS = {
+    'course_curr': _field('curriculum_abbr', lambda v: v.upper()),
+    'course_no': _field('course_number'),
+    'course_year': _field('year'),
+    'course_qtr': _field('quarter', lambda v: GWS.QTRS[v]),
+    'course_sect': _field('section_id', lambda v: v.upper()),
+    'course_sln': _field('sln'),
+    'course_instructors': _instructors,
+}
+
+COURSE_GROUP_FIELDS = dict(GROUP_FIELDS, **COURSE_FIELDS)
+
+GROUPREFERENCE_FIELDS = {
+    'regid': _field('uwregid'),
+    'title': _field('title'),
+    'description': _field('description'),
+    'name': _field('name'),
+}
+
+
+def _parse_children(element, table, fields):
+    """
+    Dispatches each child of element to its handler in table, which
+    sets its value in the fields dict.  Other children are skipped.
+    """
+    for e in element.iterchildren():
+        handler = table.get(e.tag)
+        if handler is not None:
+            handler(fields, e)
+    return fields
+
+
+def _group_from_element(gr):
+    """
+    Returns a Group (CourseGroup for course_ groups) for a <group> element.
+    """
+    group_id = gr.findtext('name')
+    if re.match(r'^course_', group_id):
+        group = CourseGroup()
+        table = COURSE_GROUP_FIELDS
+    else:
+        group = Group()
+        table = GROUP_FIELDS
+    group.__dict__.update(_parse_children(gr, table, {}))
+    group.name = group_id
+    return group
+
+
+class _LazyField(object):
+    """
+    A group attribute parsed from the group's XML on first access.
+    """
+
+    def __init__(self, attr, sources, default):
+        self._attr = attr
+        self._sources = sources
+        self._default = default
+
+    def __get__(self, group, cls):
+        if group is None:
+            return self
+        try:
+            return group.__dict__[self._attr]
+        except KeyError:
+            pass
+        fields = {}
+        children = group._children()
+        for tag, handler in self._sources:
+            if tag in children:
+                handler(fields, children[tag])
+        value = fields.get(self._attr, self._default() if callable(self._default) else self._default)
+        group.__dict__[self._attr] = value
+        return value
+
+    def __set__(self, group, value):
+        group.__dict__[self._attr] = value
+
+
+def _add_lazy_fields(cls, table):
+    sources = {}
+    for tag, handler in table.items():
+        sources.setdefault(handler.attr, []).append((tag, handler))
+    for attr in sources:
+        default = getattr(sources[attr][0][1], 'default', getattr(cls, attr, ''))
+        setattr(cls, attr, _LazyField(attr, sources[attr], default))
+
+
+class _LazyGroupBase(object):
+    """
+    Holds a group's XML; the _LazyField attributes parse it when first
+    read.  The XML is parsed at most once, into an index of the
+    <group> element's children.
+    """
+
+    def __init__(self, name, data):
+        self.__dict__['name'] = name
+        self._data = data
+        self._index = None
+
+    def _children(self):
+        if self._index is None:
+            gr = etree.fromstring(self._data).find('group')
+            self._index = dict((e.tag, e) for e in gr.iterchildren())
+            self._data = None
+        return self._index
+
+
+class LazyGroup(_LazyGroupBase, Group):
+    """
+    A Group whose fields and ACL lists are parsed from the XML when first
+    read.  Returned by get_group_by_id when conf['GWS_LAZY'] is set.
+    """
+
+
+class LazyCourseGroup(_LazyGroupBase, CourseGroup):
+    """
+    The CourseGroup counterpart of LazyGroup.
+    """
+
+
+_add_lazy_fields(LazyGroup, GROUP_FIELDS)
+_add_lazy_fields(LazyCourseGroup, COURSE_GROUP_FIELDS)
+
+
+class LazyMemberList(object):
+    """
+    A read-only list of GroupMember objects over a members document.
+    The document is parsed on first use; each GroupMember is made when
+    its item is first read.  Returned by get_members and
+    get_effective_members when conf['GWS_LAZY'] is set.
+    """
+
+    def __init__(self, data):
+        self._data = data
+        self._members = None
+        self._objects = None
+
+    def _load(self):
+        if self._members is None:
+            e_mbrs = etree.fromstring(self._data).find('group').find('members')
+            self._members = [(m.text, m.get('type')) for m in e_mbrs.iterchildren('member')]
+            self._objects = [None] * len(self._members)
+            self._data = None
+        return self._members
+
+    def __len__(self):
+        return len(self._load())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        members = self._load()
+        member = self._objects[index]
+        if member is None:
+            name, member_type = members[index]
+            member = self._objects[index] = GroupMember(name=name, member_type=member_type)
+        return member
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def names(self):
+        """
+        The member names, without making GroupMember objects.
+        """
+        return [name for name, member_type in self._load()]
+
+
+# member types, by code; codes are assigned as types are first seen
+_member_types = [GroupMember.UWNETID_TYPE, GroupMember.EPPN_TYPE, GroupMember.GROUP_TYPE, GroupMember.DNS_TYPE]
+_member_type_codes = dict((t, code) for code, t in enumerate(_member_types))
+_member_types_lock = threading.Lock()
+
+
+def _member_type_code(member_type):
+    code = _member_type_codes.get(member_type)
+    if code is None:
+        with _member_types_lock:
+            code = _member_type_codes.get(member_type)
+            if code is None:
+                _member_types.append(member_type)
+                code = _member_type_codes[member_type] = len(_member_types) - 1
+    return code
+
+
+class CompactMemberList(object):
+    """
+    A read-only list of GroupMember objects held compactly: the names
+    are packed end to end in one UTF-8 string with an array of offsets,
+    and each member's type is a one-byte code.  GroupMember objects
+    are made as items are read and not kept.  in, difference and
+    intersection compare (name, member_type) through a sorted index
+    built on first use; a plain name tests for a member of any type.
+    Returned by get_members and get_effective_members when
+    conf['GWS_COMPACT'] is set.
+    """
+    __slots__ = ('_names', '_offsets', '_types', '_order')
+
+    def __init__(self, members=()):
+        """
+        members are GroupMember objects or (name, member_type) pairs.
+        """
+        names = []
+        offsets = array('I', [0])
+        types = array('B')
+        end = 0
+        for member in members:
+            if isinstance(member, tuple):
+                name, member_type = member
+            else:
+                name, member_type = member.name, member.member_type
+            if isinstance(name, unicode):
+                name = name.encode('utf-8')
+            names.append(name)
+            end += len(name)
+            offsets.append(end)
+            types.append(_member_type_code(member_type))
+        self._names = ''.join(names)
+        self._offsets = offsets
+        self._types = types
+        self._order = None
+
+    def __len__(self):
+        return len(self._types)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('member index out of range')
+        return GroupMember(name=self._name(index), member_type=_member_types[self._types[index]])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __contains__(self, member):
+        if isinstance(member, basestring):
+            return self._find(member, None) is not None
+        if isinstance(member, tuple):
+            return self._find(*member) is not None
+        return self._find(member.name, member.member_type) is not None
+
+    def _name(self, index):
+        name = self._raw_name(index)
+        # as lxml gives them: str for ASCII names, unicode otherwise
+        try:
+            name.decode('ascii')
+        except UnicodeDecodeError:
+            return name.decode('utf-8')
+        return name
+
+    def _raw_name(self, index):
+        return self._names[self._offsets[index]:self._offsets[index + 1]]
+
+    def _index(self):
+        if self._order is None:
+            self._order = array('I', sorted(range(len(self)), key=lambda i: (self._raw_name(i), self._types[i])))
+        return self._order
+
+    def _find(self, name, member_type):
+        """
+        The index of a member with name (and member_type, unless None),
+        or None.
+        """
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        order = self._index()
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._raw_name(order[mid]) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        # members of the same name are next to each other, by type code
+        while lo < len(order) and self._raw_name(order[lo]) == name:
+            if member_type is None or _member_types[self._types[order[lo]]] == member_type:
+                return order[lo]
+            lo += 1
+        return None
+
+    def names(self):
+        """
+        The member names, without making GroupMember objects.
+        """
+        return [self._name(index) for index in range(len(self))]
+
+    def keys(self):
+        """
+        The set of (name, member_type) of the members.
+        """
+        return set((self._name(index), _member_types[self._types[index]]) for index in range(len(self)))
+
+    def difference(self, other):
+        """
+        The members not in other (a CompactMemberList, or GroupMember
+        objects), as a CompactMemberList, in this list's order.
+        """
+        if not isinstance(other, CompactMemberList):
+            other = CompactMemberList(other)
+        return CompactMemberList(self._pairs(lambda name, member_type: (name, member_type) not in other))
+
+    def intersection(self, other):
+        """
+        The members also in other, as for difference.
+        """
+        if not isinstance(other, CompactMemberList):
+            other = CompactMemberList(other)
+        return CompactMemberList(self._pairs(lambda name, member_type: (name, member_type) in other))
+
+    def _pairs(self, keep):
+        for index in range(len(self)):
+            pair = (self._name(index), _member_types[self._types[index]])
+            if keep(*pair):
+                yield pair
@@ -0,0 +1,173 @@
+"""
+An in-process index of IRWS identifiers.
+
+IRWS answers many calls that only translate one identifier into another
+(netid to regid, regid to netids, employee id to netid...).  Every response
+the IRWS client parses tells us some of these mappings, so we keep them here
+and let the client answer later translations without a round trip.
+
+Identifiers (netid, regid, (source, validid)) all resolve to the canonical
+regid of the entity.  Records (UWNetId lists, Regid and Person objects) are
+stored under that regid.  Entries expire after ttl seconds and the index
+holds at most max_size entries, dropping the least recently used.
+"""
+
+import copy
+import time
+import threading
+from collections import OrderedDict
+
+
+class IdentityIndex(object):
+
+    def __init__(self, ttl=300, max_size=10000):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, key):
+        """
+        Returns the value stored under key, or None if it is missing
+        or has expired.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                return None
+            # re-insert to mark as most recently used
+            self._entries[key] = entry
+            return entry[1]
+
+    def put(self, key, value):
+        if self._max_size <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self._ttl, value)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    # identifier resolution
+
+    def resolve(self, netid=None, regid=None, source=None, eid=None):
+        """
+        Returns the canonical regid for the given identifier, if known.
+        """
+        key = self._id_key(netid=netid, regid=regid, source=source, eid=eid)
+        if key is None:
+            return None
+        return self.get(key)
+
+    def link(self, regid, netid=None, source=None, eid=None, alias=None):
+        """
+        Records that the identifiers belong to the entity with regid.
+        """
+        if not regid:
+            return
+        self.put(('regid', regid), regid)
+        if alias:
+            self.put(('regid', alias), regid)
+        if netid:
+            self.put(('netid', netid.lower()), regid)
+        if source is not None and eid:
+            self.put(('eid', str(source), str(eid)), regid)
+
+    def forget(self, **ids):
+        """
+        Drops the records of the entity with the given identifier, after
+        a write that may have changed them.  Identifier links are kept.
+        An eid without a source matches the eid from any source.
+        """
+        with self._lock:
+            if ids.get('eid') is not None and ids.get('source') is None:
+                regids = set(entry[1] for key, entry in self._entries.items()
+                             if key[0] == 'eid' and key[2] == str(ids['eid']))
+            else:
+                key = self._id_key(**ids)
+                regids = set([self._entries[key][1]]) if key in self._entries else set()
+            for key in list(self._entries):
+                if key[0] in ('uwnetids', 'person', 'regid_obj') and key[1] in regids:
+                    del self._entries[key]
+
+    # records
+
+    def add_uwnetids(self, uwnetids, status=None, **ids):
+        """
+        Stores the complete uwnetid list returned for an entity.
+        ids are the identifiers used for the query.
+        """
+        if not uwnetids:
+            return
+        regid = uwnetids[0].validid
+        self._link_query(regid, ids)
+        for uwnetid in uwnetids:
+            self.link(regid, netid=uwnetid.uwnetid)
+        self.put(('uwnetids', regid, status), copy.deepcopy(uwnetids))
+
+    def get_uwnetids(self, status=None, **ids):
+        """
+        Returns the uwnetid list for the entity, filtered by status, or
+        None if it is not known.
+        """
+        regid = self.resolve(**ids)
+        if regid is None:
+            return None
+        uwnetids = self.get(('uwnetids', regid, status))
+        if uwnetids is None and status is not None:
+            uwnetids = self.get(('uwnetids', regid, None))
+            if uwnetids is not None:
+                uwnetids = [n for n in uwnetids if n.status_code == str(status)]
+        if not uwnetids:
+            return None
+        return copy.deepcopy(uwnetids)
+
+    def add_person(self, person, **ids):
+        if not person.regid:
+            return
+        self._link_query(person.regid, ids)
+        self.put(('person', person.regid), copy.deepcopy(person))
+
+    def get_person(self, **ids):
+        return self._get_record('person', ids)
+
+    def add_regid(self, record, **ids):
+        # record, not regid: regid may be one of the query ids
+        if not record.regid:
+            return
+        self._link_query(record.regid, ids)
+        self.put(('regid_obj', record.regid), copy.deepcopy(record))
+
+    def get_regid(self, **ids):
+        return self._get_record('regid_obj', ids)
+
+    def _get_record(self, kind, ids):
+        regid = self.resolve(**ids)
+        if regid is None:
+            return None
+        record = self.get((kind, regid))
+        if record is None:
+            return None
+        return copy.deepcopy(record)
+
+    def _link_query(self, regid, ids):
+        self.link(regid, netid=ids.get('netid'), source=ids.get('source'),
+                  eid=ids.get('eid'), alias=ids.get('regid'))
+
+    def _id_key(self, netid=None, regid=None, source=None, eid=None):
+        if regid is not None:
+            return ('regid', regid)
+        if netid is not None:
+            return ('netid', netid.lower())
+        if source is not None and eid is not None:
+            return ('eid', str(source), str(eid))
+        return None
@@ -7,6 +7,7 @@ import time
 import re
 import random
 import copy
+import threading
 
 import json
 
@@ -25,10 +26,15 @@ from resttools.models.irws import QnA
 from resttools.models.irws import GenericPerson
 
 from resttools.exceptions import DataFailureException
+from resttools.identity_index import IdentityIndex
 
 import logging
 logger = logging.getLogger(__name__)
 
+# identity indexes, shared by all IRWS clients of the same service
+_identity_indexes = {}
+_identity_indexes_lock = threading.Lock()
+
 
 class IRWS(object):
 
@@ -37,6 +43,18 @@ class IRWS(object):
         self._service_name = conf['SERVICE_NAME']
         self._conf = conf
         self.new_ids = set([])
+        self._index = self._get_identity_index()
+
+    def _get_identity_index(self):
+        # opt in: answers from the index can be up to IDENTITY_INDEX_TTL old
+        if not self._conf.get('IDENTITY_INDEX'):
+            return IdentityIndex(max_size=0)
+        key = (self._conf.get('HOST'), self._service_name)
+        with _identity_indexes_lock:
+            if key not in _identity_indexes:
+                _identity_indexes[key] = IdentityIndex(ttl=self._conf.get('IDENTITY_INDEX_TTL', 300),
+                                                       max_size=self._conf.get('IDENTITY_INDEX_SIZE', 10000))
+            return _identity_indexes[key]
 
     def _get_code_from_error(self, message):
         try:
@@ -59,12 +77,22 @@ class IRWS(object):
         dao = IRWS_DAO(self._conf)
         if eid is not None and source is not None:
             url = "/%s/v1/uwnetid?validid=%d=%s%s" % (self._service_name, source, eid, status_str)
+            ids = {'source': source, 'eid': eid}
         elif regid is not None:
             url = "/%s/v1/uwnetid?validid=regid=%s%s" % (self._service_name, regid, status_str)
+            ids = {'regid': regid}
         elif netid is not None:
             url = "/%s/v1/uwnetid?validid=uwnetid=%s%s" % (self._service_name, netid, status_str)
+            ids = {'netid': netid}
         else:
             return None
+
+        uwnetids = self._index.get_uwnetids(status=status, **ids)
+        if uwnetids is not None:
+            if ret_array:
+                return uwnetids
+            return uwnetids[0]
+
         response = dao.getURL(url, {"Accept": "application/json"})
 
         if response.status == 404:
@@ -74,13 +102,14 @@ class IRWS(object):
             raise DataFailureException(url, response.status, response.data)
 
         id_data = json.loads(response.data)['uwnetid']
+        ret = []
+        for n in range(0, len(id_data)):
+            ret.append(self._uwnetid_from_json_obj(id_data[n]))
+        self._index.add_uwnetids(ret, status=status, **ids)
         if ret_array:
-            ret = []
-            for n in range(0, len(id_data)):
-                ret.append(self._uwnetid_from_json_obj(id_data[n]))
             return ret
         else:
-            return self._uwnetid_from_json_obj(id_data[0])
+            return ret[0]
 
     def get_person(self, netid=None, regid=None, eid=None):
         """
@@ -92,12 +121,20 @@ class IRWS(object):
         url = None
         if netid is not None:
             url = "/%s/v1/person?uwnetid=%s" % (self._service_name, netid.lower())
+            ids = {'netid': netid}
         elif regid is not None:
             url = "/%s/v1/person?validid=regid=%s" % (self._service_name, regid)
+            ids = {'regid': regid}
         elif eid is not None:
             url = "/%s/v1/person?validid=1=%s" % (self._service_name, eid)
+            ids = {'source': 1, 'eid': eid}
         else:
             return None
+
+        person = self._index.get_person(**ids)
+        if person is not None:
+            return person
+
         response = dao.getURL(url, {"Accept": "application/json"})
 
         if response.status == 404:
@@ -106,7 +143,9 @@ class IRWS(object):
         if response.status != 200:
             raise DataFailureException(url, response.status, response.data)
 
-        return self._person_from_json(response.data)
+        person = self._person_from_json(response.data)
+        self._index.add_person(person, **ids)
+        return person
 
     def get_regid(self, netid=None, regid=None):
         """
@@ -118,10 +157,17 @@ class IRWS(object):
         url = None
         if netid is not None:
             url = "/%s/v1/regid?uwnetid=%s" % (self._service_name, netid.lower())
+            ids = {'netid': netid}
         elif regid is not None:
             url = "/%s/v1/regid?validid=regid=%s" % (self._service_name, regid)
+            ids = {'regid': regid}
         else:
             return None
+
+        ret = self._index.get_regid(**ids)
+        if ret is not None:
+            return ret
+
         response = dao.getURL(url, {"Accept": "application/json"})
 
         if response.status == 404:
@@ -130,7 +176,9 @@ class IRWS(object):
         if response.status != 200:
             raise DataFailureException(url, response.status, response.data)
 
-        return self._regid_from_json(response.data)
+        ret = self._regid_from_json(response.data)
+        self._index.add_regid(ret, **ids)
+        return ret
 
     def get_pw_recover_info(self, netid):
         """
@@ -159,6 +207,7 @@ class IRWS(object):
         dao = IRWS_DAO(self._conf)
         url = "/%s/v1/profile/validid=uwnetid=%s" % (self._service_name, netid)
         response = dao.putURL(url, {"Content-type": "application/json"}, json.dumps(profile.json_data()))
+        self._index.forget(netid=netid)
 
         if response.status >= 500:
             raise DataFailureException(url, response.status, response.data)
@@ -220,7 +269,9 @@ class IRWS(object):
         if response.status != 200:
             raise DataFailureException(url, response.status, response.data)
 
-        return self._uwhr_person_from_json(response.data)
+        person = self._uwhr_person_from_json(response.data)
+        self._index.link(person.regid, source=person.source_code, eid=person.validid)
+        return person
 
     def get_sdb_person(self, vid):
         """
@@ -240,7 +291,9 @@ class IRWS(object):
         if response.status != 200:
             raise DataFailureException(url, response.status, response.data)
 
-        return self._sdb_person_from_json(response.data)
+        person = self._sdb_person_from_json(response.data)
+        self._index.link(person.regid, source=person.source_code, eid=person.validid)
+        return person
 
     def get_supplemental_person(self, id):
         """
@@ -304,6 +357,8 @@ class IRWS(object):
         dao = IRWS_DAO(self._conf)
         url = "/%s/v1/person/%s/%s/pac" % (self._service_name, source, eid)
         response = dao.putURL(url, {"Accept": "application/json"}, '')
+        # the index keeps sources by code, not name: match the eid alone
+        self._index.forget(eid=eid)
 
         if response.status != 200:
             raise DataFailureException(url, response.status, response.data)
@@ -522,6 +577,8 @@ class IRWS(object):
         uwnetid.uwnetid = id_data['uwnetid']
         uwnetid.validid = id_data['validid']
         uwnetid.uid = id_data['uid']
+        if 'status_code' in id_data:
+            uwnetid.status_code = id_data['status_code']
         return uwnetid
 
     def _subscription_from_json(self, data):
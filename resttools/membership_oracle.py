@@ -0,0 +1,206 @@
+"""
+An in-process oracle of GWS effective membership.
+
+Request-time authorization asks is_effective_member about the same few
+groups over and over.  The oracle keeps the effective member names of
+registered groups in memory, refreshed in the background, and answers
+from them:
+
+    oracle = MembershipOracle(GWS(conf), max_age=300)
+    admins = oracle.register('u_acme_admins')
+    oracle.start()
+    ...
+    if admins.contains(netid): ...
+    if oracle.contains('u_acme_admins', netid): ...
+
+A group's names are trusted for max_age seconds after they were last
+loaded (or found unchanged).  Groups that are not registered, not yet
+loaded or staler than that are checked live with is_effective_member.
+Refreshes send the ETag of the last load, when GWS sent one, so an
+unchanged group costs a 304 and no parse.
+"""
+
+import re
+import time
+import threading
+
+from resttools.exceptions import DataFailureException, InvalidGroupID
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class GroupMembership(object):
+    """
+    The oracle's members of one group.  names is a frozenset of
+    lowercased names, replaced whole on refresh, so readers need no
+    lock.
+    """
+
+    def __init__(self, oracle, group_id):
+        self._oracle = oracle
+        self.group_id = group_id
+        self.names = None
+        self.etag = None
+        self.loaded = None
+        self.attempted = None
+        self.error = None
+
+    def __len__(self):
+        return len(self.names or ())
+
+    @property
+    def age(self):
+        """
+        Seconds since the names were last known current, or None.
+        """
+        if self.loaded is None:
+            return None
+        return time.time() - self.loaded
+
+    def is_fresh(self):
+        return self.names is not None and time.time() - self.loaded <= self._oracle.max_age
+
+    def contains(self, netid):
+        """
+        Returns True if netid is an effective member, from memory if the
+        names are fresh, live otherwise.
+        """
+        return self._oracle.contains(self.group_id, netid)
+
+    def refresh(self):
+        """
+        Reloads the names, or keeps them if GWS says they are unchanged.
+        Returns True on success; a failure is logged and kept in error,
+        and the old names age out.
+        """
+        gws = self._oracle.gws
+        start = self.attempted = time.time()
+        try:
+            names, etag = gws.get_effective_member_names(self.group_id, self.etag if self.names is not None else None)
+        except DataFailureException as e:
+            self.error = e
+            logger.warning('membership refresh of %s failed: %s' % (self.group_id, e))
+            return False
+        # loaded first: a reader that sees the new names sees their time
+        self.loaded = start
+        if names is not None:
+            # netids are not case sensitive: is_effective_member ignores case
+            self.names = frozenset(name.lower() for name in names)
+        self.etag = etag
+        self.error = None
+        return True
+
+
+class MembershipOracle(object):
+    """
+    Effective membership of registered groups from memory.  Names older
+    than max_age seconds are not used; the background refresh (start)
+    reloads each group every refresh_interval seconds, max_age / 2 by
+    default.  With live_fallback False, contains raises LookupError for
+    groups it cannot answer from memory.
+    """
+
+    def __init__(self, gws, max_age=300, refresh_interval=None, live_fallback=True):
+        self.gws = gws
+        self.max_age = max_age
+        self.refresh_interval = refresh_interval if refresh_interval is not None else max_age / 2.0
+        self.live_fallback = live_fallback
+        self._groups = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.fallbacks = 0
+
+    def __len__(self):
+        return len(self._groups)
+
+    def register(self, group_id, load=True):
+        """
+        Starts keeping group_id's members and returns its GroupMembership.
+        With load, the members are loaded now.
+        """
+        if not self.gws._is_valid_group_id(group_id):
+            raise InvalidGroupID(group_id)
+        with self._lock:
+            group = self._groups.get(group_id)
+            if group is None:
+                group = self._groups[group_id] = GroupMembership(self, group_id)
+        if load and group.names is None:
+            group.refresh()
+        return group
+
+    def unregister(self, group_id):
+        with self._lock:
+            self._groups.pop(group_id, None)
+
+    def group(self, group_id):
+        """
+        The GroupMembership of a registered group, or None.
+        """
+        return self._groups.get(group_id)
+
+    def contains(self, group_id, netid):
+        """
+        Returns True if netid is an effective member of group_id.
+        """
+        # as is_effective_member: GWS knows UW users by netid, not EPPN
+        netid = re.sub('@washington.edu', '', netid)
+        group = self._groups.get(group_id)
+        if group is not None:
+            names = group.names
+            if names is not None and time.time() - group.loaded <= self.max_age:
+                with self._lock:
+                    self.hits += 1
+                return netid.lower() in names
+        if not self.live_fallback:
+            raise LookupError('no fresh members of %s' % group_id)
+        with self._lock:
+            self.fallbacks += 1
+        return self.gws.is_effective_member(group_id, netid)
+
+    def refresh(self, force=False):
+        """
+        Refreshes the groups last tried refresh_interval or more seconds
+        ago (all of them with force).  Returns the number refreshed.
+        """
+        count = 0
+        now = time.time()
+        for group in self._groups.values():
+            if force or group.attempted is None or now - group.attempted >= self.refresh_interval:
+                group.refresh()
+                count += 1
+        return count
+
+    def start(self):
+        """
+        Refreshes from a background thread until stop.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='membership-oracle')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('membership oracle refresh failed')
+            self._stop.wait(self._next_refresh())
+
+    def _next_refresh(self):
+        # seconds until the next group is due
+        now = time.time()
+        due = [self.refresh_interval - (now - group.attempted) if group.attempted is not None else 0
+               for group in self._groups.values()]
+        return max(min(due or [self.refresh_interval]), 0.01)
@@ -0,0 +1,133 @@
+"""
+A stand-in cache server for tests and benchmarks.  It speaks the subset
+of the memcached text protocol used by MemcachedCache (get, set, add,
+delete), so several of them can stand in for a cache cluster.
+
+    server = MockCacheServer()
+    server.start()
+    ... MemcachedCache(['%s:%d' % server.address]) ...
+    server.stop()
+"""
+
+import sys
+import time
+import socket
+import threading
+import SocketServer
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+
+    def setup(self):
+        SocketServer.StreamRequestHandler.setup(self)
+        self.server.clients.add(self.request)
+
+    def finish(self):
+        self.server.clients.discard(self.request)
+        try:
+            SocketServer.StreamRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = line.split()
+            if not args:
+                continue
+            cmd = args[0]
+            if cmd == 'get' or cmd == 'gets':
+                reply = []
+                for key in args[1:]:
+                    value = self.server.get(key)
+                    if value is not None:
+                        reply.append('VALUE %s %s %d\r\n%s\r\n' % (key, value[1], len(value[2]), value[2]))
+                reply.append('END\r\n')
+                self.wfile.write(''.join(reply))
+            elif cmd in ('set', 'add') and len(args) >= 5:
+                data = self.rfile.read(int(args[4]) + 2)[:-2]
+                stored = self.server.store(args[1], args[2], int(args[3]), data, cmd == 'add')
+                self.wfile.write('STORED\r\n' if stored else 'NOT_STORED\r\n')
+            elif cmd == 'delete' and len(args) >= 2:
+                deleted = self.server.delete(args[1])
+                self.wfile.write('DELETED\r\n' if deleted else 'NOT_FOUND\r\n')
+            elif cmd == 'quit':
+                return
+            else:
+                self.wfile.write('ERROR\r\n')
+            self.wfile.flush()
+
+
+class MockCacheServer(SocketServer.ThreadingTCPServer):
+    """
+    An in-memory memcached stand-in.  Use port 0 for any free port;
+    the bound (host, port) is in .address once created.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        SocketServer.ThreadingTCPServer.__init__(self, (host, port), _Handler)
+        self.address = self.server_address
+        self.clients = set()
+        self._data = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None and value[0] and value[0] < time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def store(self, key, flags, exptime, data, add=False):
+        expires = 0
+        if exptime:
+            expires = time.time() + exptime
+        with self._lock:
+            current = self._data.get(key)
+            if add and current is not None and not (current[0] and current[0] < time.time()):
+                return False
+            self._data[key] = (expires, flags, data)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def handle_error(self, request, client_address):
+        # clients dropped by stop() are expected
+        if not isinstance(sys.exc_info()[1], socket.error):
+            SocketServer.ThreadingTCPServer.handle_error(self, request, client_address)
+
+    def start(self):
+        """
+        Serves from a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        # drop open connections too, like a node going down
+        for client in list(self.clients):
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+if __name__ == '__main__':
+    port = 11211
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    MockCacheServer(port=port).serve_forever()
@@ -0,0 +1,408 @@
+"""
+Generates synthetic GWS and IRWS mock data at production scale.
+
+    python -m resttools.mock.generate <out> [--persons N] [--groups N]
+        [--max-members N] [--seed N] [--archive] [--irws-service NAME]
+
+writes a mock tree under out (gws/ and irws/, use as MOCK_ROOT), or with
+--archive a packed archive at out (use as MOCK_ARCHIVE).  The same seed
+always gives the same data.
+
+Persons have a regid, uwnetid, name and recovery profile; some are
+employees (uwhr) and some students (sdb).  Groups have heavy-tailed
+member counts (a few huge, most small) and some have other groups as
+members, so effective membership differs from direct membership.  For
+each group there is the group, member, effective_member and count
+resource, and per member effective_member checks; searches by stem and
+by member (direct and effective) list the groups that match.  Member
+names, regids and validids all refer to generated persons.
+"""
+
+import os
+import sys
+import json
+import random
+import hashlib
+import argparse
+from urllib import urlencode
+from xml.sax.saxutils import escape
+
+from resttools.dao_implementation.mock import MockArchiveWriter, convert_to_platform_safe
+
+import logging
+logger = logging.getLogger(__name__)
+
+FNAMES = ['JAMES', 'MARY', 'ROBERT', 'PATRICIA', 'JOHN', 'JENNIFER', 'MICHAEL', 'LINDA', 'DAVID',
+          'ELIZABETH', 'WILLIAM', 'BARBARA', 'RICHARD', 'SUSAN', 'JOSEPH', 'JESSICA', 'THOMAS', 'SARAH',
+          'WEI', 'PRIYA', 'AHMED', 'SOFIA', 'HIROSHI', 'OLUWASEUN', 'MATEO', 'ANH', 'FATIMA', 'IVAN']
+LNAMES = ['SMITH', 'JOHNSON', 'WILLIAMS', 'BROWN', 'JONES', 'GARCIA', 'MILLER', 'DAVIS', 'RODRIGUEZ',
+          'MARTINEZ', 'HERNANDEZ', 'LOPEZ', 'GONZALEZ', 'WILSON', 'ANDERSON', 'THOMAS', 'TAYLOR', 'MOORE',
+          'NGUYEN', 'KIM', 'PATEL', 'CHEN', 'WANG', 'SATO', 'OKAFOR', 'IVANOV', 'KOWALSKI', 'SILVA']
+STEMS = ['uwit', 'med', 'eng', 'lib', 'astra', 'fin', 'hr', 'cs', 'art', 'law', 'nurs', 'bio']
+WORDS = ['staff', 'admins', 'devs', 'readers', 'team', 'lab', 'ops', 'committee', 'students', 'faculty']
+
+
+class Person(object):
+    """
+    A generated registry person.  Everything is derived from seed and
+    index, so persons are never stored.
+    """
+
+    def __init__(self, seed, index):
+        digest = hashlib.md5('%s:person:%d' % (seed, index)).hexdigest()
+        pick = int(digest[:8], 16)
+        self.index = index
+        self.regid = digest.upper()
+        self.fname = FNAMES[pick % len(FNAMES)]
+        self.lname = LNAMES[(pick // len(FNAMES)) % len(LNAMES)]
+        self.uwnetid = '%s%d' % (self.fname[0].lower() + self.lname[:5].lower(), index)
+        self.uid = str(100000 + index)
+        kind = int(digest[8:10], 16) % 4
+        # a quarter are employees, half students, a quarter both
+        self.eid = '8%08d' % index if kind in (0, 3) else None
+        self.sid = '0%08d' % index if kind in (1, 2, 3) else None
+        self.studentid = str(1000000 + index)
+
+
+class MockTreeWriter(object):
+    """
+    Writes mock data files under root, one directory per service.
+    """
+
+    def __init__(self, root):
+        self._root = root
+        self._dirs = set()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def write(self, service_name, url, data, resource=False):
+        path = convert_to_platform_safe(self._root + '/' + service_name + url)
+        if resource:
+            path = path + '.resource'
+        directory = os.path.dirname(path)
+        if directory not in self._dirs:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._dirs.add(directory)
+        with open(path, 'wb') as f:
+            f.write(data)
+        self._count += 1
+
+    def close(self):
+        pass
+
+
+class _ArchiveWriter(object):
+    """
+    The MockTreeWriter interface over a MockArchiveWriter.
+    """
+
+    def __init__(self, path, compress=False):
+        self._archive = MockArchiveWriter(path, compress=compress)
+
+    def __len__(self):
+        return len(self._archive)
+
+    def write(self, service_name, url, data, resource=False):
+        key = convert_to_platform_safe(url)
+        member = 'data/' + service_name + key + ('.resource' if resource else '')
+        self._archive.add(service_name, key, data, member=member)
+
+    def close(self):
+        self._archive.close()
+
+
+class DatasetGenerator(object):
+    """
+    Generates persons and groups for seed.  Group sizes follow a Pareto
+    distribution from min_members up to max_members; nest_rate of the
+    groups also have up to three earlier groups as members.
+    """
+
+    def __init__(self, persons=1000, groups=100, seed=1, min_members=2, max_members=None,
+                 alpha=1.1, nest_rate=0.1, irws_service='registry-dev', member_checks=True):
+        self.persons = persons
+        self.groups = groups
+        self.seed = seed
+        self.min_members = min_members
+        self.max_members = min(max_members or persons, persons)
+        self.alpha = alpha
+        self.nest_rate = nest_rate
+        self.irws_service = irws_service
+        self.member_checks = member_checks
+
+    def person(self, index):
+        return Person(self.seed, index)
+
+    def group_name(self, index):
+        stem = STEMS[index % len(STEMS)]
+        word = WORDS[(index // len(STEMS)) % len(WORDS)]
+        return 'u_%s_%s%d' % (stem, word, index)
+
+    def group_regid(self, index):
+        return hashlib.md5('%s:group:%d' % (self.seed, index)).hexdigest()
+
+    def write(self, writer):
+        """
+        Writes the dataset with writer.  Returns the number of urls.
+        """
+        self._write_persons(writer)
+        self._write_groups(writer)
+        writer.close()
+        return len(writer)
+
+    def _write_persons(self, writer):
+        for index in xrange(self.persons):
+            person = self.person(index)
+            for url, data in self._person_resources(person):
+                writer.write('irws', url, data)
+            if index and index % 100000 == 0:
+                logger.info('%d persons written' % index)
+
+    def _person_resources(self, person):
+        base = '/%s/v1' % self.irws_service
+        identifiers = {}
+        if person.eid:
+            identifiers['uwhr'] = '/person/uwhr/%s' % person.eid
+        if person.sid:
+            identifiers['sdb'] = '/person/sdb/%s' % person.sid
+        identity = _json({'person': [{'identity': {'regid': person.regid,
+                                                   'lname': person.lname,
+                                                   'fname': person.fname,
+                                                   'identifiers': identifiers}}],
+                          'totalcount': 1})
+        yield '%s/person?uwnetid=%s' % (base, person.uwnetid), identity
+        yield '%s/person?validid=regid=%s' % (base, person.regid), identity
+
+        uwnetid = _json({'uwnetid': [{'uwnetid': person.uwnetid,
+                                      'accid': person.regid,
+                                      'validid': person.regid,
+                                      'uid': person.uid,
+                                      'disenfran': '0',
+                                      'netid_code': '10',
+                                      'netid_name': 'Personal',
+                                      'status_code': '30',
+                                      'status_name': 'Active UW NetID'}],
+                         'totalcount': 1})
+        validids = ['regid=%s' % person.regid, 'uwnetid=%s' % person.uwnetid]
+        if person.eid:
+            validids.append('1=%s' % person.eid)
+        if person.sid:
+            validids.append('2=%s' % person.sid)
+        for validid in validids:
+            yield '%s/uwnetid?validid=%s' % (base, validid), uwnetid
+            yield '%s/uwnetid?validid=%s&status=30' % (base, validid), uwnetid
+
+        regid = _json({'regid': [{'regid': person.regid,
+                                  'entity_code': '10',
+                                  'entity_name': 'Person',
+                                  'status_code': '30',
+                                  'status_name': 'Active'}],
+                       'totalcount': 1})
+        yield '%s/regid?uwnetid=%s' % (base, person.uwnetid), regid
+        yield '%s/regid?validid=regid=%s' % (base, person.regid), regid
+
+        cname = '%s %s' % (person.fname, person.lname)
+        yield '%s/name/uwnetid=%s' % (base, person.uwnetid), _json(
+            {'name': [{'validid': person.regid,
+                       'formal_cname': cname, 'formal_fname': person.fname, 'formal_sname': person.lname,
+                       'formal_privacy': 'Public',
+                       'display_cname': cname, 'display_fname': person.fname, 'display_sname': person.lname,
+                       'display_privacy': 'Public'}],
+             'totalcount': 1})
+        yield '%s/profile/validid=uwnetid=%s' % (base, person.uwnetid), _json(
+            {'profile': [{'validid': person.regid,
+                          'recover_email': '%s@example.com' % person.uwnetid,
+                          'recover_email_date': '2016-01-01'}],
+             'totalcount': 1})
+
+        if person.eid:
+            employee = _json({'person': [{'validid': person.eid, 'regid': person.regid,
+                                          'lname': person.lname, 'fname': person.fname,
+                                          'category_code': '4', 'category_name': 'Staff',
+                                          'hepps_type': 'E', 'hepps_status': 'A',
+                                          'source_code': '1', 'source_name': 'UW Faculty/Staff',
+                                          'status_code': '1', 'status_name': 'Current', 'in_feed': '1'}],
+                              'totalcount': 1})
+            yield '%s/person/uwhr/%s' % (base, person.eid), employee
+            yield '%s/person?validid=1=%s' % (base, person.eid), identity
+        if person.sid:
+            yield '%s/person/sdb/%s' % (base, person.sid), _json(
+                {'person': [{'validid': person.sid, 'regid': person.regid, 'studentid': person.studentid,
+                             'lname': person.lname, 'fname': person.fname, 'pac': 'P',
+                             'category_code': '1', 'category_name': 'Undergraduate',
+                             'source_code': '2', 'source_name': 'UW Students',
+                             'status_code': '1', 'status_name': 'Current', 'in_feed': '1'}],
+                 'totalcount': 1})
+
+    def _write_groups(self, writer):
+        rnd = random.Random(self.seed)
+        effective = []
+        direct_groups = {}
+        effective_groups = {}
+        stems = {}
+        for index in xrange(self.groups):
+            name = self.group_name(index)
+            size = min(self.max_members, int(self.min_members * rnd.paretovariate(self.alpha)))
+            members = sorted(rnd.sample(xrange(self.persons), size))
+            nested = []
+            if index and rnd.random() < self.nest_rate:
+                # only earlier groups, so nesting never cycles
+                nested = sorted(set(rnd.randrange(index) for n in range(rnd.randint(1, 3))))
+            eff = set(members)
+            for other in nested:
+                eff.update(effective[other])
+            effective.append(eff)
+            eff = sorted(eff)
+
+            for member in members:
+                direct_groups.setdefault(member, []).append(index)
+            for member in eff:
+                effective_groups.setdefault(member, []).append(index)
+            stems.setdefault('u_' + STEMS[index % len(STEMS)], []).append(index)
+
+            self._write_group(writer, index, name, members, nested, eff)
+
+        for stem in sorted(stems):
+            writer.write('gws', _search_url(stem=stem), self._search_xml(stems[stem], stem=stem))
+        for member in xrange(self.persons):
+            netid = self.person(member).uwnetid
+            writer.write('gws', _search_url(member=netid),
+                         self._search_xml(direct_groups.get(member, []), member=netid))
+            writer.write('gws', _search_url(member=netid, type='effective'),
+                         self._search_xml(effective_groups.get(member, []), member=netid, type='effective'))
+
+    def _write_group(self, writer, index, name, members, nested, effective):
+        base = '/group_sws/v2/group/%s' % name
+        regid = self.group_regid(index)
+        netids = [self.person(member).uwnetid for member in members]
+        eff_netids = [self.person(member).uwnetid for member in effective]
+
+        writer.write('gws', base, self._group_xml(index, name), resource=True)
+        entries = [('uwnetid', netid) for netid in netids] + [('group', self.group_name(n)) for n in nested]
+        writer.write('gws', base + '/member', _members_xml(regid, name, entries))
+        writer.write('gws', base + '/effective_member',
+                     _members_xml(regid, name, [('uwnetid', netid) for netid in eff_netids]),
+                     resource=self.member_checks)
+        writer.write('gws', base + '/effective_member?view=count',
+                     '<gws class="gws" version="2">\n<member_count class="member_count" count="%d"/>\n</gws>\n'
+                     % len(eff_netids))
+        if self.member_checks:
+            for netid in eff_netids:
+                writer.write('gws', '%s/effective_member/%s' % (base, netid),
+                             _members_xml(regid, name, [('uwnetid', netid)]))
+
+    def _group_xml(self, index, name):
+        stem = STEMS[index % len(STEMS)]
+        admin = self.person(index % self.persons).uwnetid
+        return GROUP_XML % {'regid': self.group_regid(index),
+                            'name': name,
+                            'title': escape('%s %s' % (stem.upper(), WORDS[(index // len(STEMS)) % len(WORDS)])),
+                            'description': escape('Generated group %d' % index),
+                            'admin': admin}
+
+    def _search_xml(self, groups, **params):
+        refs = []
+        for index in groups:
+            name = self.group_name(index)
+            refs.append(GROUPREFERENCE_XML % {'regid': self.group_regid(index),
+                                              'name': name,
+                                              'title': escape(name),
+                                              'description': escape('Generated group %d' % index)})
+        attrs = ' '.join('%s="%s"' % (k, escape(v)) for k, v in sorted(params.items()))
+        return ('<gws class="gws" version="2">\n<searchparams class="searchparams" %s/>\n'
+                '<groupreferences class="groupreferences">\n%s</groupreferences>\n</gws>\n' % (attrs, ''.join(refs)))
+
+
+GROUP_XML = '''<gws class="gws" version="2">
+<group class="group" version="2">
+ <regid class="regid">%(regid)s</regid>
+ <name class="name">%(name)s</name>
+ <title class="title">%(title)s</title>
+ <description class="description">%(description)s</description>
+ <contact class="contact">%(admin)s</contact>
+ <authnfactor class="authnfactor">1</authnfactor>
+ <classification class="classification">u</classification>
+ <dependson class="dependson"></dependson>
+ <emailenabled class="emailenabled">disabled</emailenabled>
+ <publishemail class="publishemail"></publishemail>
+ <reporttoorig class="reporttoorig">no</reporttoorig>
+ <admins class="admins"><admin class="admin" type="uwnetid">%(admin)s</admin></admins>
+ <updaters class="updaters"></updaters>
+ <creators class="creators"></creators>
+ <readers class="readers"><reader class="reader" type="none">dc=all</reader></readers>
+ <optins class="optins"></optins>
+ <optouts class="optouts"></optouts>
+</group>
+</gws>
+'''
+
+GROUPREFERENCE_XML = ''' <groupreference class="groupreference">
+  <regid class="regid">%(regid)s</regid>
+  <title class="title">%(title)s</title>
+  <description class="description">%(description)s</description>
+  <name class="name" href="/group_sws/v2/group/%(name)s">%(name)s</name>
+ </groupreference>
+'''
+
+
+def _members_xml(regid, name, members):
+    lines = ['<gws class="gws" version="2">\n<group class="group">\n',
+             ' <regid class="regid">%s</regid>\n <name class="name">%s</name>\n' % (regid, name),
+             ' <members class="members">\n']
+    for member_type, member in members:
+        lines.append('  <member class="member" type="%s">%s</member>\n' % (member_type, member))
+    lines.append(' </members>\n</group>\n</gws>\n')
+    return ''.join(lines)
+
+
+def _search_url(**kwargs):
+    # the url GWS.search_groups builds for the same arguments
+    return "/group_sws/v2/search?" + urlencode(kwargs)
+
+
+def _json(obj):
+    return json.dumps(obj, sort_keys=True)
+
+
+def generate(out, archive=False, compress=False, **kw):
+    """
+    Writes a dataset (DatasetGenerator arguments in kw) as a mock tree
+    under out, or as an archive at out.  Returns the number of urls.
+    """
+    if archive:
+        writer = _ArchiveWriter(out, compress=compress)
+    else:
+        writer = MockTreeWriter(out)
+    return DatasetGenerator(**kw).write(writer)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Generate synthetic GWS and IRWS mock data.')
+    parser.add_argument('out', help='mock root directory, or archive path with --archive')
+    parser.add_argument('--persons', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=100)
+    parser.add_argument('--min-members', type=int, default=2)
+    parser.add_argument('--max-members', type=int, default=None)
+    parser.add_argument('--nest-rate', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--irws-service', default='registry-dev')
+    parser.add_argument('--no-member-checks', action='store_true',
+                        help='skip the per-member effective_member resources')
+    parser.add_argument('--archive', action='store_true', help='write a packed archive')
+    parser.add_argument('--compress', action='store_true', help='deflate archive members')
+    args = parser.parse_args(argv)
+
+    count = generate(args.out, archive=args.archive, compress=args.compress,
+                     persons=args.persons, groups=args.groups, seed=args.seed,
+                     min_members=args.min_members, max_members=args.max_members,
+                     nest_rate=args.nest_rate, irws_service=args.irws_service,
+                     member_checks=not args.no_member_checks)
+    print('%d urls written to %s' % (count, args.out))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
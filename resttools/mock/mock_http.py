@@ -29,3 +29,45 @@ class MockHTTP(object):
                     return self.headers[header]
 
         return default
+
+    def buffer(self):
+        """
+        Returns a read-only view of the document body, without copying it
+        where the implementation allows.
+        """
+        return _buffer(self.data, 0, len(self.data))
+
+
+class MappedMockHTTP(MockHTTP):
+    """
+    A MockHTTP whose body is a region of a memory-mapped file.  buffer()
+    is a zero-copy view of the region; data copies it out on each access.
+    """
+
+    def __init__(self, mapped, offset, size):
+        self._mapped = mapped
+        self._offset = offset
+        self._size = size
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is not None:
+            return self._data
+        return self._mapped[self._offset:self._offset + self._size]
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    def buffer(self):
+        if self._data is not None:
+            return MockHTTP.buffer(self)
+        return _buffer(self._mapped, self._offset, self._size)
+
+
+try:
+    _buffer = buffer
+except NameError:
+    def _buffer(obj, offset, size):
+        return memoryview(obj)[offset:offset + size]
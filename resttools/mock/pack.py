@@ -0,0 +1,26 @@
+"""
+Packs a mock data tree into a single archive for the File DAOs.
+
+    python -m resttools.mock.pack <mock_root> <archive.zip> [service ...]
+
+mock_root holds one directory per service (gws, irws, nws, ...), as
+resttools/mock and MOCK_ROOT trees do.  Point conf['MOCK_ARCHIVE'] at
+the result.
+"""
+
+import sys
+
+from resttools.dao_implementation.mock import build_mock_archive
+
+
+def main(argv):
+    if len(argv) < 3:
+        print(__doc__)
+        return 2
+    count = build_mock_archive(argv[1], argv[2], services=argv[3:] or None)
+    print('%d urls packed into %s' % (count, argv[2]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,226 @@
+"""
+Replays a log of API calls against File mode or stand-in servers, at
+the recorded pace or a multiple of it, and reports throughput and
+latency percentiles per method.
+
+    python -m resttools.mock.replay calls.log --speed 2 --concurrency 16 \\
+        --mock-root /path/to/mock [--preload] [--archive mock.zip] \\
+        [--host gws=http://127.0.0.1:8080 ...]
+
+The log has one JSON object per line:
+
+    {"ts": 1444240200.125, "service": "gws", "method": "is_effective_member",
+     "args": ["u_fox_unittest", "javerage"], "kwargs": {}}
+
+ts is in seconds; service is gws, irws or nws and method a public
+method of GWS, IRWS or NWS.  Calls are issued when their time comes,
+whether or not earlier calls have finished, so latency counts from the
+scheduled time and includes any wait for a free worker.  Speed 0 issues
+calls as fast as the workers take them.
+"""
+
+import sys
+import copy
+import json
+import math
+import time
+import Queue
+import argparse
+import threading
+
+from resttools.gws import GWS
+from resttools.irws import IRWS
+from resttools.nws import NWS
+
+import logging
+logger = logging.getLogger(__name__)
+
+CLIENTS = {
+    'gws': GWS,
+    'irws': IRWS,
+    'nws': NWS,
+}
+
+
+def read_log(path):
+    """
+    Yields the calls in the log at path, skipping blank and # lines.
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield json.loads(line)
+
+
+def percentile(values, pct):
+    """
+    The nearest-rank percentile of sorted values.
+    """
+    if not values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class ReplayReport(object):
+    """
+    Per method call counts, errors and latencies from a replay.
+    """
+
+    PERCENTILES = (50, 90, 99, 99.9)
+
+    def __init__(self):
+        self._latencies = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+        self.elapsed = 0.0
+
+    def add(self, method, latency, error=None):
+        with self._lock:
+            self._latencies.setdefault(method, []).append(latency)
+            if error is not None:
+                self._errors[method] = self._errors.get(method, 0) + 1
+
+    def stats(self):
+        """
+        Returns {method: {count, errors, throughput, p50, p90, p99, p99.9, max}};
+        the method 'all' covers every call.  Latencies are in seconds.
+        """
+        ret = {}
+        every = []
+        for method, latencies in self._latencies.items():
+            ret[method] = self._stats(latencies, self._errors.get(method, 0))
+            every.extend(latencies)
+        ret['all'] = self._stats(every, sum(self._errors.values()))
+        return ret
+
+    def _stats(self, latencies, errors):
+        latencies = sorted(latencies)
+        stats = {'count': len(latencies),
+                 'errors': errors,
+                 'throughput': len(latencies) / self.elapsed if self.elapsed else 0.0,
+                 'max': latencies[-1] if latencies else None}
+        for pct in self.PERCENTILES:
+            stats['p%g' % pct] = percentile(latencies, pct)
+        return stats
+
+    def format(self):
+        lines = ['%-32s %8s %6s %9s %9s %9s %9s %9s %9s' % ('method', 'count', 'errors', 'calls/s',
+                                                            'p50 ms', 'p90 ms', 'p99 ms', 'p99.9 ms', 'max ms')]
+        stats = self.stats()
+        for method in sorted(stats, key=lambda m: (m == 'all', m)):
+            s = stats[method]
+            if not s['count']:
+                continue
+            lines.append('%-32s %8d %6d %9.1f %9.2f %9.2f %9.2f %9.2f %9.2f' % (
+                method, s['count'], s['errors'], s['throughput'],
+                s['p50'] * 1000, s['p90'] * 1000, s['p99'] * 1000, s['p99.9'] * 1000, s['max'] * 1000))
+        lines.append('elapsed %.2fs' % self.elapsed)
+        return '\n'.join(lines)
+
+
+class LogReplay(object):
+    """
+    Replays calls with the clients for confs ({service: conf}).  speed
+    multiplies the recorded pace; concurrency is the number of workers.
+    """
+
+    def __init__(self, confs, speed=1.0, concurrency=8):
+        self._clients = dict((service, CLIENTS[service](conf)) for service, conf in confs.items())
+        self._speed = speed
+        self._concurrency = concurrency
+
+    def run(self, calls):
+        """
+        Replays calls (an iterable, in log order).  Returns a ReplayReport.
+        """
+        report = ReplayReport()
+        queue = Queue.Queue(maxsize=self._concurrency * 4)
+        workers = [threading.Thread(target=self._work, args=(queue, report)) for n in range(self._concurrency)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        start = time.time()
+        first = None
+        for call in calls:
+            if self._speed:
+                if first is None:
+                    first = call['ts']
+                due = start + (call['ts'] - first) / self._speed
+                wait = due - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+            else:
+                due = None
+            queue.put((call, due))
+        for worker in workers:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+        report.elapsed = time.time() - start
+        return report
+
+    def _work(self, queue, report):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            call, due = item
+            method = '%s.%s' % (call['service'], call['method'])
+            started = time.time()
+            error = None
+            try:
+                self._call(call)
+            except Exception as e:
+                error = e
+                logger.debug('%s failed: %s' % (method, e))
+            report.add(method, time.time() - (due if due is not None else started), error)
+
+    def _call(self, call):
+        client = self._clients[call['service']]
+        if call['method'].startswith('_'):
+            raise ValueError('not an API method: %s' % call['method'])
+        return getattr(client, call['method'])(*call.get('args', []), **call.get('kwargs', {}))
+
+
+DEFAULT_CONFS = {
+    'gws': {},
+    'irws': {'SERVICE_NAME': 'registry-dev'},
+    'nws': {'SERVICE_NAME': 'nws'},
+}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Replay a log of resttools API calls.')
+    parser.add_argument('log')
+    parser.add_argument('--speed', type=float, default=1.0, help='multiple of the recorded pace, 0 for flat out')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mock-root', help='MOCK_ROOT for File mode')
+    parser.add_argument('--preload', action='store_true', help='serve File mode from a preloaded index')
+    parser.add_argument('--archive', help='MOCK_ARCHIVE for File mode')
+    parser.add_argument('--irws-service', default='registry-dev')
+    parser.add_argument('--nws-service', default='nws')
+    parser.add_argument('--host', action='append', default=[], metavar='SERVICE=URL',
+                        help='send a service to a (stand-in) server instead of File mode')
+    args = parser.parse_args(argv)
+
+    confs = copy.deepcopy(DEFAULT_CONFS)
+    confs['irws']['SERVICE_NAME'] = args.irws_service
+    confs['nws']['SERVICE_NAME'] = args.nws_service
+    for conf in confs.values():
+        conf.update({'RUN_MODE': 'File', 'MOCK_ROOT': args.mock_root,
+                     'MOCK_PRELOAD': args.preload, 'MOCK_ARCHIVE': args.archive})
+    for host in args.host:
+        service, url = host.split('=', 1)
+        confs[service].update({'RUN_MODE': 'Live', 'HOST': url,
+                               'KEY_FILE': None, 'CERT_FILE': None, 'CA_FILE': None})
+
+    report = LogReplay(confs, speed=args.speed, concurrency=args.concurrency).run(read_log(args.log))
+    print(report.format())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,226 @@
+"""
+A stand-in HTTP(S) server for one service, answering from its File DAO:
+the same mock data and response semantics as File mode, over the wire.
+Point the service's Live conf at it to exercise the Live DAOs (pooling,
+TLS, retries) without the real service.
+
+In-process:
+
+    server = MockServer('gws', {'MOCK_ROOT': ...})
+    server.start()
+    conf['HOST'] = server.url
+    ...
+    server.stop()
+
+As a subprocess:
+
+    python -m resttools.mock.server gws --port 8443 \\
+        --mock-root /path/to/mock --cert server.crt --key server.key --ca ca.crt
+
+With a CA file, clients must present a certificate signed by it.
+"""
+
+import ssl
+import sys
+import socket
+import struct
+import argparse
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from resttools.dao_implementation.gws import File as GWSFile
+from resttools.dao_implementation.irws import File as IRWSFile
+from resttools.dao_implementation.nws import File as NWSFile
+from resttools.dao_implementation.ntfyws import File as NTFYWSFile
+from urllib3.exceptions import ProtocolError
+
+import logging
+logger = logging.getLogger(__name__)
+
+FILE_DAOS = {
+    'gws': GWSFile,
+    'irws': IRWSFile,
+    'nws': NWSFile,
+    'ntfyws': NTFYWSFile,
+}
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        if isinstance(self.request, ssl.SSLSocket):
+            # handshake here, in the request thread, not in accept()
+            self.request.do_handshake()
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        self._answer('getURL')
+
+    def do_HEAD(self):
+        # the GET answer, without the body
+        self._answer('getURL')
+
+    def do_PUT(self):
+        self._answer('putURL', body=True)
+
+    def do_POST(self):
+        self._answer('postURL', body=True)
+
+    def do_DELETE(self):
+        self._answer('deleteURL')
+
+    def _answer(self, method, body=False):
+        headers = dict((name.title(), value) for name, value in self.headers.items())
+        args = [self.path, headers]
+        if body:
+            if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+                args.append(self._read_chunked())
+            else:
+                length = int(self.headers.get('Content-Length') or 0)
+                args.append(self.rfile.read(length) if length else None)
+
+        dao = self.server.dao
+        if not hasattr(dao, method):
+            self._send(405, {}, 'Method not allowed')
+            return
+        try:
+            response = getattr(dao, method)(*args)
+        except ProtocolError:
+            # an injected connection reset: reset the connection
+            self._reset()
+            return
+        except Exception as e:
+            logger.exception('mock server error on %s %s' % (self.command, self.path))
+            self._send(500, {}, 'Mock server error: %s' % e)
+            return
+        if hasattr(response, 'iter_chunks'):
+            self._send(response.status, response.headers or {}, response.iter_chunks(),
+                       length=response.length)
+        else:
+            self._send(response.status, response.headers or {}, response.buffer())
+
+    def _reset(self):
+        # closing with a zero linger time sends RST, not FIN
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.close_connection = 1
+        self.connection.close()
+
+    def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(';')[0].strip(), 16)
+            if size == 0:
+                # trailers, up to the blank line
+                while self.rfile.readline().strip():
+                    pass
+                return ''.join(chunks)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def _send(self, status, headers, body, length=None):
+        # body is a string, or an iterable of chunks of length bytes in all
+        self.send_response(status)
+        for name, value in headers.items():
+            if name.lower() not in ('content-length', 'connection', 'transfer-encoding'):
+                self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body) if length is None else length))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        if length is None:
+            self.wfile.write(body)
+            return
+        for chunk in body:
+            self.wfile.write(chunk)
+            self.wfile.flush()
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class MockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves service_name's mock data.  conf is the File DAO conf (MOCK_ROOT,
+    MOCK_PRELOAD, MOCK_PROFILE, ...).  Port 0 binds any free port.
+    certfile/keyfile turn on TLS; ca_certs also requires client certs.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, service_name, conf=None, host='127.0.0.1', port=0,
+                 certfile=None, keyfile=None, ca_certs=None):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), _Handler)
+        self.dao = FILE_DAOS[service_name](conf or {})
+        if (conf or {}).get('MOCK_PROFILE') is not None:
+            # latency, faults and trickled bodies, on the wire
+            self.dao = conf['MOCK_PROFILE'].wrap(self.dao)
+        self._context = None
+        if certfile is not None:
+            self._context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            self._context.load_cert_chain(certfile, keyfile)
+            if ca_certs is not None:
+                self._context.verify_mode = ssl.CERT_REQUIRED
+                self._context.load_verify_locations(ca_certs)
+        self._thread = None
+
+    @property
+    def url(self):
+        scheme = 'https' if self._context is not None else 'http'
+        return '%s://%s:%d' % (scheme, self.server_address[0], self.server_address[1])
+
+    def get_request(self):
+        sock, address = self.socket.accept()
+        if self._context is not None:
+            sock = self._context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+        return sock, address
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (socket.error, ssl.SSLError)):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+    def start(self):
+        """
+        Serves from a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Serve resttools mock data over HTTP(S).')
+    parser.add_argument('service', choices=sorted(FILE_DAOS))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--mock-root', help='MOCK_ROOT for the File DAO')
+    parser.add_argument('--preload', action='store_true', help='serve from a preloaded index')
+    parser.add_argument('--archive', help='MOCK_ARCHIVE for the File DAO')
+    parser.add_argument('--cert', help='server certificate (turns on TLS)')
+    parser.add_argument('--key', help='server key')
+    parser.add_argument('--ca', help='CA for client certificates (requires them)')
+    args = parser.parse_args(argv)
+
+    conf = {'MOCK_ROOT': args.mock_root, 'MOCK_PRELOAD': args.preload, 'MOCK_ARCHIVE': args.archive}
+    server = MockServer(args.service, conf, host=args.host, port=args.port,
+                        certfile=args.cert, keyfile=args.key, ca_certs=args.ca)
+    print('serving %s mock data on %s' % (args.service, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
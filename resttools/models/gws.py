@@ -145,3 +145,95 @@ class GroupMember():
     def __str__(self):
         return "{name: %s, user_type: %s}" % (
             self.name, self.member_type)
+
+
+class MemberSync():
+    """
+    What GWS.sync_members did: the members added and removed, how
+    (method is 'none', 'delta' or 'full') and any member requests that
+    failed, as (member, status) pairs; the status is the exception for
+    a request that raised one.
+    """
+
+    def __init__(self, method='none'):
+        self.method = method
+        self.added = []
+        self.removed = []
+        self.unchanged = 0
+        self.failed = []
+
+    def __str__(self):
+        return "{method: %s, added: %d, removed: %d, unchanged: %d, failed: %d}" % (
+            self.method, len(self.added), len(self.removed), self.unchanged, len(self.failed))
+
+
+class GroupExpansion():
+    """
+    The result of GWS.expand_members: the members found under a group,
+    without duplicates, and for each member (keyed by (name, type)) the
+    path of group ids it was reached through.  cycles lists paths that
+    led back into a group already on them; errors maps the group ids
+    that could not be read to the status (to the InvalidGroupID for a
+    member that is not a valid group id).  truncated names the limit
+    that was reached, if any ('depth' or 'size').
+    """
+
+    def __init__(self, group_id):
+        self.group_id = group_id
+        self.members = []
+        self.provenance = {}
+        self.groups = [group_id]
+        self.cycles = []
+        self.errors = {}
+        self.truncated = None
+
+    def __str__(self):
+        return "{group_id: %s, members: %d, groups: %d, cycles: %d, truncated: %s}" % (
+            self.group_id, len(self.members), len(self.groups), len(self.cycles), self.truncated)
+
+
+class MembershipCheck():
+    """
+    One item of a batch membership check: is netid an effective member
+    of group_id.  is_member is None if the check failed (error says
+    why).  seconds is the time the check took; checks answered from one
+    shared request all carry that request's time.
+    """
+
+    def __init__(self, group_id, netid, is_member=None, seconds=0.0, error=None):
+        self.group_id = group_id
+        self.netid = netid
+        self.is_member = is_member
+        self.seconds = seconds
+        self.error = error
+
+    def __str__(self):
+        return "{group_id: %s, netid: %s, is_member: %s}" % (self.group_id, self.netid, self.is_member)
+
+
+class MembershipResult():
+    """
+    The checks of a batch membership call, in request order, and the
+    strategy used ('point', 'fetch' or 'search').  True if any check
+    found a membership.
+    """
+
+    def __init__(self, strategy, checks, seconds=0.0):
+        self.strategy = strategy
+        self.checks = checks
+        self.seconds = seconds
+
+    def __nonzero__(self):
+        return any(check.is_member for check in self.checks)
+
+    def __len__(self):
+        return len(self.checks)
+
+    def __iter__(self):
+        return iter(self.checks)
+
+    def members(self):
+        """
+        The checks that found a membership.
+        """
+        return [check for check in self.checks if check.is_member]
@@ -0,0 +1,228 @@
+import copy
+import time
+import random
+import shutil
+import tempfile
+import threading
+import logging
+from nose.tools import *
+
+from resttools.gws import GWS
+from resttools.models.gws import GroupMember
+from resttools.dao_implementation.mock import MockStore, get_mock_store
+from resttools.mock.mock_http import MockHTTP
+from resttools.mock.cache_server import MockCacheServer
+from resttools.cache_implementation import TimedCache, FileCache, MemcachedCache
+from resttools.cache_implementation import simulate_trace, _node_key
+
+import resttools.test.test_settings as settings
+import logging.config
+logging.config.dictConfig(settings.LOGGING)
+logger = logging.getLogger(__name__)
+
+
+def _response(data, status=200):
+    response = MockHTTP()
+    response.status = status
+    response.data = data
+    response.headers = {'Content-Type': 'text/xml'}
+    return response
+
+
+class Cache_Test():
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+
+    def test_timed_cache(self):
+        cache = TimedCache(ttl=60, max_entries=2)
+        eq_(cache.getCache('gws', '/a', {}), None)
+        cache.processResponse('gws', '/a', {}, _response('a'))
+        eq_(cache.getCache('gws', '/a', {}).data, 'a')
+        eq_(cache.getCache('gws', '/a', {'X-UW-Act-as': 'fox'}), None)
+        cache.processResponse('gws', '/a', {'X-UW-Act-as': 'fox'}, None)
+        eq_(cache.getCache('gws', '/b', {}), None)
+        cache.processResponse('gws', '/b', {}, _response('b', status=404))
+        eq_(len(cache), 1)
+        cache.deleteCache('gws', '/a', {})
+        eq_(len(cache), 0)
+
+    def test_tinylfu_scan_resistance(self):
+        # hot groups interleaved with a crawl of one-off urls
+        rnd = random.Random(1)
+        trace = []
+        for n in range(10000):
+            if rnd.random() < 0.5:
+                trace.append('/group_sws/v2/group/hot%d' % rnd.randrange(80))
+            else:
+                trace.append('/group_sws/v2/search?name=crawl%d' % n)
+        lru = simulate_trace(TimedCache(max_entries=100), trace)
+        tinylfu = simulate_trace(TimedCache(max_entries=100, policy='tinylfu'), trace)
+        ok_(tinylfu['hit_ratio'] > lru['hit_ratio'] + 0.1)
+        ok_(tinylfu['rejections'] > 0)
+        eq_(tinylfu['hits'] + tinylfu['misses'], len(trace))
+
+    def test_gws_uses_cache(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['CACHE'] = TimedCache()
+        gws = GWS(conf)
+        group = gws.get_group_by_id('u_fox_unittest')
+        eq_(len(conf['CACHE']), 1)
+        eq_(gws.get_group_by_id('u_fox_unittest').uwregid, group.uwregid)
+
+    def test_cache_vary_headers(self):
+        cache = TimedCache(ttl=60)
+        cache.processResponse('gws', '/a', {'Accept': 'text/xml'}, _response('xml'))
+        eq_(cache.getCache('gws', '/a', {'accept': 'text/xml'}).data, 'xml')
+        eq_(cache.getCache('gws', '/a', {'Accept': 'application/json'}), None)
+        cache.processResponse('gws', '/a', {'Accept': 'application/json'}, _response('json'))
+        eq_(cache.getCache('gws', '/a', {'Accept': 'text/xml'}), None)
+        cache.processResponse('gws', '/a', {'Accept': 'text/xml'}, None)
+        # one entry per url: deleting it drops every variant
+        eq_(len(cache), 1)
+        cache.deleteCache('gws', '/a', {'Content-Type': 'text/xml'})
+        eq_(len(cache), 0)
+
+    def test_gws_write_invalidates_related(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['CACHE'] = TimedCache()
+        conf['MOCK_STORE'] = MockStore()
+        gws = GWS(conf)
+        gws.get_group_by_id('u_fox_unittest')
+        gws.get_members('u_fox_unittest')
+        gws.get_group_by_id('course_2015spr-phys114a')
+        eq_(len(conf['CACHE']), 3)
+        gws.put_members('u_fox_unittest', [GroupMember('fox', 'uwnetid')])
+        eq_(len(conf['CACHE']), 1)
+        ok_(conf['CACHE'].getCache('gws', '/group_sws/v2/group/course_2015spr-phys114a',
+                                   {'Accept': 'text/xml'}) is not None)
+
+    def test_conditional_requests_bypass_cache(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['CACHE'] = TimedCache()
+        conf['MOCK_STORE'] = MockStore()
+        url = '/group_sws/v2/group/u_t_cached/effective_member'
+        get_mock_store(conf).put('gws', url, {}, '<gws><group><members><member type="uwnetid">a</member>'
+                                                 '</members></group></gws>')
+        gws = GWS(conf)
+        names, etag = gws.get_effective_member_names('u_t_cached')
+        eq_(names, set(['a']))
+        # changed behind the cache's back: the conditional request sees it
+        get_mock_store(conf).put('gws', url, {}, '<gws><group><members><member type="uwnetid">b</member>'
+                                                 '</members></group></gws>')
+        eq_(gws.get_effective_member_names('u_t_cached')[0], set(['a']))
+        eq_(gws.get_effective_member_names('u_t_cached', etag)[0], set(['b']))
+        eq_(len(conf['CACHE']), 1)
+
+    def test_file_cache_shared(self):
+        writer = FileCache(self.path, ttl=60)
+        reader = FileCache(self.path, ttl=60)
+        eq_(writer.getCache('gws', '/a', {}), None)
+        writer.processResponse('gws', '/a', {}, _response('a'))
+        eq_(reader.getCache('gws', '/a', {}).data, 'a')
+        eq_(reader.getCache('gws', '/a', {}).headers['Content-Type'], 'text/xml')
+        reader.deleteCache('gws', '/a', {})
+        eq_(writer.getCache('gws', '/a', {}), None)
+
+    def test_file_cache_coalesce(self):
+        # one cache per worker, as if they were separate processes
+        caches = [FileCache(self.path, ttl=60, wait_timeout=5.0) for n in range(8)]
+        fetches = []
+        results = []
+
+        def worker(cache):
+            response = cache.getCache('gws', '/big', {})
+            if response is None:
+                fetches.append(1)
+                threading.Event().wait(0.2)
+                response = _response('members')
+                cache.processResponse('gws', '/big', {}, response)
+            results.append(response.data)
+
+        threads = [threading.Thread(target=worker, args=(c,)) for c in caches]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        eq_(len(fetches), 1)
+        eq_(results, ['members'] * 8)
+
+    def test_file_cache_failed_fetch(self):
+        first = FileCache(self.path, ttl=60)
+        second = FileCache(self.path, ttl=60, wait_timeout=0.2)
+        eq_(first.getCache('gws', '/a', {}), None)
+        eq_(second.getCache('gws', '/a', {}), None)
+        first.processResponse('gws', '/a', {}, None)
+        # lease released: the next miss takes it at once
+        eq_(first.getCache('gws', '/a', {}), None)
+        ok_(first._get_lease('gws /a') is not None)
+
+    def test_memcached_sharded(self):
+        servers = [MockCacheServer() for n in range(3)]
+        for server in servers:
+            server.start()
+        try:
+            nodes = ['%s:%d' % server.address for server in servers]
+            cache = MemcachedCache(nodes, ttl=60)
+            urls = ['/group_sws/v2/group/g%d' % n for n in range(90)]
+            for url in urls:
+                eq_(cache.getCache('gws', url, {}), None)
+                cache.processResponse('gws', url, {}, _response(url))
+            placement = dict((url, cache.node_for('gws %s' % url).name) for url in urls)
+            eq_(set(placement.values()), set(nodes))
+
+            servers[0].stop()
+            for url in urls:
+                response = cache.getCache('gws', url, {})
+                if placement[url] == nodes[0]:
+                    eq_(response, None)
+                    cache.processResponse('gws', url, {}, _response(url))
+                else:
+                    # keys on the surviving nodes did not move
+                    eq_(response.data, url)
+            for url in urls:
+                eq_(cache.getCache('gws', url, {}).data, url)
+
+            stats = cache.node_stats()
+            eq_(stats[nodes[0]]['errors'], 1)
+            on_node1 = len([url for url in urls if placement[url] == nodes[1]])
+            ok_(stats[nodes[1]]['hits'] >= 2 * on_node1)
+            ok_(stats[nodes[1]]['hit_rate'] > 0.0)
+        finally:
+            for server in servers[1:]:
+                server.stop()
+
+    def test_memcached_rejoin(self):
+        servers = [MockCacheServer() for n in range(2)]
+        for server in servers:
+            server.start()
+        try:
+            nodes = ['%s:%d' % server.address for server in servers]
+            cache = MemcachedCache(nodes, ttl=60)
+            eq_(len(list(cache._ring.nodes_for('k'))), 2)
+            url = '/group_sws/v2/group/g1'
+            cache.processResponse('gws', url, {}, _response('old'))
+            primary = cache.node_for('gws %s' % url).name
+
+            # the primary is away while the url is deleted and refetched
+            cache._down[primary] = time.time() + 60
+            cache.deleteCache('gws', url, {})
+            cache.processResponse('gws', url, {}, _response('new'))
+            eq_(cache.getCache('gws', url, {}).data, 'new')
+
+            # back: the missed key is deleted, not served old, and the
+            # rest of what it holds is kept
+            other = '/group_sws/v2/group/g2'
+            server = servers[nodes.index(primary)]
+            server.store(_node_key('gws %s' % other), 0, 0, 'kept')
+            cache._down[primary] = time.time() - 1
+            eq_(cache.getCache('gws', url, {}), None)
+            ok_(primary not in cache._down)
+            eq_(cache._missed, {})
+            eq_(server.get(_node_key('gws %s' % other))[2], 'kept')
+        finally:
+            for server in servers:
+                server.stop()
@@ -1,9 +1,20 @@
+import os
+import copy
 import json
+import time
+import shutil
+import tempfile
 import logging
 from nose.tools import *
 
-from resttools.gws import GWS
-from resttools.exceptions import DataFailureException
+import resttools.gws as gws_module
+from resttools.gws import GWS, LazyGroup, CompactMemberList
+from resttools.membership_oracle import MembershipOracle
+from resttools.group_catalog import GroupCatalog, _Query
+from resttools.models.gws import GroupMember, GroupReference
+from resttools.dao_implementation.mock import MockStore, get_mock_store
+from resttools.mock.generate import generate, DatasetGenerator
+from resttools.exceptions import DataFailureException, InvalidGroupID
 
 import resttools.test.test_settings as settings
 import logging.config
@@ -25,7 +36,391 @@ class GWS_Test():
     def test_get_group(self):
         group = self.gws.get_group_by_id('course_2015spr-phys114a')
         eq_(group.name, 'course_2015spr-phys114a')
+        eq_(group.curriculum_abbr, 'PHYS')
+        eq_(group.quarter, 'spring')
+        eq_(group.section_id, 'A')
+        eq_([i.name for i in group.instructors], ['susanh82', 'blinov', 'kaimeifu'])
+
+    def test_get_group_acls(self):
+        group = self.gws.get_group_by_id('u_fox_unittest')
+        eq_(group.contact, 'fox')
+        eq_(group.reporttoorig, 'no')
+        eq_([(u.name, u.user_type) for u in group.readers], [('u_fox_00-spud99', 'group'), ('dc=all', 'none')])
+        eq_([u.name for u in group.admins], ['fox'])
 
     @raises(DataFailureException)
     def test_get_group_members_403(self):
         members = self.gws.get_members('course_2015spr-phys114a')
+
+    def test_iter_search_groups(self):
+        groups = self.gws.iter_search_groups(name='2015spr-phys*1', stem='course')
+        first = next(groups)
+        listed = self.gws.search_groups(name='2015spr-phys*1', stem='course')
+        eq_(first.name, listed[0].name)
+        eq_([g.uwregid for g in groups], [g.uwregid for g in listed[1:]])
+        assert_raises(DataFailureException, list, self.gws.iter_search_groups(member='nobody'))
+
+    def test_search_groups_paged(self):
+        listed = self.gws.search_groups(name='2015spr-phys*1', stem='course')
+        page = self.gws.search_groups(name='2015spr-phys*1', stem='course', limit=20)
+        eq_([g.name for g in page], [g.name for g in listed[:20]])
+        page = self.gws.search_groups(name='2015spr-phys*1', stem='course', limit=20, offset=190)
+        eq_([g.name for g in page], [g.name for g in listed[190:]])
+
+    def test_lazy_group(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['GWS_LAZY'] = True
+        gws = GWS(conf)
+        group = gws.get_group_by_id('u_fox_unittest')
+        ok_(isinstance(group, LazyGroup))
+        eq_(group.name, 'u_fox_unittest')
+        ok_(group._index is None)
+        eq_(group.uwregid, self.gws.get_group_by_id('u_fox_unittest').uwregid)
+        eq_([u.name for u in group.admins], ['fox'])
+        ok_('readers' not in group.__dict__)
+        eq_(group.reporttoorig, 'no')
+        group.title = 'changed'
+        eq_(group.title, 'changed')
+
+        course = gws.get_group_by_id('course_2015spr-phys114a')
+        eq_(course.quarter, 'spring')
+        eq_([i.name for i in course.instructors], ['susanh82', 'blinov', 'kaimeifu'])
+        eq_(course.optouts, [])
+
+        members = gws.get_members('u_fox_unittest')
+        eq_(len(members), 3)
+        eq_(members[1].name, 'imf')
+        ok_(members[1] is members[1])
+        eq_(members.names(), ['fox', 'imf', 'pass'])
+        eq_([m.name for m in members], [m.name for m in self.gws.get_members('u_fox_unittest')])
+
+    def test_put_members_streamed(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['MOCK_STORE'] = MockStore()
+        taken = []
+
+        def members():
+            for n in range(20000):
+                taken.append(n)
+                yield GroupMember(name='user%d' % n, member_type='uwnetid')
+
+        body = GWS(conf)._stream_members_xml('u_fox_unittest', members())
+        first = next(body)
+        # only the first chunk's members have been read
+        ok_(len(taken) < 20000)
+        ok_(len(first) >= gws_module.STREAM_CHUNK_SIZE)
+        ok_(''.join([first] + list(body)).count('<x class="member"') == 20000)
+
+        eq_(GWS(conf).put_members('u_fox_unittest', (m for m in [GroupMember('fox', 'uwnetid')])), [])
+        stored = get_mock_store(conf).get('gws', '/group_sws/v2/group/u_fox_unittest/member')
+        ok_('>fox</member>' in stored['data'])
+
+    def test_put_then_get_members(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['MOCK_STORE'] = MockStore()
+        gws = GWS(conf)
+        eq_(len(gws.get_members('u_fox_unittest')), 3)
+        eq_(gws.put_members('u_fox_unittest', [GroupMember('spud', 'uwnetid'), GroupMember('a@b.edu', 'eppn')]), [])
+        eq_([(m.name, m.member_type) for m in gws.get_members('u_fox_unittest')],
+            [('spud', 'uwnetid'), ('a@b.edu', 'eppn')])
+        # per-member writes show in the list too
+        gws._member_request('u_fox_unittest', 'PUT', GroupMember('newguy', 'uwnetid'))
+        gws._member_request('u_fox_unittest', 'DELETE', GroupMember('spud', 'uwnetid'))
+        eq_([m.name for m in gws.get_members('u_fox_unittest')], ['a@b.edu', 'newguy'])
+        # a group with no list yet
+        gws._member_request('u_t_new', 'PUT', GroupMember('fox', 'uwnetid'))
+        eq_([m.name for m in gws.get_members('u_t_new')], ['fox'])
+        # a group with no member fixture
+        eq_(gws.put_members('u_t_nomembers', [GroupMember('fox', 'uwnetid')]), [])
+        eq_([m.name for m in gws.get_members('u_t_nomembers')], ['fox'])
+
+    def test_create_group_then_members(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['MOCK_STORE'] = MockStore()
+        gws = GWS(conf)
+        group = gws.get_group_by_id('u_fox_unittest')
+        group.name = 'u_t_created'
+        gws.create_group(group)
+        eq_(gws.put_members('u_t_created', [GroupMember('fox', 'uwnetid')]), [])
+        eq_([m.name for m in gws.get_members('u_t_created')], ['fox'])
+        result = gws.sync_members('u_t_created', ['fox', 'imf'], full_put_ratio=1.0)
+        eq_(([m.name for m in result.added], result.failed), (['imf'], []))
+        eq_(gws.sync_members('u_t_created', ['fox', 'imf']).method, 'none')
+
+    def test_sync_members(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['MOCK_STORE'] = MockStore()
+        gws = GWS(conf)
+        eq_(gws.sync_members('u_fox_unittest', ['fox', 'imf', 'pass']).method, 'none')
+
+        result = gws.sync_members('u_fox_unittest', ['fox', 'imf', 'newguy'], full_put_ratio=1.0)
+        eq_(result.method, 'delta')
+        eq_([m.name for m in result.added], ['newguy'])
+        eq_([m.name for m in result.removed], ['pass'])
+        eq_(result.unchanged, 2)
+        eq_(result.failed, [])
+        ok_(get_mock_store(conf).get('gws', '/group_sws/v2/group/u_fox_unittest/member/newguy') is not None)
+
+        result = gws.sync_members('u_fox_unittest', [GroupMember('spud', 'uwnetid')])
+        eq_(result.method, 'full')
+        eq_(sorted(m.name for m in result.removed), ['fox', 'imf', 'newguy'])
+        ok_('>spud</member>' in get_mock_store(conf).get('gws', '/group_sws/v2/group/u_fox_unittest/member')['data'])
+        # the writes are read back: syncing again changes nothing
+        result = gws.sync_members('u_fox_unittest', ['spud'])
+        eq_(result.method, 'none')
+        eq_(result.unchanged, 1)
+
+    def test_sync_members_failures(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['MOCK_STORE'] = MockStore()
+        gws = GWS(conf)
+        request = gws._member_request
+
+        def failing_request(group_id, method, member):
+            if member.name == 'bad':
+                raise DataFailureException('/member/bad', 500, 'down')
+            return request(group_id, method, member)
+        gws._member_request = failing_request
+
+        result = gws.sync_members('u_fox_unittest', ['fox', 'imf', 'pass', 'newguy', 'bad'], full_put_ratio=1.0)
+        eq_(result.method, 'delta')
+        eq_([m.name for m in result.added], ['newguy'])
+        eq_([(m.name, e.status) for m, e in result.failed], [('bad', 500)])
+        eq_(sorted(m.name for m in gws.get_members('u_fox_unittest')), ['fox', 'imf', 'newguy', 'pass'])
+
+    def test_expand_members(self):
+        path = tempfile.mkdtemp()
+        try:
+            groups = {'u_t_a': [('uwnetid', 'x'), ('group', 'u_t_b'), ('group', 'u_t_c')],
+                      'u_t_b': [('uwnetid', 'y'), ('group', 'u_t_c'), ('group', 'u_t_a'), ('group', 'u_t_gone')],
+                      'u_t_c': [('uwnetid', 'z'), ('uwnetid', 'x'), ('group', 'u_t_d')],
+                      'u_t_d': [('eppn', 'w@example.com'), ('group', 'u_t_bad!')]}
+            for name, members in groups.items():
+                os.makedirs(os.path.join(path, 'gws/group_sws/v2/group', name))
+                with open(os.path.join(path, 'gws/group_sws/v2/group', name, 'member'), 'w') as f:
+                    f.write('<gws><group><members>%s</members></group></gws>' % ''.join(
+                        '<member type="%s">%s</member>' % m for m in members))
+            conf = copy.copy(settings.GWS_CONF)
+            conf['MOCK_ROOT'] = path
+            gws = GWS(conf)
+
+            memo = {}
+            result = gws.expand_members('u_t_a', memo=memo)
+            eq_(sorted(m.name for m in result.members), ['w@example.com', 'x', 'y', 'z'])
+            eq_(result.provenance[('x', 'uwnetid')], ('u_t_a',))
+            eq_(result.provenance[('z', 'uwnetid')], ('u_t_a', 'u_t_c'))
+            eq_(result.provenance[('w@example.com', 'eppn')], ('u_t_a', 'u_t_c', 'u_t_d'))
+            eq_(result.cycles, [('u_t_a', 'u_t_b', 'u_t_a')])
+            eq_(sorted(result.errors), ['u_t_bad!', 'u_t_gone'])
+            eq_(result.errors['u_t_gone'], 404)
+            ok_(isinstance(result.errors['u_t_bad!'], InvalidGroupID))
+            eq_(result.truncated, None)
+
+            # failures are not memoized: a group that appears is read next time
+            eq_(sorted(memo), ['u_t_a', 'u_t_b', 'u_t_c', 'u_t_d'])
+            os.makedirs(os.path.join(path, 'gws/group_sws/v2/group/u_t_gone'))
+            with open(os.path.join(path, 'gws/group_sws/v2/group/u_t_gone/member'), 'w') as f:
+                f.write('<gws><group><members><member type="uwnetid">v</member></members></group></gws>')
+            result = gws.expand_members('u_t_a', memo=memo)
+            eq_(sorted(result.errors), ['u_t_bad!'])
+            eq_(result.provenance[('v', 'uwnetid')], ('u_t_a', 'u_t_b', 'u_t_gone'))
+
+            result = gws.expand_members('u_t_a', max_depth=1)
+            eq_(result.truncated, 'depth')
+            ok_(('w@example.com', 'eppn') not in result.provenance)
+            result = gws.expand_members('u_t_a', member_filter=lambda m: m.is_uwnetid(), max_members=2)
+            eq_(len(result.members), 2)
+            eq_(result.truncated, 'size')
+            assert_raises(DataFailureException, gws.expand_members, 'u_t_none')
+        finally:
+            shutil.rmtree(path)
+
+    def test_membership_oracle(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['MOCK_STORE'] = MockStore()
+        url = '/group_sws/v2/group/u_t_admins/effective_member'
+
+        def set_members(*names):
+            get_mock_store(conf).put('gws', url, {}, '<gws><group><members>%s</members></group></gws>' % ''.join(
+                '<member type="uwnetid">%s</member>' % name for name in names))
+
+        set_members('fox', 'IMF')
+        gws = GWS(conf)
+        oracle = MembershipOracle(gws, max_age=60)
+        admins = oracle.register('u_t_admins')
+        ok_(admins.contains('fox'))
+        ok_(oracle.contains('u_t_admins', 'imf@washington.edu'))
+        ok_(not admins.contains('pass'))
+        # as the live check, case does not matter
+        ok_(admins.contains('Fox'))
+        eq_((oracle.hits, oracle.fallbacks), (4, 0))
+
+        # unchanged: a 304 keeps the same names
+        names = admins.names
+        ok_(admins.etag is not None)
+        eq_(oracle.refresh(force=True), 1)
+        ok_(admins.names is names)
+        set_members('pass')
+        oracle.refresh(force=True)
+        ok_(admins.contains('pass') and not admins.contains('fox'))
+
+        # stale and unregistered groups are checked live
+        admins.loaded -= 120
+        ok_(not admins.contains('pass'))
+        ok_(not oracle.contains('u_fox_unittest', 'fox'))
+        eq_(oracle.fallbacks, 2)
+        oracle.live_fallback = False
+        assert_raises(LookupError, oracle.contains, 'u_t_admins', 'pass')
+
+        # the background refresh brings it back
+        oracle.refresh_interval = 0.01
+        oracle.start()
+        try:
+            for n in range(100):
+                if admins.is_fresh():
+                    break
+                time.sleep(0.01)
+        finally:
+            oracle.stop()
+        ok_(admins.contains('pass'))
+        eq_(oracle.register('u_t_gone').error.status, 404)
+        assert_raises(LookupError, oracle.contains, 'u_t_gone', 'pass')
+
+    def test_batch_membership(self):
+        path = tempfile.mkdtemp()
+        try:
+            generate(path, persons=100, groups=20, seed=9)
+            gen = DatasetGenerator(persons=100, groups=20, seed=9)
+            conf = copy.copy(settings.GWS_CONF)
+            conf['MOCK_ROOT'] = path
+            gws = GWS(conf)
+            name = gen.group_name(4)
+            members = set(m.name for m in gws.get_effective_members(name))
+            netids = [gen.person(n).uwnetid for n in range(30)]
+
+            for strategy in ('point', 'fetch'):
+                result = gws.is_effective_member_many(name, netids, strategy=strategy)
+                eq_(result.strategy, strategy)
+                eq_([c.netid for c in result], netids)
+                eq_([c.is_member for c in result], [netid in members for netid in netids])
+            eq_(gws.is_effective_member_many(name, netids).strategy, 'fetch')
+            eq_(gws.is_effective_member_many(name, netids[:3]).strategy, 'point')
+
+            netid = sorted(members)[0]
+            groups = [gen.group_name(n) for n in range(20)] + ['u_nobody_here']
+            expected = [gws.is_effective_member(g, netid) for g in groups[:-1]] + [False]
+            for strategy in ('point', 'search'):
+                result = gws.member_of_any(netid, groups, strategy=strategy)
+                ok_(result)
+                eq_([c.is_member for c in result], expected)
+            ok_(not gws.member_of_any('nobody', groups[:3]))
+            eq_([c.is_member for c in gws.member_of_any(netid, (g for g in groups), strategy='search')], expected)
+            # netids are not case sensitive
+            result = gws.is_effective_member_many(name, [n.upper() for n in netids], strategy='fetch')
+            eq_([c.is_member for c in result], [netid in members for netid in netids])
+            failed = gws.is_effective_member_many('u_nobody_here', ['a'] * 10)
+            ok_(failed.checks[0].error is not None and failed.checks[0].is_member is None)
+        finally:
+            shutil.rmtree(path)
+
+    def test_compact_members(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['GWS_COMPACT'] = True
+        members = GWS(conf).get_members('u_fox_unittest')
+        ok_(isinstance(members, CompactMemberList))
+        eq_(members.names(), ['fox', 'imf', 'pass'])
+        eq_([(m.name, m.member_type) for m in members],
+            [(m.name, m.member_type) for m in self.gws.get_members('u_fox_unittest')])
+        eq_(members[-1].name, 'pass')
+        eq_([m.name for m in members[1:]], ['imf', 'pass'])
+        ok_('imf' in members and GroupMember('imf', 'uwnetid') in members)
+        ok_(GroupMember('imf', 'eppn') not in members and 'nobody' not in members)
+
+        other = CompactMemberList([('pass', 'uwnetid'), (u'j\xf6rg', 'eppn'), ('fox', 'group'), ('x', 'newtype')])
+        eq_(other[1].name, u'j\xf6rg')
+        eq_(other[3].member_type, 'newtype')
+        ok_(u'j\xf6rg' in other)
+        eq_(members.difference(other).names(), ['fox', 'imf'])
+        eq_(members.intersection(other).keys(), set([('pass', 'uwnetid')]))
+        eq_(members.difference([GroupMember('fox', 'uwnetid')]).names(), ['imf', 'pass'])
+
+    def test_get_groups_by_ids(self):
+        ids = ['course_2015spr-phys114a', 'u_fox_unittest', 'u_t_gone', 'course_2015spr-phys114a']
+        groups = self.gws.get_groups_by_ids(ids, max_workers=3)
+        eq_(groups.keys(), ['course_2015spr-phys114a', 'u_fox_unittest', 'u_t_gone'])
+        eq_(groups['course_2015spr-phys114a'].curriculum_abbr, 'PHYS')
+        eq_(groups['u_fox_unittest'].name, 'u_fox_unittest')
+        ok_(isinstance(groups['u_t_gone'], DataFailureException))
+        eq_(groups['u_t_gone'].status, 404)
+
+        ready = self.gws.get_groups_by_ids(ids, as_ready=True)
+        eq_(sorted(group_id for group_id, group in ready), sorted(groups))
+        eq_(self.gws.get_groups_by_ids(group_id for group_id in ids).keys(), groups.keys())
+        eq_(self.gws.get_groups_by_ids([]), {})
+
+        # a caller that stops early stops the reads
+        gws = GWS(copy.copy(settings.GWS_CONF))
+        read = []
+
+        def slow_read(group_id):
+            read.append(group_id)
+            time.sleep(0.02)
+            return group_id, None
+        gws._group_or_error = slow_read
+        ready = gws.get_groups_by_ids(['u_t_%d' % n for n in range(50)], max_workers=1, as_ready=True)
+        next(ready)
+        ready.close()
+        count = len(read)
+        time.sleep(0.1)
+        ok_(len(read) <= count + 1 and count < 50)
+        assert_raises(InvalidGroupID, self.gws.get_groups_by_ids, ['u_fox_unittest', 'bad id'])
+
+    def test_group_catalog(self):
+        catalog = GroupCatalog(self.gws, max_age=60)
+        eq_(catalog.crawl(stem='u_fox_unittest'), 5)
+        eq_([g.name for g in catalog.search_groups(stem='u_fox_unittest', scope='one')],
+            ['u_fox_unittest', 'u_fox_unittest_sub6', 'u_fox_unittest_sub7', 'u_fox_unittest_test214'])
+        eq_([g.name for g in catalog.search_groups(stem='u_fox_unittest', name='sub*')],
+            ['u_fox_unittest_sub1_sub11', 'u_fox_unittest_sub6', 'u_fox_unittest_sub7'])
+        eq_([g.name for g in catalog.search_groups(name='u_fox_unittest_sub1', limit=1)], ['u_fox_unittest_sub1_sub11'])
+        eq_([g.name for g in catalog.search_groups(name='u_fox_unittest_sub1', stem=None)],
+            ['u_fox_unittest_sub1_sub11'])
+        eq_((catalog.local, catalog.remote), (4, 0))
+
+        # searches it cannot answer go to GWS; name searches are kept
+        eq_(len(catalog.search_groups(name='2015spr-phys*1', stem='course')), 199)
+        eq_(len(catalog.search_groups(name='2015spr-phys*1', stem='course')), 199)
+        eq_(len(catalog.search_groups(member='javerage', stem=None)), 24)
+        eq_((catalog.local, catalog.remote), (5, 2))
+        assert_raises(ValueError, catalog.crawl, member='javerage')
+
+        eq_(len(catalog.courses(curriculum='phys', quarter='spr', year=2015)), 199)
+        group = catalog.get_group_by_id('course_2015spr-phys114a')
+        eq_([g.name for g in catalog.courses(sln=group.sln)], ['course_2015spr-phys114a'])
+        eq_([g.name for g in catalog.courses(number='114', section='a')], ['course_2015spr-phys114a'])
+
+        # refresh drops what the crawl no longer returns
+        ghost = GroupReference()
+        ghost.name = 'u_fox_unittest_ghost'
+        catalog.add(ghost)
+        ok_('u_fox_unittest_ghost' in catalog)
+        eq_(catalog.refresh(), 0)
+        eq_(catalog.refresh(force=True), 2)
+        ok_('u_fox_unittest_ghost' not in catalog)
+        catalog.remove('u_fox_unittest_sub6')
+        eq_(len(catalog.search_groups(stem='u_fox_unittest')), 4)
+
+        # stale crawls do not answer
+        for key, (query, kwargs, when) in catalog._crawls.items():
+            catalog._crawls[key] = (query, kwargs, when - 120)
+        eq_(len(catalog.search_groups(stem='u_fox_unittest')), 5)
+        eq_(catalog.remote, 3)
+
+    def test_group_catalog_coverage(self):
+        ok_(_Query('sub', 'u_fox_unittest', 'one').covers(_Query('sub6', 'u_fox_unittest', 'one')))
+        ok_(_Query(None, 'u_fox_unittest', 'one').covers(_Query('s*7', 'u_fox_unittest', 'one')))
+        # an inner wildcard does not match every name with the prefix
+        ok_(not _Query('s*7', 'u_fox_unittest', 'one').covers(_Query('sub6', 'u_fox_unittest', 'one')))
+        ok_(not _Query('s*7', 'u_fox_unittest').covers(_Query('sub6', 'u_fox_unittest')))
+        ok_(not _Query(None, 'u_fox_unittest', 'one').covers(_Query('sub1_sub11', 'u_fox_unittest')))
+        ok_(_Query(None, 'u_fox_unittest').covers(_Query('sub6', 'u_fox_unittest', 'one')))
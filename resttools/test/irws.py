@@ -1,8 +1,11 @@
+import copy
 import json
 import logging
 from nose.tools import *
 
 from resttools.irws import IRWS
+from resttools.identity_index import IdentityIndex
+from resttools.dao_implementation.mock import MockStore
 
 import resttools.test.test_settings as settings
 import logging.config
@@ -88,3 +91,61 @@ class IRWS_Test():
         eq_(g.contact_email, 'legacyemail@example.com')
         eq_(g.category_code, '1')
         eq_(g.source_code, '2')
+
+    def _indexed_irws(self):
+        conf = copy.copy(settings.IRWS_CONF)
+        conf['IDENTITY_INDEX'] = True
+        return IRWS(conf)
+
+    def test_identity_index_translation(self):
+        irws = self._indexed_irws()
+        irws.get_uwnetid(regid='DC5C0C166A7C11D5A4AE0004AC494FFE', status=30)
+        # no mock data for this query: must be answered by the index
+        netids = irws.get_uwnetid(netid='junk4', status=30, ret_array=True)
+        eq_(len(netids), 2)
+        eq_(netids[0].uwnetid, 'lucy123wf')
+        eq_(netids[1].uid, '-2')
+        eq_(irws.get_uwnetid(netid='junk4', status=31), None)
+
+        # off by default
+        self.irws.get_uwnetid(regid='DC5C0C166A7C11D5A4AE0004AC494FFE', status=30)
+        eq_(self.irws.get_uwnetid(netid='junk4', status=30), None)
+
+    def test_identity_index_person(self):
+        irws = self._indexed_irws()
+        person = irws.get_person(netid='wdspud867')
+        eq_(irws._index.resolve(netid='WDSPUD867'), person.regid)
+        person.identifiers['hepps'] = 'changed'
+        person = irws.get_person(netid='wdspud867')
+        eq_(person.identifiers['hepps'], '/person/hepps/867003233')
+
+        # writes drop the entity's records
+        ok_(irws._index.get_person(netid='wdspud867') is not None)
+        irws._index.forget(netid='wdspud867')
+        eq_(irws._index.get_person(netid='wdspud867'), None)
+        eq_(irws._index.resolve(netid='wdspud867'), person.regid)
+        index = IdentityIndex()
+        index.link('regid1', source='1', eid='123')
+        index.add_regid(type('R', (), {'regid': 'regid1'})())
+        index.forget(eid='123')
+        eq_(index.get_regid(regid='regid1'), None)
+
+    def test_identity_index_bounds(self):
+        index = IdentityIndex(ttl=300, max_size=2)
+        index.link('regid1', netid='netid1')
+        eq_(index.resolve(netid='netid1'), 'regid1')
+        index.link('regid2', netid='netid2')
+        eq_(index.resolve(netid='netid1'), None)
+        eq_(index.resolve(regid='regid2'), 'regid2')
+        index = IdentityIndex(ttl=-1)
+        index.link('regid1', netid='netid1')
+        eq_(index.resolve(netid='netid1'), None)
+
+    def test_put_then_get_recover_info(self):
+        conf = copy.copy(settings.IRWS_CONF)
+        conf['MOCK_STORE'] = MockStore()
+        irws = IRWS(conf)
+        eq_(irws.put_pw_recover_email('bill', 'bill@example.com', '2016-01-01'), 200)
+        profile = irws.get_pw_recover_info('bill')
+        eq_(profile.recover_email, 'bill@example.com')
+        eq_(IRWS(settings.IRWS_CONF).get_pw_recover_info('bill'), None)
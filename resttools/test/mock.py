@@ -0,0 +1,288 @@
+import os
+import copy
+import json
+import time
+import shutil
+import tempfile
+import threading
+import logging
+from nose.tools import *
+
+from resttools.dao_implementation.mock import get_mockdata_url, MockIndex
+from resttools.dao_implementation.mock import MockArchive, build_mock_archive
+from resttools.dao_implementation.mock import MockStore, put_mockdata_url, delete_mockdata_url
+from resttools.mock.mock_http import MappedMockHTTP
+from resttools.mock.generate import generate, DatasetGenerator
+from resttools.mock.replay import LogReplay, read_log, percentile
+from resttools.dao_implementation.faults import FaultProfile
+from resttools.exceptions import DataFailureException
+from resttools.gws import GWS
+from resttools.irws import IRWS
+from urllib3.exceptions import ProtocolError
+
+import resttools.test.test_settings as settings
+import logging.config
+logging.config.dictConfig(settings.LOGGING)
+logger = logging.getLogger(__name__)
+
+
+class Mock_Test():
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.conf = copy.copy(settings.GWS_CONF)
+        self.conf['MOCK_PRELOAD'] = True
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+
+    def _write(self, name, data):
+        path = os.path.join(self.path, 'gws', name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def test_preload_matches_files(self):
+        urls = ['/group_sws/v2/group/u_fox_unittest',
+                '/group_sws/v2/group/u_fox_unittest/member',
+                '/group_sws/v2/group/course_2015spr-phys114a/member',
+                '/group_sws/v2/search?member=javerage',
+                '/group_sws/v2/group/nonexistent']
+        for url in urls:
+            file_response = get_mockdata_url('gws', settings.GWS_CONF, url, {})
+            index_response = get_mockdata_url('gws', self.conf, url, {})
+            eq_(index_response.status, file_response.status)
+            eq_(index_response.data, file_response.data)
+            eq_(index_response.headers, file_response.headers)
+        eq_(get_mockdata_url('gws', self.conf, urls[2], {}).status, 403)
+
+    def test_index_overrides_and_strips(self):
+        self._write('group_sws/v2/group/u_fox_unittest.resource', 'comment\nMOCKDATA-MOCKDATA-MOCKDATA\n<gws/>')
+        std_root = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'mock', 'gws')
+        index = MockIndex('gws', [os.path.join(self.path, 'gws'), std_root])
+        eq_(index.lookup('/group_sws/v2/group/u_fox_unittest.resource').data, '<gws/>')
+        # bundled data is still served
+        eq_(index.lookup('/group_sws/v2/group/u_fox_browser6/member').status, 200)
+
+    def test_index_reload(self):
+        self._write('group_sws/v2/group/g1', 'one')
+        index = MockIndex('gws', [os.path.join(self.path, 'gws')], reload=True)
+        eq_(index.lookup('/group_sws/v2/group/g1').data, 'one')
+        eq_(index.lookup('/group_sws/v2/group/g2'), None)
+        self._write('group_sws/v2/group/g1', 'two')
+        os.utime(os.path.join(self.path, 'gws/group_sws/v2/group/g1'), (0, 0))
+        self._write('group_sws/v2/group/g2', 'new')
+        eq_(index.lookup('/group_sws/v2/group/g1').data, 'two')
+        eq_(index.lookup('/group_sws/v2/group/g2').data, 'new')
+
+    def test_archive(self):
+        archive_path = os.path.join(self.path, 'mock.zip')
+        count = build_mock_archive(settings.MOCK_ROOT, archive_path, services=['gws', 'irws'])
+        archive = MockArchive(archive_path)
+        eq_(len(archive), count)
+        conf = copy.copy(settings.GWS_CONF)
+        conf['MOCK_ARCHIVE'] = archive_path
+        urls = ['/group_sws/v2/group/u_fox_unittest',
+                '/group_sws/v2/group/course_2015spr-phys114a/member',
+                '/group_sws/v2/search?member=javerage']
+        for url in urls:
+            file_response = get_mockdata_url('gws', settings.GWS_CONF, url, {})
+            archive_response = get_mockdata_url('gws', conf, url, {})
+            eq_(archive_response.status, file_response.status)
+            eq_(archive_response.data, file_response.data)
+            eq_(archive_response.headers, file_response.headers)
+        eq_(archive.lookup('irws', '/registry-dev/v1/regid?uwnetid=joeuser').status, 200)
+        eq_(archive.lookup('nws', '/nws/v1/uwnetid/groups/admin'), None)
+
+    def test_mmap_large_fixtures(self):
+        body = '<gws>' + 'x' * 4096 + '</gws>'
+        self._write('group_sws/v2/group/big/effective_member', 'big\nMOCKDATA-MOCKDATA-MOCKDATA\n' + body)
+        self._write('group_sws/v2/group/small', 'small')
+        index = MockIndex('gws', [os.path.join(self.path, 'gws')], mmap_threshold=1024)
+        response = index.lookup('/group_sws/v2/group/big/effective_member')
+        ok_(isinstance(response, MappedMockHTTP))
+        eq_(response.data, body)
+        eq_(str(response.buffer()), body)
+        ok_(not isinstance(index.lookup('/group_sws/v2/group/small'), MappedMockHTTP))
+
+        archive_path = os.path.join(self.path, 'mock.zip')
+        build_mock_archive(self.path, archive_path)
+        archive = MockArchive(archive_path, mmap_threshold=1024)
+        response = archive.lookup('gws', '/group_sws/v2/group/big/effective_member')
+        ok_(isinstance(response, MappedMockHTTP))
+        eq_(response.read(), body)
+        eq_(archive.lookup('gws', '/group_sws/v2/group/small').data, 'small')
+
+    def test_fault_profile_seeded(self):
+        def statuses(seed):
+            conf = copy.copy(settings.GWS_CONF)
+            conf['MOCK_PROFILE'] = FaultProfile(errors={500: 0.2, 503: 0.2}, seed=seed)
+            gws = GWS(conf)
+            ret = []
+            for n in range(40):
+                try:
+                    gws.get_group_by_id('u_fox_unittest')
+                    ret.append(200)
+                except DataFailureException as e:
+                    ret.append(e.status)
+            return ret
+        first = statuses(7)
+        eq_(first, statuses(7))
+        ok_(500 in first and 503 in first and 200 in first)
+
+    def test_fault_profile_latency(self):
+        slept = []
+        conf = copy.copy(settings.GWS_CONF)
+        conf['MOCK_PROFILE'] = FaultProfile(latency={'dist': 'fixed', 'value': 0.01},
+                                            trickle={'chunk_size': 1024, 'delay': 0.5},
+                                            urls=[(r'/member$', {'reset_rate': 1.0})],
+                                            sleep=slept.append)
+        gws = GWS(conf)
+        group = gws.get_group_by_id('u_fox_unittest')
+        eq_(slept[0], 0.01)
+        eq_(slept[1:], [0.5] * 3)
+        assert_raises(ProtocolError, gws.get_members, 'u_fox_unittest')
+
+    def test_fault_profile_longtail(self):
+        profile = FaultProfile(latency={'dist': 'longtail', 'median': 0.01, 'sigma': 1.5, 'max': 1.0}, seed=3)
+        delays = sorted(profile._latency(profile.rule_for('GET', '/')['latency']) for n in range(1000))
+        ok_(0.005 < delays[500] < 0.02)
+        ok_(delays[990] > 5 * delays[500])
+        ok_(delays[-1] <= 1.0)
+
+    def test_store_etags(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['MOCK_STORE'] = MockStore()
+        url = '/group_sws/v2/group/u_fox_unittest'
+        eq_(put_mockdata_url('gws', conf, url + '_new', {'If-Match': '*'}, '<a/>').status, 412)
+        created = put_mockdata_url('gws', conf, url + '_new', {'If-None-Match': '*'}, '<a/>')
+        eq_(created.status, 201)
+        eq_(put_mockdata_url('gws', conf, url + '_new', {'If-None-Match': '*'}, '<b/>').status, 412)
+        etag = created.headers['ETag']
+        updated = put_mockdata_url('gws', conf, url + '_new', {'If-Match': etag}, '<b/>')
+        eq_(updated.status, 200)
+        ok_(updated.headers['ETag'] != etag)
+        eq_(put_mockdata_url('gws', conf, url + '_new', {'If-Match': etag}, '<c/>').status, 412)
+        eq_(get_mockdata_url('gws', conf, url + '_new', {}).data, '<b/>')
+        # mock data files count as existing resources
+        eq_(put_mockdata_url('gws', conf, url, {'If-Match': '*'}, '<d/>').status, 200)
+        eq_(get_mockdata_url('gws', conf, url, {}).data, '<d/>')
+        ok_(get_mockdata_url('gws', settings.GWS_CONF, url, {}).data != '<d/>')
+
+    def test_store_delete(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['MOCK_STORE'] = MockStore()
+        gws = GWS(conf)
+        url = '/group_sws/v2/group/u_fox_unittest'
+        body = get_mockdata_url('gws', conf, url, {}).data
+        eq_(put_mockdata_url('gws', conf, url + '-copy', {'Content-Type': 'text/xml'}, body).status, 201)
+        eq_(gws.get_group_by_id('u_fox_unittest-copy').uwregid, gws.get_group_by_id('u_fox_unittest').uwregid)
+        ok_(gws.delete_group('u_fox_unittest-copy'))
+        ok_(gws.delete_group('u_fox_unittest'))
+        for group_id in ('u_fox_unittest-copy', 'u_fox_unittest'):
+            with assert_raises(DataFailureException) as cm:
+                gws.get_group_by_id(group_id)
+            eq_(cm.exception.status, 404)
+        eq_(delete_mockdata_url('gws', conf, url, {}).status, 404)
+
+    def test_store_threads(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['MOCK_STORE'] = MockStore()
+        url = '/group_sws/v2/group/counter'
+        put_mockdata_url('gws', conf, url, {}, '0')
+        failed = []
+
+        def worker():
+            # optimistic increments: retry on 412 until our write wins
+            for n in range(20):
+                while True:
+                    current = get_mockdata_url('gws', conf, url, {})
+                    value = str(int(current.data) + 1)
+                    response = put_mockdata_url('gws', conf, url, {'If-Match': current.headers['ETag']}, value)
+                    if response.status == 200:
+                        break
+                    if response.status != 412:
+                        failed.append(response.status)
+                        return
+
+        threads = [threading.Thread(target=worker) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        eq_(failed, [])
+        eq_(get_mockdata_url('gws', conf, url, {}).data, '160')
+
+    def test_generated_dataset(self):
+        generate(self.path, persons=300, groups=40, seed=5, nest_rate=0.3)
+        gen = DatasetGenerator(persons=300, groups=40, seed=5)
+        gws_conf = copy.copy(settings.GWS_CONF)
+        gws_conf['MOCK_ROOT'] = self.path
+        irws_conf = copy.copy(settings.IRWS_CONF)
+        irws_conf['MOCK_ROOT'] = self.path
+        gws = GWS(gws_conf)
+        irws = IRWS(irws_conf)
+
+        nested = 0
+        for index in range(40):
+            name = gen.group_name(index)
+            eq_(gws.get_group_by_id(name).uwregid, gen.group_regid(index))
+            members = gws.get_members(name)
+            effective = gws.get_effective_members(name)
+            eq_(gws.get_effective_member_count(name), len(effective))
+            netids = [m.name for m in members if m.member_type == 'uwnetid']
+            ok_(set(netids) <= set(m.name for m in effective))
+            if len(netids) < len(members):
+                nested += 1
+            ok_(gws.is_effective_member(name, effective[0].name))
+            eq_([m.name for m in gws.get_effective_members(name, limit=2, offset=1)],
+                [m.name for m in effective[1:3]])
+            # members are registry persons
+            person = irws.get_person(netid=effective[0].name)
+            eq_(irws.get_uwnetid(regid=person.regid).uwnetid, effective[0].name)
+            ok_(name in [g.name for g in gws.search_groups(member=effective[0].name, type='effective')])
+        ok_(nested > 0)
+
+        netid = gen.person(7).uwnetid
+        eq_(irws.get_regid(netid=netid).regid, gen.person(7).regid)
+        eq_(irws.get_name_by_netid(netid).display_lname, gen.person(7).lname)
+
+    def test_generated_archive(self):
+        archive_path = os.path.join(self.path, 'gen.zip')
+        eq_(generate(archive_path, archive=True, persons=50, groups=5, seed=2),
+            generate(os.path.join(self.path, 'tree'), persons=50, groups=5, seed=2))
+        conf = copy.copy(settings.GWS_CONF)
+        conf['MOCK_ARCHIVE'] = archive_path
+        name = DatasetGenerator(persons=50, groups=5, seed=2).group_name(3)
+        tree = get_mockdata_url('gws', dict(settings.GWS_CONF, MOCK_ROOT=os.path.join(self.path, 'tree')),
+                                '/group_sws/v2/group/%s/effective_member' % name, {})
+        eq_(get_mockdata_url('gws', conf, '/group_sws/v2/group/%s/effective_member' % name, {}).data, tree.data)
+
+    def test_replay(self):
+        log = os.path.join(self.path, 'calls.log')
+        with open(log, 'w') as f:
+            for n in range(20):
+                f.write(json.dumps({'ts': 1000 + n * 0.01, 'service': 'gws', 'method': 'is_effective_member',
+                                    'args': ['u_fox_unittest', 'javerage']}) + '\n')
+                f.write(json.dumps({'ts': 1000 + n * 0.01, 'service': 'irws', 'method': 'get_person',
+                                    'kwargs': {'netid': 'javerage'}}) + '\n')
+            f.write(json.dumps({'ts': 1000.2, 'service': 'gws', 'method': 'get_group_by_id',
+                                'args': ['u_nobody_here']}) + '\n')
+        confs = {'gws': settings.GWS_CONF, 'irws': settings.IRWS_CONF}
+        start = time.time()
+        report = LogReplay(confs, speed=1.0, concurrency=4).run(read_log(log))
+        # paced: the log spans 0.2s
+        ok_(time.time() - start >= 0.2)
+        stats = report.stats()
+        eq_(stats['gws.is_effective_member']['count'], 20)
+        eq_(stats['irws.get_person']['errors'], 0)
+        eq_(stats['gws.get_group_by_id']['errors'], 1)
+        eq_(stats['all']['count'], 41)
+        ok_(stats['all']['p50'] <= stats['all']['p99'] <= stats['all']['max'])
+        ok_('gws.is_effective_member' in report.format())
+
+        fast = LogReplay(confs, speed=0, concurrency=4).run(read_log(log))
+        eq_(fast.stats()['all']['count'], 41)
+        eq_(percentile(range(1, 101), 99), 99)
+        eq_(percentile([5], 50), 5)
@@ -0,0 +1,223 @@
+import os
+import copy
+import time
+import ssl
+import socket
+import httplib
+import shutil
+import tempfile
+import logging
+from nose.tools import *
+
+from resttools.gws import GWS
+from resttools.nws import NWS
+from resttools.exceptions import DataFailureException
+from resttools.mock.server import MockServer
+from resttools.dao_implementation.gws import Live as GWSLive
+from resttools.dao_implementation.nws import Live as NWSLive
+from resttools.dao_implementation.record import Recorder
+from resttools.dao_implementation.mock import MockStore
+from resttools.dao_implementation.faults import FaultProfile
+from resttools.models.gws import GroupMember
+from urllib3.exceptions import MaxRetryError, ProtocolError
+
+import resttools.test.test_settings as settings
+import logging.config
+logging.config.dictConfig(settings.LOGGING)
+logger = logging.getLogger(__name__)
+
+
+def _live_conf(conf, server):
+    conf = copy.copy(conf)
+    conf.update({'RUN_MODE': 'Live', 'HOST': server.url,
+                 'KEY_FILE': None, 'CERT_FILE': None, 'CA_FILE': None})
+    return conf
+
+
+class Server_Test():
+
+    def setup(self):
+        self.gws_server = MockServer('gws', settings.GWS_CONF)
+        self.gws_server.start()
+        self.nws_server = MockServer('nws', settings.NWS_CONF)
+        self.nws_server.start()
+        # the Live pools are per class; start from fresh ones
+        GWSLive.pool = None
+        NWSLive.pool = None
+        self.path = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+        self.gws_server.stop()
+        self.nws_server.stop()
+        GWSLive.pool = None
+        NWSLive.pool = None
+
+    def test_live_gws(self):
+        gws = GWS(_live_conf(settings.GWS_CONF, self.gws_server))
+        group = gws.get_group_by_id('u_fox_unittest')
+        eq_(group.name, 'u_fox_unittest')
+        eq_(len(gws.search_groups(member='javerage')), 24)
+        eq_(len(gws.get_members('u_fox_unittest')), 3)
+        # status from the .http-headers file
+        assert_raises(DataFailureException, gws.get_members, 'course_2015spr-phys114a')
+        assert_raises(DataFailureException, gws.get_group_by_id, 'u_nobody_here')
+
+    def test_head(self):
+        host, port = self.gws_server.server_address
+        con = httplib.HTTPConnection(host, port, timeout=5)
+        con.request('HEAD', '/group_sws/v2/group/u_fox_unittest')
+        response = con.getresponse()
+        eq_(response.status, 200)
+        ok_(int(response.getheader('Content-Length')) > 0)
+        eq_(response.read(), '')
+        # the connection is still usable: no body was sent after all
+        con.request('GET', '/group_sws/v2/group/u_fox_unittest')
+        eq_(len(con.getresponse().read()), int(response.getheader('Content-Length')))
+        con.close()
+
+    def test_tls_client_certs(self):
+        tls = os.path.join(os.path.dirname(__file__), 'test_data', 'tls')
+        server = MockServer('gws', settings.GWS_CONF, certfile=os.path.join(tls, 'server.crt'),
+                            keyfile=os.path.join(tls, 'server.key'), ca_certs=os.path.join(tls, 'ca.crt'))
+        server.start()
+        try:
+            ok_(server.url.startswith('https://'))
+            port = server.server_address[1]
+
+            def get(certfile=None):
+                context = ssl.create_default_context(cafile=os.path.join(tls, 'ca.crt'))
+                if certfile is not None:
+                    context.load_cert_chain(os.path.join(tls, certfile + '.crt'), os.path.join(tls, certfile + '.key'))
+                # the certificate names localhost; python 2 does not match IP addresses
+                con = httplib.HTTPSConnection('localhost', port, timeout=5, context=context)
+                try:
+                    con.request('GET', '/group_sws/v2/group/u_fox_unittest')
+                    return con.getresponse().status
+                finally:
+                    con.close()
+
+            eq_(get('client'), 200)
+            # no client certificate: the handshake is refused
+            assert_raises((ssl.SSLError, socket.error), get)
+        finally:
+            server.stop()
+
+    def test_trickled_body(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['MOCK_PROFILE'] = FaultProfile(trickle={'chunk_size': 256, 'delay': 0.05})
+        server = MockServer('gws', conf)
+        server.start()
+        try:
+            host, port = server.server_address
+            con = httplib.HTTPConnection(host, port, timeout=5)
+            con.request('GET', '/group_sws/v2/group/u_fox_unittest')
+            response = con.getresponse()
+            length = int(response.getheader('Content-Length'))
+            ok_(length > 3 * 256)
+            start = time.time()
+            eq_(len(response.read(256)), 256)
+            body = response.read()
+            # the rest came a chunk at a time
+            ok_(time.time() - start >= 0.05 * ((length - 1) // 256) - 0.01)
+            eq_(256 + len(body), length)
+            con.close()
+
+            # a read timeout shorter than the delay fails part way through
+            con = httplib.HTTPConnection(host, port, timeout=5)
+            con.request('GET', '/group_sws/v2/group/u_fox_unittest')
+            response = con.getresponse()
+            response.fp._sock.settimeout(0.01)
+            assert_raises(socket.timeout, response.read)
+            con.close()
+        finally:
+            server.stop()
+
+    def test_injected_reset(self):
+        conf = copy.copy(settings.GWS_CONF)
+        conf['MOCK_PROFILE'] = FaultProfile(reset_rate=1.0)
+        server = MockServer('gws', conf)
+        server.start()
+        try:
+            gws = GWS(_live_conf(settings.GWS_CONF, server))
+            # the client sees the connection reset, not a 500
+            with assert_raises(MaxRetryError) as cm:
+                gws.get_group_by_id('u_fox_unittest')
+            ok_(isinstance(cm.exception.reason, ProtocolError))
+            ok_('reset' in str(cm.exception.reason))
+        finally:
+            server.stop()
+
+    def test_live_put_members_chunked(self):
+        store = MockStore()
+        server = MockServer('gws', dict(settings.GWS_CONF, MOCK_STORE=store))
+        server.start()
+        try:
+            gws = GWS(_live_conf(settings.GWS_CONF, server))
+            members = (GroupMember('user%d' % n, 'uwnetid') for n in range(5000))
+            eq_(gws.put_members('u_fox_unittest', members), [])
+        finally:
+            server.stop()
+        stored = store.get('gws', '/group_sws/v2/group/u_fox_unittest/member')
+        eq_(stored['data'].count('<member class="member"'), 5000)
+
+    def test_live_nws(self):
+        nws = NWS(_live_conf(settings.NWS_CONF, self.nws_server))
+        eq_(nws.get_netid_pwinfo('groups').min_len, 8)
+        eq_(len(nws.get_netid_admins('groups')), 3)
+
+    def _record_session(self, conf):
+        gws = GWS(conf)
+        gws.get_group_by_id('u_fox_unittest')
+        gws.get_members('u_fox_unittest')
+        gws.search_groups(member='javerage')
+        assert_raises(DataFailureException, gws.get_members, 'course_2015spr-phys114a')
+        assert_raises(DataFailureException, gws.get_group_by_id, 'u_nobody_here')
+
+    def _check_replay(self, conf):
+        gws = GWS(conf)
+        group = gws.get_group_by_id('u_fox_unittest')
+        eq_(group.name, 'u_fox_unittest')
+        eq_(group.contact, 'nobody')
+        eq_(len(gws.get_members('u_fox_unittest')), 3)
+        eq_(len(gws.search_groups(member='javerage')), 24)
+        for call, arg, status in ((gws.get_members, 'course_2015spr-phys114a', 403),
+                                  (gws.get_group_by_id, 'u_nobody_here', 404)):
+            with assert_raises(DataFailureException) as cm:
+                call(arg)
+            eq_(cm.exception.status, status)
+        # only the recording answers: this is in the bundled mock data
+        with assert_raises(DataFailureException) as cm:
+            gws.get_group_by_id('u_fox_browser6')
+        eq_(cm.exception.status, 404)
+
+    def test_record_tree(self):
+        conf = _live_conf(settings.GWS_CONF, self.gws_server)
+        conf['RUN_MODE'] = 'Record'
+        conf['RECORD_ROOT'] = os.path.join(self.path, 'mock')
+        conf['RECORD_REDACT'] = [(r'>fox<', '>nobody<')]
+        self._record_session(conf)
+        # the group was recorded before its member dir: it moved to .resource
+        ok_(os.path.isfile(os.path.join(self.path, 'mock/gws/group_sws/v2/group/u_fox_unittest.resource')))
+
+        replay = copy.copy(settings.GWS_CONF)
+        replay['MOCK_ROOT'] = conf['RECORD_ROOT']
+        replay['MOCK_FALLBACK'] = False
+        replay['MOCK_PRELOAD'] = True
+        self._check_replay(replay)
+
+    def test_record_archive(self):
+        conf = _live_conf(settings.GWS_CONF, self.gws_server)
+        conf['RUN_MODE'] = 'Record'
+        conf['RECORDER'] = Recorder(archive=os.path.join(self.path, 'mock.zip'),
+                                    redact=[(r'>fox<', '>nobody<')])
+        self._record_session(conf)
+        conf['RECORDER'].close()
+        eq_(conf['RECORDER'].count, 5)
+        assert_raises(ValueError, GWS(conf).get_group_by_id, 'u_fox_unittest')
+
+        replay = copy.copy(settings.GWS_CONF)
+        replay['MOCK_ROOT'] = self.path
+        replay['MOCK_FALLBACK'] = False
+        replay['MOCK_ARCHIVE'] = os.path.join(self.path, 'mock.zip')
+        self._check_replay(replay)
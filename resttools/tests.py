@@ -7,3 +7,6 @@ import resttools.test.test_settings as settings
 from resttools.test.irws import IRWS_Test
 from resttools.test.nws import NWS_Test
 from resttools.test.gws import GWS_Test
+from resttools.test.cache import Cache_Test
+from resttools.test.mock import Mock_Test
+from resttools.test.server import Server_Test